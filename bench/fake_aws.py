@@ -0,0 +1,324 @@
+"""
+Synthetic, in-process stand-ins for the EC2, IAM, RDS and S3 clients the
+tools use, with a configurable per-call latency and per-operation call
+counters. Only the operations and response fields the tools read exist.
+"""
+import threading
+import time
+from collections import Counter
+
+SSM_POLICY = {'PolicyName': 'AmazonSSMManagedInstanceCore',
+              'PolicyArn': 'arn:aws:iam::aws:policy/'
+                           'AmazonSSMManagedInstanceCore'}
+
+
+class CallStats:
+    """Thread-safe count of API calls per service and operation."""
+
+    def __init__(self):
+        self.calls = Counter()
+        self.lock = threading.Lock()
+
+    def record(self, service, operation):
+        with self.lock:
+            self.calls[f'{service}:{operation}'] += 1
+
+    def total(self):
+        with self.lock:
+            return sum(self.calls.values())
+
+
+class FakePaginator:
+    """Paginator over a list returned by items(**params), page by page."""
+
+    def __init__(self, client, operation, key, items, page_size):
+        self.client = client
+        self.operation = operation
+        self.key = key
+        self.items = items
+        self.page_size = page_size
+
+    def paginate(self, PaginationConfig=None, **params):
+        page_size = (PaginationConfig or {}).get('PageSize', self.page_size)
+        items = self.items(**params)
+        for start in range(0, max(len(items), 1), page_size):
+            self.client.call(self.operation)
+            yield {self.key: items[start:start + page_size]}
+
+
+class FakeClient:
+    """Base client counting every call and sleeping `latency` seconds."""
+
+    service = None
+    paginators = {}
+
+    def __init__(self, fleet, stats, latency=0.0):
+        self.fleet = fleet
+        self.stats = stats
+        self.latency = latency
+
+    def call(self, operation):
+        self.stats.record(self.service, operation)
+        if self.latency:
+            time.sleep(self.latency)
+
+    def get_paginator(self, operation):
+        key, page_size = self.paginators[operation]
+        return FakePaginator(self, operation, key,
+                             getattr(self, f'_{operation}'), page_size)
+
+
+class FakeEC2(FakeClient):
+    service = 'ec2'
+    paginators = {'describe_instances': ('Reservations', 1000)}
+
+    def _describe_instances(self, Filters=None):
+        # One instance per reservation, as launched one at a time
+        instances = self.fleet.instances
+        for entry in Filters or []:
+            if entry['Name'] == 'iam-instance-profile.arn':
+                suffixes = tuple(value.lstrip('*')
+                                 for value in entry['Values'])
+                instances = [
+                    instance for instance in instances
+                    if instance.get('IamInstanceProfile', {}).get(
+                        'Arn', '').endswith(suffixes)
+                ]
+        return [{'Instances': [instance]} for instance in instances]
+
+    def describe_instances(self, **params):
+        self.call('describe_instances')
+        return {'Reservations': self._describe_instances(**params)}
+
+
+class FakeIAM(FakeClient):
+    service = 'iam'
+    paginators = {
+        'list_instance_profiles': ('InstanceProfiles', 100),
+        'list_attached_role_policies': ('AttachedPolicies', 100),
+        'get_account_authorization_details': ('RoleDetailList', 100),
+        'list_policies': ('Policies', 100),
+        'list_entities_for_policy': ('PolicyRoles', 100),
+        'list_instance_profiles_for_role': ('InstanceProfiles', 100),
+    }
+
+    def _list_instance_profiles(self):
+        return self.fleet.profiles
+
+    def _list_attached_role_policies(self, RoleName):
+        with self.fleet.lock:
+            return list(self.fleet.role_policies[RoleName])
+
+    def _get_account_authorization_details(self, Filter=None):
+        with self.fleet.lock:
+            return [
+                {'RoleName': profile['Roles'][0]['RoleName'],
+                 'InstanceProfileList': [profile],
+                 'AttachedManagedPolicies': list(self.fleet.role_policies[
+                     profile['Roles'][0]['RoleName']])}
+                for profile in self.fleet.profiles
+            ]
+
+    def _list_policies(self, OnlyAttached=False):
+        with self.fleet.lock:
+            arns = {policy['PolicyArn']: policy['PolicyName']
+                    for policies in self.fleet.role_policies.values()
+                    for policy in policies}
+        return [{'PolicyName': name, 'Arn': arn}
+                for arn, name in sorted(arns.items())]
+
+    def _list_entities_for_policy(self, PolicyArn, EntityFilter=None):
+        with self.fleet.lock:
+            return [{'RoleName': role_name}
+                    for role_name, policies in self.fleet.role_policies.items()
+                    if any(policy['PolicyArn'] == PolicyArn
+                           for policy in policies)]
+
+    def _list_instance_profiles_for_role(self, RoleName):
+        return [profile for profile in self.fleet.profiles
+                if profile['Roles'][0]['RoleName'] == RoleName]
+
+    def list_attached_role_policies(self, RoleName):
+        self.call('list_attached_role_policies')
+        return {'AttachedPolicies':
+                self._list_attached_role_policies(RoleName)}
+
+    def detach_role_policy(self, RoleName, PolicyArn):
+        self.call('detach_role_policy')
+        with self.fleet.lock:
+            self.fleet.role_policies[RoleName] = [
+                policy for policy in self.fleet.role_policies[RoleName]
+                if policy['PolicyArn'] != PolicyArn
+            ]
+
+
+class FakeRDS(FakeClient):
+    service = 'rds'
+    paginators = {
+        'describe_db_instances': ('DBInstances', 100),
+        'describe_db_clusters': ('DBClusters', 100),
+    }
+
+    def _describe_db_instances(self, Filters=None):
+        return filter_dbs(self.fleet.db_instances, Filters)
+
+    def _describe_db_clusters(self, Filters=None):
+        return filter_dbs(self.fleet.db_clusters, Filters)
+
+    def modify_db_instance(self, DBInstanceIdentifier, PubliclyAccessible,
+                           ApplyImmediately):
+        self.call('modify_db_instance')
+        self.fleet.db_index[DBInstanceIdentifier]['PubliclyAccessible'] = (
+            PubliclyAccessible)
+
+    def modify_db_cluster(self, DBClusterIdentifier, PubliclyAccessible,
+                          ApplyImmediately):
+        self.call('modify_db_cluster')
+        self.fleet.db_index[DBClusterIdentifier]['PubliclyAccessible'] = (
+            PubliclyAccessible)
+
+
+def filter_dbs(dbs, filters):
+    """Apply a db-instance-id/db-cluster-id filter like the RDS API."""
+    if not filters:
+        return dbs
+    wanted = set(filters[0]['Values'])
+    return [db for db in dbs
+            if (db.get('DBInstanceIdentifier')
+                or db.get('DBClusterIdentifier')) in wanted]
+
+
+class FakeS3(FakeClient):
+    service = 's3'
+
+    def list_buckets(self, MaxBuckets=10000, ContinuationToken=None):
+        self.call('list_buckets')
+        names = list(self.fleet.buckets)
+        start = int(ContinuationToken or 0)
+        response = {'Buckets': [
+            {'Name': name, 'CreationDate': '2024-01-01',
+             'BucketRegion': self.fleet.bucket_region(name)}
+            for name in names[start:start + MaxBuckets]
+        ]}
+        if start + MaxBuckets < len(names):
+            response['ContinuationToken'] = str(start + MaxBuckets)
+        return response
+
+    def get_public_access_block(self, Bucket):
+        self.call('get_public_access_block')
+        return {'PublicAccessBlockConfiguration':
+                dict(self.fleet.buckets[Bucket])}
+
+    def put_public_access_block(self, Bucket,
+                                PublicAccessBlockConfiguration):
+        self.call('put_public_access_block')
+        self.fleet.buckets[Bucket] = dict(PublicAccessBlockConfiguration)
+
+
+class FakeS3Control(FakeClient):
+    service = 's3control'
+
+    def get_public_access_block(self, AccountId):
+        self.call('get_public_access_block')
+        if self.fleet.account_block is None:
+            raise RuntimeError("NoSuchPublicAccessBlockConfiguration")
+        return {'PublicAccessBlockConfiguration':
+                dict(self.fleet.account_block)}
+
+
+class FakeSTS(FakeClient):
+    service = 'sts'
+
+    def get_caller_identity(self):
+        self.call('get_caller_identity')
+        return {'Account': '123456789012'}
+
+
+CLIENTS = {'ec2': FakeEC2, 'iam': FakeIAM, 'rds': FakeRDS, 's3': FakeS3,
+           's3control': FakeS3Control, 'sts': FakeSTS}
+
+
+class FakeSession:
+    """boto3 session stand-in handing out fake clients over one fleet."""
+
+    def __init__(self, fleet, latency=0.0, region_name='us-east-1'):
+        self.fleet = fleet
+        self.latency = latency
+        self.region_name = region_name
+        self.stats = CallStats()
+
+    def client(self, service_name, **kwargs):
+        return CLIENTS[service_name](self.fleet, self.stats, self.latency)
+
+
+class Fleet:
+    """
+    A synthetic account of `size` resources per service. About one in
+    `flagged_every` resources needs remediating; EC2 instances share one
+    role per `instances_per_role` instances. Buckets are spread over
+    `bucket_regions`; account_block is the account-level Block Public
+    Access configuration, if any.
+    """
+
+    def __init__(self, size, flagged_every=10, instances_per_role=10,
+                 policies_per_role=3,
+                 bucket_regions=('us-east-1', 'eu-west-1'),
+                 account_block=None):
+        self.lock = threading.Lock()
+        role_count = max(size // instances_per_role, 1)
+
+        self.role_policies = {}
+        self.profiles = []
+        for n in range(role_count):
+            role_name = f'role-{n}'
+            policies = [
+                {'PolicyName': f'Policy{p}',
+                 'PolicyArn': f'arn:aws:iam::123456789012:policy/Policy{p}'}
+                for p in range(policies_per_role)
+            ]
+            if n % flagged_every == 0:
+                policies.append(dict(SSM_POLICY))
+            self.role_policies[role_name] = policies
+            self.profiles.append({'InstanceProfileName': f'profile-{n}',
+                                  'Roles': [{'RoleName': role_name}]})
+
+        self.instances = [
+            {'InstanceId': f'i-{n:08x}', 'State': {'Name': 'running'},
+             'IamInstanceProfile': {
+                 'Arn': 'arn:aws:iam::123456789012:instance-profile/'
+                        f'profile-{n % role_count}'}}
+            for n in range(size)
+        ]
+
+        self.db_instances = [
+            {'DBInstanceIdentifier': f'db-{n}',
+             'PubliclyAccessible': n % flagged_every == 0,
+             'DBInstanceStatus': 'available'}
+            for n in range(size)
+        ]
+        self.db_clusters = [
+            {'DBClusterIdentifier': f'cluster-{n}',
+             'PubliclyAccessible': n % flagged_every == 0,
+             'Status': 'available'}
+            for n in range(max(size // 50, 1))
+        ]
+        self.db_index = {db.get('DBInstanceIdentifier')
+                         or db['DBClusterIdentifier']: db
+                         for db in self.db_instances + self.db_clusters}
+
+        self.buckets = {
+            f'bucket-{n}': {
+                'BlockPublicAcls': True,
+                'IgnorePublicAcls': n % flagged_every != 0,
+                'BlockPublicPolicy': True,
+                'RestrictPublicBuckets': True,
+            }
+            for n in range(size)
+        }
+        self.bucket_regions = bucket_regions
+        self.account_block = account_block
+
+    def bucket_region(self, name):
+        """Return the region of a bucket, spreading buckets round-robin."""
+        n = int(name.rsplit('-', 1)[1])
+        return self.bucket_regions[n % len(self.bucket_regions)]
@@ -0,0 +1,148 @@
+"""
+Benchmark the remediation tools against synthetic fleets.
+
+    PYTHONPATH=. python bench/run_bench.py --sizes 1000,10000 --latency 0.002
+
+Reports wall time, API calls per operation and peak Python memory
+(tracemalloc) for each tool and fleet size.
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from fake_aws import Fleet, FakeSession
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for app in ('ec2/app', 'rds/app', 's3/app'):
+    sys.path.insert(0, os.path.join(ROOT, app))
+
+import EC2_remove_SSM_policy  # noqa: E402
+from common import inventory, rules  # noqa: E402
+import check_rds  # noqa: E402
+import s3_block_public_access  # noqa: E402
+
+
+def run_ec2(session, workers):
+    EC2_remove_SSM_policy.initialize_clients(session, None)
+    EC2_remove_SSM_policy.remove_ec2_ssm_roles()
+
+
+def run_ec2_snapshot(session, workers):
+    EC2_remove_SSM_policy.initialize_clients(session, None, iam_snapshot=True)
+    EC2_remove_SSM_policy.remove_ec2_ssm_roles()
+
+
+def run_ec2_reverse(session, workers):
+    EC2_remove_SSM_policy.initialize_clients(session, None)
+    EC2_remove_SSM_policy.scan_policy_first()
+
+
+def run_rds(session, workers):
+    check_rds.check_and_remove_rds_public_access(
+        session, max_workers=workers, rate=0
+    )
+
+
+def run_s3(session, workers):
+    s3_block_public_access.scan_buckets(session, workers)
+
+
+def run_rules(session, workers):
+    tables = inventory.merge_tables([
+        EC2_remove_SSM_policy.collect_inventory(session),
+        check_rds.collect_inventory(session),
+        s3_block_public_access.collect_inventory(session,
+                                                 max_workers=workers),
+    ])
+    rules.evaluate_rules(rules.RULES, tables)
+
+
+# Entry point of each benchmarked tool, called as task(session, workers)
+TOOLS = {'ec2': run_ec2, 'ec2-snapshot': run_ec2_snapshot,
+         'ec2-reverse': run_ec2_reverse, 'rds': run_rds, 's3': run_s3,
+         'rules': run_rules}
+
+
+def measure(task, size, latency=0.0, workers=16, memory=True):
+    """
+    Run task against a fresh fleet of `size` resources and return a dict
+    with the wall time, call counts and, if `memory`, peak memory.
+    """
+    session = FakeSession(Fleet(size), latency)
+    with open(os.devnull, 'w') as devnull, \
+            contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        task(session, workers)
+        elapsed = time.perf_counter() - start
+
+        peak = None
+        if memory:
+            # A second run on a fresh fleet, so tracing does not skew timing
+            memory_session = FakeSession(Fleet(size), latency)
+            tracemalloc.start()
+            try:
+                task(memory_session, workers)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+    return {
+        'size': size,
+        'seconds': round(elapsed, 3),
+        'calls': session.stats.total(),
+        'calls_by_operation': dict(sorted(session.stats.calls.items())),
+        'peak_memory_bytes': peak,
+    }
+
+
+def print_report(tool, result):
+    """Print one benchmark result as a few aligned lines."""
+    peak = result['peak_memory_bytes']
+    memory = f"{peak / 1048576:.1f} MiB" if peak is not None else "n/a"
+    print(f"{tool:12} {result['size']:>7} resources  "
+          f"{result['seconds']:>8.3f}s  {result['calls']:>7} calls  "
+          f"peak {memory}")
+    for operation, count in result['calls_by_operation'].items():
+        print(f"               {operation:40} {count:>7}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the tools against synthetic AWS fleets."
+    )
+    parser.add_argument('--tools', default=','.join(TOOLS),
+                        help="Comma-separated tools to run (default: all)")
+    parser.add_argument('--sizes', default='1000,10000',
+                        help="Comma-separated fleet sizes (default: "
+                             "1000,10000)")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="Seconds each fake API call sleeps")
+    parser.add_argument('--workers', type=int, default=16,
+                        help="Worker threads passed to the tools")
+    parser.add_argument('--no-memory', action='store_true',
+                        help="Skip the tracemalloc peak memory run")
+    parser.add_argument('--json',
+                        help="Also write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    report = []
+    for tool in args.tools.split(','):
+        for size in (int(size) for size in args.sizes.split(',')):
+            result = measure(TOOLS[tool], size, args.latency, args.workers,
+                             memory=not args.no_memory)
+            result['tool'] = tool
+            print_report(tool, result)
+            report.append(result)
+
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump(report, json_file, indent=2)
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+import unittest
+
+from run_bench import TOOLS, measure
+
+
+class TestBenchmarks(unittest.TestCase):
+
+    def test_ec2_reads_each_role_once(self):
+        result = measure(TOOLS['ec2'], 200, memory=False)
+        calls = result['calls_by_operation']
+        # 20 shared roles, 2 of them with an SSM policy
+        self.assertEqual(calls['iam:list_attached_role_policies'], 20)
+        self.assertEqual(calls['iam:detach_role_policy'], 2)
+        self.assertEqual(calls['iam:list_instance_profiles'], 1)
+
+    def test_ec2_snapshot_replaces_per_role_lookups(self):
+        result = measure(TOOLS['ec2-snapshot'], 200, memory=False)
+        calls = result['calls_by_operation']
+        self.assertEqual(calls['iam:get_account_authorization_details'], 1)
+        self.assertNotIn('iam:list_attached_role_policies', calls)
+        self.assertNotIn('iam:list_instance_profiles', calls)
+        self.assertEqual(calls['iam:detach_role_policy'], 2)
+
+    def test_ec2_reverse_lookup_reads_only_violating_roles(self):
+        result = measure(TOOLS['ec2-reverse'], 200, memory=False)
+        calls = result['calls_by_operation']
+        # 2 of the 20 roles hold the SSM policy
+        self.assertEqual(calls['iam:list_instance_profiles_for_role'], 2)
+        self.assertEqual(calls['iam:detach_role_policy'], 2)
+        self.assertNotIn('iam:list_attached_role_policies', calls)
+
+    def test_rds_modifies_only_public_dbs(self):
+        result = measure(TOOLS['rds'], 200, memory=False)
+        calls = result['calls_by_operation']
+        self.assertEqual(calls['rds:modify_db_instance'], 20)
+        self.assertEqual(calls['rds:describe_db_instances'], 2)
+
+    def test_s3_reports_calls_and_memory(self):
+        result = measure(TOOLS['s3'], 50)
+        self.assertEqual(result['calls_by_operation']['s3:list_buckets'], 1)
+        self.assertGreater(result['peak_memory_bytes'], 0)
+        self.assertEqual(
+            result['calls_by_operation']['s3control:get_public_access_block'],
+            1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1 @@
+"""Helpers shared by the ec2, rds, s3 and get-url tools."""
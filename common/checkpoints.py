@@ -0,0 +1,141 @@
+import json
+import os
+import threading
+import time
+
+from botocore.paginate import TokenEncoder
+
+from common import results
+
+# Seconds between two writes of the checkpoint file
+CHECKPOINT_INTERVAL = 30.0
+
+
+def progress_key(tool, target):
+    """Return the checkpoint key of a tool's scan of a target."""
+    account_id = target.account_id if target else None
+    region = target.region if target else None
+    return f"{tool}|{account_id or ''}|{region or ''}"
+
+
+def starting_token(next_token):
+    """Return the paginator StartingToken resuming at a page NextToken."""
+    if next_token is None:
+        return None
+    return TokenEncoder().encode({'NextToken': next_token})
+
+
+class Checkpoint:
+    """
+    Progress of a run's scans, written to a JSON file at most every
+    `interval` seconds and on close, so an interrupted run can resume.
+    For each tool and target it holds the resources done with their
+    status, the NextToken of the last page fully handled and whether the
+    scan completed. Thread-safe.
+    """
+
+    def __init__(self, path, resume=False, interval=CHECKPOINT_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.progress = {}
+        if resume and os.path.exists(path):
+            with open(path) as checkpoint_file:
+                self.progress = json.load(checkpoint_file)['progress']
+        self.saved = time.monotonic()
+
+    def entry(self, tool, target):
+        """Return the progress of a scan; call with the lock held."""
+        return self.progress.setdefault(progress_key(tool, target), {
+            'done': {}, 'token': None, 'complete': False,
+        })
+
+    def done(self, tool, target):
+        """Return the resources of a scan already done, with their status."""
+        with self.lock:
+            return dict(self.entry(tool, target)['done'])
+
+    def token(self, tool, target):
+        """Return the NextToken of the last page the scan handled."""
+        with self.lock:
+            return self.entry(tool, target)['token']
+
+    def is_complete(self, tool, target):
+        with self.lock:
+            return self.entry(tool, target)['complete']
+
+    def partition(self, tool, target, resources):
+        """
+        Split resources into the ones left to check, in order, and a dict
+        of the ones already done to their recorded status.
+        """
+        done = self.done(tool, target)
+        return ([resource for resource in resources if resource not in done],
+                {resource: done[resource]
+                 for resource in resources if resource in done})
+
+    def record(self, tool, target, findings, token=None, complete=False):
+        """
+        Record findings as done and, if given, the NextToken to resume
+        at. Failed checks are left out so a resumed run retries them.
+        """
+        with self.lock:
+            entry = self.entry(tool, target)
+            for finding in findings:
+                if finding.status != results.ERROR:
+                    entry['done'][finding.resource] = finding.status
+            if token is not None:
+                entry['token'] = token
+            if complete:
+                entry['complete'] = True
+            if time.monotonic() - self.saved >= self.interval:
+                self.save()
+
+    def save(self):
+        """Write the checkpoint, replacing the file atomically."""
+        temporary = f"{self.path}.tmp"
+        with open(temporary, 'w') as checkpoint_file:
+            json.dump({'progress': self.progress}, checkpoint_file)
+        os.replace(temporary, self.path)
+        self.saved = time.monotonic()
+
+    def close(self):
+        with self.lock:
+            self.save()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def resumed_findings(tool, check, done, target=None):
+    """Return the Findings of resources done by an interrupted run."""
+    return [
+        results.make_finding(tool, check, resource, status,
+                             {'resumed': True}, target)
+        for resource, status in sorted(done.items())
+    ]
+
+
+def add_checkpoint_arguments(parser):
+    """Add the checkpoint and resume options shared by the tools."""
+    parser.add_argument(
+        '--checkpoint',
+        help="Save the scan progress to this file as it goes"
+    )
+    parser.add_argument(
+        '--resume', action='store_true',
+        help="Continue the interrupted scan saved in --checkpoint instead "
+             "of starting over"
+    )
+
+
+def checkpoint_from_args(args):
+    """Return the Checkpoint selected on the command line, or None."""
+    if args.resume and not args.checkpoint:
+        raise RuntimeError("--resume needs --checkpoint FILE")
+    if not args.checkpoint:
+        return None
+    return Checkpoint(args.checkpoint, resume=args.resume)
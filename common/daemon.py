@@ -0,0 +1,201 @@
+import json
+import sys
+import time
+
+from common import results, runner
+from common.runner import Target
+
+# Seconds between reads of a followed event file that has no new lines
+POLL_INTERVAL = 1.0
+
+# SQS long polling: seconds per receive and messages per receive
+SQS_WAIT_SECONDS = 20
+SQS_BATCH_SIZE = 10
+
+
+def event_record(event):
+    """
+    Return the CloudTrail record of an event, unwrapping the EventBridge
+    envelope ("detail-type": "AWS API Call via CloudTrail") if present.
+    """
+    if isinstance(event.get('detail'), dict):
+        return event['detail']
+    return event
+
+
+def event_target(record):
+    """Return the Target (account and region) a CloudTrail record is for."""
+    return Target(account_id=record.get('recipientAccountId'),
+                  region=record.get('awsRegion'))
+
+
+def request_parameter(record, name):
+    """Return a request parameter of a record, or None."""
+    return (record.get('requestParameters') or {}).get(name)
+
+
+def iter_file_events(path, follow=False, poll_interval=POLL_INTERVAL):
+    """
+    Yield (event, None) for the events of a JSON-lines file ('-' for
+    stdin); lines need no acknowledgement. With follow, keep waiting for
+    new lines like `tail -f` instead of stopping at the end of the file.
+    """
+    events_file = sys.stdin if path == '-' else open(path)
+    try:
+        while True:
+            line = events_file.readline()
+            if not line:
+                if not follow:
+                    return
+                time.sleep(poll_interval)
+                continue
+            if line.strip():
+                yield json.loads(line), None
+    finally:
+        if events_file is not sys.stdin:
+            events_file.close()
+
+
+def iter_sqs_events(sqs_client, queue_url, wait_seconds=SQS_WAIT_SECONDS):
+    """
+    Yield (event, acknowledge) from an SQS queue fed by an EventBridge
+    rule, forever. acknowledge() deletes the message; call it only once
+    the event has been handled, so a failed or interrupted event is
+    redelivered after the visibility timeout instead of being lost.
+    """
+    def acknowledger(message):
+        return lambda: sqs_client.delete_message(
+            QueueUrl=queue_url, ReceiptHandle=message['ReceiptHandle']
+        )
+
+    while True:
+        response = sqs_client.receive_message(
+            QueueUrl=queue_url, MaxNumberOfMessages=SQS_BATCH_SIZE,
+            WaitTimeSeconds=wait_seconds,
+        )
+        for message in response.get('Messages', []):
+            acknowledge = acknowledger(message)
+            try:
+                event = json.loads(message['Body'])
+            except ValueError as e:
+                # No retry can parse it; drop it instead of looping on it
+                print(f"Dropping unparseable message "
+                      f"{message.get('MessageId')}: {e}")
+                acknowledge()
+                continue
+            yield event, acknowledge
+
+
+class Daemon:
+    """
+    Dispatch change events to a tool's handlers, keeping one warm session
+    per account/region between events.
+
+    handlers maps a CloudTrail eventName to handler(session, record,
+    target), returning the Findings of the resources it re-checked; an
+    ERROR finding fails the event like an exception does.
+    session_factory(target) returns the session of an event's target.
+    """
+
+    def __init__(self, handlers, session_factory, writer=None):
+        self.handlers = handlers
+        self.session_factory = session_factory
+        self.writer = writer
+        self.sessions = {}
+        self.handled = 0
+        self.failed = 0
+
+    def session(self, target):
+        if target not in self.sessions:
+            self.sessions[target] = self.session_factory(target)
+        return self.sessions[target]
+
+    def handle(self, event):
+        """
+        Handle one event. Return True once it is handled or ignored, and
+        False when its handler failed and it should be retried.
+        """
+        record = event_record(event)
+        handler = self.handlers.get(record.get('eventName'))
+        if handler is None or record.get('errorCode'):
+            # Unrelated or failed API calls change nothing
+            return True
+
+        target = event_target(record)
+        name = f"{record['eventName']} in {runner.describe_target(target)}"
+        try:
+            findings = handler(self.session(target), record, target)
+        except Exception as e:
+            self.failed += 1
+            print(f"Error handling {name}: {e}")
+            return False
+        results.write_findings(self.writer, findings)
+        for finding in findings:
+            print(f"{name}: {finding.resource} is {finding.status}")
+        if any(finding.status == results.ERROR for finding in findings):
+            self.failed += 1
+            return False
+        self.handled += 1
+        return True
+
+    def run(self, events):
+        """
+        Handle (event, acknowledge) pairs until the source is exhausted,
+        acknowledging the events handled or ignored.
+        """
+        for event, acknowledge in events:
+            if self.handle(event) and acknowledge is not None:
+                acknowledge()
+        print(f"{self.handled} events handled, {self.failed} failed.")
+        return self.handled
+
+
+def add_daemon_arguments(parser):
+    """Add the event-driven service mode options shared by the tools."""
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument(
+        '--events',
+        help="Run as a service re-checking the resources named by the "
+             "CloudTrail events of this JSON-lines file ('-': stdin)"
+    )
+    group.add_argument(
+        '--queue-url',
+        help="Run as a service reading CloudTrail events from this SQS "
+             "queue (e.g. fed by an EventBridge rule)"
+    )
+    parser.add_argument(
+        '--follow', action='store_true',
+        help="Keep reading --events as lines are appended"
+    )
+
+
+def session_factory_from_args(args, default_session):
+    """
+    Return a session factory for event targets. With --targets, events
+    of the listed accounts use their role and other accounts are
+    rejected; without, every event uses the command line credentials.
+    """
+    if not args.targets:
+        return lambda target: default_session(target.region)
+
+    accounts = {target.account_id: target
+                for target in runner.load_targets(args.targets)}
+
+    def session_factory(target):
+        known = accounts.get(target.account_id)
+        if known is None:
+            raise RuntimeError(f"Account {target.account_id} is not in "
+                               f"{args.targets}")
+        return runner.create_session(known._replace(region=target.region))
+    return session_factory
+
+
+def run_from_args(args, handlers, default_session, writer=None):
+    """Run the service mode selected on the command line."""
+    session_factory = session_factory_from_args(args, default_session)
+    if args.queue_url:
+        sqs = default_session().client('sqs')
+        events = iter_sqs_events(sqs, args.queue_url)
+    else:
+        events = iter_file_events(args.events, args.follow)
+    return Daemon(handlers, session_factory, writer).run(events)
@@ -0,0 +1,62 @@
+import gzip
+import json
+
+# Columns every inventory table starts with, so rules can join and report
+# per account and region
+TARGET_COLUMNS = ('account_id', 'region')
+
+
+def make_table(rows, columns, target=None, regional=True):
+    """
+    Build a columnar table (column name -> list of values) from row
+    tuples, prefixed with the target's account and, if regional, region.
+    """
+    account_id = target.account_id if target else None
+    region = target.region if target and regional else None
+    table = {column: [] for column in TARGET_COLUMNS + tuple(columns)}
+    for row in rows:
+        table['account_id'].append(account_id)
+        table['region'].append(region)
+        for column, value in zip(columns, row):
+            table[column].append(value)
+    return table
+
+
+def table_length(table):
+    """Return the number of rows of a table."""
+    return len(next(iter(table.values()), []))
+
+
+def merge_tables(parts):
+    """
+    Concatenate the tables of several collections, table by table,
+    dropping duplicate rows (account-wide tables are collected once per
+    region of an account). Cells are scalars, so rows are hashable.
+    """
+    merged = {}
+    seen = {}
+    for part in parts:
+        for name, table in part.items():
+            target = merged.setdefault(name, {column: [] for column in table})
+            rows = seen.setdefault(name, set())
+            for row in zip(*(table[column] for column in target)):
+                if row in rows:
+                    continue
+                rows.add(row)
+                for column, value in zip(target, row):
+                    target[column].append(value)
+    return merged
+
+
+def write_snapshot(path, tables):
+    """Write inventory tables to a JSON file, gzipped if path ends in .gz."""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'wt') as snapshot_file:
+        json.dump({'tables': tables}, snapshot_file, default=str)
+
+
+def read_snapshot(path):
+    """Read the inventory tables written by write_snapshot."""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt') as snapshot_file:
+        return json.load(snapshot_file)['tables']
@@ -0,0 +1,234 @@
+import os
+import threading
+import time
+
+# Upper bounds, in seconds, of the call latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0)
+
+
+class Histogram:
+    """Latency histogram with fixed bucket bounds, like Prometheus'."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            index = len(self.buckets)
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Return the bucket bound holding quantile q (an upper estimate)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                if index < len(self.buckets):
+                    return self.buckets[index]
+                break
+        return float('inf')
+
+
+class OperationStats:
+    """Counters and latencies of one API operation (or HTTP method)."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.throttles = 0
+        self.retries = 0
+        self.retry_delay = 0.0
+        self.latency = Histogram()
+
+
+class Metrics:
+    """
+    Thread-safe per-operation call counts, errors, throttles, retries and
+    latency histograms, fed by boto3 events and requests hooks.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.operations = {}
+        self.started = time.monotonic()
+
+    def stats(self, service, operation):
+        """Return the OperationStats of an operation; call with the lock."""
+        key = (service, operation)
+        if key not in self.operations:
+            self.operations[key] = OperationStats()
+        return self.operations[key]
+
+    def observe_call(self, service, operation, seconds, error=False):
+        with self.lock:
+            stats = self.stats(service, operation)
+            stats.calls += 1
+            stats.errors += bool(error)
+            stats.latency.observe(seconds)
+
+    def observe_throttle(self, service, operation):
+        with self.lock:
+            self.stats(service, operation).throttles += 1
+
+    def observe_retry(self, service, operation, delay):
+        with self.lock:
+            stats = self.stats(service, operation)
+            stats.retries += 1
+            stats.retry_delay += delay
+
+    def reset(self):
+        with self.lock:
+            self.operations = {}
+            self.started = time.monotonic()
+
+    # boto3 event handlers. The request context is per call, so it carries
+    # the start time between before-call and after-call across threads.
+
+    def before_call(self, context, **kwargs):
+        context['metrics_started'] = time.monotonic()
+
+    def after_call(self, model, context, http_response=None, **kwargs):
+        started = context.get('metrics_started')
+        if started is not None:
+            error = http_response is None or http_response.status_code >= 400
+            self.observe_call(model.service_model.service_name, model.name,
+                              time.monotonic() - started, error)
+
+    def after_call_error(self, context, **kwargs):
+        started = context.get('metrics_started')
+        model = context.get('metrics_model')
+        if started is not None and model is not None:
+            self.observe_call(model.service_model.service_name, model.name,
+                              time.monotonic() - started, error=True)
+
+    def before_parameter_build(self, model, context, **kwargs):
+        # after-call-error is emitted without the operation model
+        context['metrics_model'] = model
+
+    def install(self, session):
+        """Record every API call made through a boto3 session."""
+        session.events.register('before-parameter-build',
+                                self.before_parameter_build)
+        session.events.register('before-call', self.before_call)
+        session.events.register('after-call', self.after_call)
+        session.events.register('after-call-error', self.after_call_error)
+
+    # requests hooks
+
+    def response_hook(self, service):
+        """Return a requests response hook recording calls as `service`."""
+        def record(response, *args, **kwargs):
+            self.observe_call(service, response.request.method,
+                              response.elapsed.total_seconds(),
+                              error=response.status_code >= 400)
+        return record
+
+    # Reporting
+
+    def summary_lines(self):
+        """Return a human readable summary, one line per operation."""
+        with self.lock:
+            items = sorted(self.operations.items())
+            elapsed = time.monotonic() - self.started
+        total = sum(stats.calls for _, stats in items)
+        lines = [f"{total} calls in {elapsed:.1f}s"]
+        for (service, operation), stats in items:
+            average = stats.latency.sum / stats.latency.count \
+                if stats.latency.count else 0.0
+            lines.append(
+                f"  {service}:{operation} calls={stats.calls} "
+                f"errors={stats.errors} throttles={stats.throttles} "
+                f"retries={stats.retries} "
+                f"retry_wait={stats.retry_delay:.2f}s "
+                f"avg={average * 1000:.0f}ms "
+                f"p95<={stats.latency.quantile(0.95) * 1000:.0f}ms"
+            )
+        return lines
+
+    def print_summary(self):
+        print("\nAPI call profile:")
+        for line in self.summary_lines():
+            print(line)
+
+    def prometheus_text(self, prefix='scan'):
+        """Return the metrics in the Prometheus text exposition format."""
+        with self.lock:
+            items = sorted(self.operations.items())
+        lines = []
+        counters = [
+            ('calls', 'API calls made', lambda s: s.calls),
+            ('errors', 'API calls that failed', lambda s: s.errors),
+            ('throttles', 'Throttled API responses', lambda s: s.throttles),
+            ('retries', 'API call retries', lambda s: s.retries),
+            ('retry_wait_seconds', 'Seconds spent waiting to retry',
+             lambda s: s.retry_delay),
+        ]
+        for name, help_text, value in counters:
+            lines.append(f"# HELP {prefix}_{name}_total {help_text}")
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            for key, stats in items:
+                lines.append(f"{prefix}_{name}_total{labels(key)} "
+                             f"{value(stats)}")
+
+        name = f"{prefix}_call_duration_seconds"
+        lines.append(f"# HELP {name} API call latency, retries included")
+        lines.append(f"# TYPE {name} histogram")
+        for key, stats in items:
+            histogram = stats.latency
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + (float('inf'),),
+                                    histogram.counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f"{name}_bucket{labels(key, le=le)} "
+                             f"{cumulative}")
+            lines.append(f"{name}_sum{labels(key)} {histogram.sum}")
+            lines.append(f"{name}_count{labels(key)} {histogram.count}")
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path, prefix='scan'):
+        """Write the metrics to a file for the node_exporter textfile
+        collector, replacing it atomically."""
+        temporary = f"{path}.tmp"
+        with open(temporary, 'w') as metrics_file:
+            metrics_file.write(self.prometheus_text(prefix))
+        os.replace(temporary, path)
+
+
+def labels(key, **extra):
+    """Format the service/operation labels of a metric sample."""
+    service, operation = key
+    pairs = [f'service="{service}"', f'operation="{operation}"']
+    pairs.extend(f'{name}="{value}"' for name, value in extra.items())
+    return '{' + ','.join(pairs) + '}'
+
+
+def add_metrics_arguments(parser):
+    """Add the API call profile options shared by the tools."""
+    parser.add_argument(
+        '--metrics',
+        help="Write the API call metrics to this Prometheus text file"
+    )
+
+
+def report_from_args(args, metrics):
+    """Print the call profile and write the Prometheus file if asked."""
+    metrics.print_summary()
+    if args.metrics:
+        metrics.write_prometheus(args.metrics)
+
+
+# Metrics shared by every session of the process
+DEFAULT_METRICS = Metrics()
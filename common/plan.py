@@ -0,0 +1,182 @@
+import functools
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from common import runner
+from common.runner import Target
+
+# Default size of the batches an apply phase runs in parallel
+APPLY_WORKERS = 8
+BATCH_SIZE = 50
+
+
+def plan_action(tool, service, operation, resource, params, target=None):
+    """
+    Describe one intended change: the API call `operation` of `service`
+    with `params`, against `resource` in `target` (None: current session).
+    """
+    return {
+        'tool': tool,
+        'service': service,
+        'operation': operation,
+        'resource': resource,
+        'params': params,
+        'target': target._asdict() if target else None,
+    }
+
+
+class PlanWriter:
+    """Thread-safe writer of plan actions as JSON lines."""
+
+    def __init__(self, path):
+        self.file = open(path, 'w')
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def write(self, action):
+        line = json.dumps(action, sort_keys=True, default=str)
+        with self.lock:
+            self.file.write(line + '\n')
+            self.count += 1
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_plan(path):
+    """Yield the actions of a plan file."""
+    with open(path) as plan_file:
+        for line in plan_file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def group_by_target(actions):
+    """Group actions by the Target (or None) they apply to."""
+    groups = {}
+    for action in actions:
+        target = action.get('target')
+        key = Target(**target) if target else None
+        groups.setdefault(key, []).append(action)
+    return groups
+
+
+def apply_plan(actions, allowed_operations, session_factory,
+               max_workers=APPLY_WORKERS, batch_size=BATCH_SIZE):
+    """
+    Execute plan actions in parallel batches, one session per target.
+
+    allowed_operations is the set of (service, operation) pairs a tool is
+    willing to execute from a plan file. session_factory(target) returns
+    the session for a Target, or for None when the plan has no targets.
+    Returns a list of (action, error) pairs, error being None on success.
+    """
+    results = []
+    for target, group in group_by_target(actions).items():
+        try:
+            session = session_factory(target)
+            if session is None:
+                raise RuntimeError("No AWS session available")
+        except Exception as e:
+            results.extend((action, e) for action in group)
+            continue
+        clients = {}
+        clients_lock = threading.Lock()
+
+        def execute(action):
+            key = (action['service'], action['operation'])
+            if key not in allowed_operations:
+                return action, ValueError(
+                    f"Operation {key[0]}:{key[1]} is not allowed in a plan"
+                )
+            try:
+                with clients_lock:
+                    if action['service'] not in clients:
+                        clients[action['service']] = session.client(
+                            action['service'])
+                    client = clients[action['service']]
+                getattr(client, action['operation'])(**action['params'])
+                return action, None
+            except Exception as e:
+                return action, e
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for start in range(0, len(group), batch_size):
+                batch = group[start:start + batch_size]
+                results.extend(pool.map(execute, batch))
+    return results
+
+
+def print_apply_results(results):
+    """Print the outcome of every applied action and the totals."""
+    failed = 0
+    for action, error in results:
+        name = f"{action['operation']} on {action['resource']}"
+        if error is not None:
+            failed += 1
+            print(f"Error applying {name}: {error}")
+        else:
+            print(f"Applied {name}")
+    print(f"{len(results) - failed} actions applied, {failed} failed.")
+
+
+def add_plan_arguments(parser):
+    """Add the two-phase plan/apply options shared by the tools."""
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument(
+        '--plan',
+        help="Scan read-only and write the intended changes to this file"
+    )
+    group.add_argument(
+        '--apply',
+        help="Execute the changes of a plan file without re-scanning"
+    )
+    parser.add_argument(
+        '--apply-workers', type=int, default=APPLY_WORKERS,
+        help=f"Parallel changes while applying (default: {APPLY_WORKERS})"
+    )
+    parser.add_argument(
+        '--batch-size', type=int, default=BATCH_SIZE,
+        help=f"Changes per apply batch (default: {BATCH_SIZE})"
+    )
+
+
+def plan_from_args(args, plan_target, default_session, account_wide=False):
+    """
+    Run plan_target(session, target, writer) over the command line
+    targets, or once for the interactive session, writing to args.plan.
+    """
+    with PlanWriter(args.plan) as writer:
+        task = functools.partial(plan_target, writer=writer)
+        if args.targets:
+            runner.run_from_args(args, task, account_wide)
+        else:
+            session = default_session()
+            task(session, Target(region=session.region_name))
+    print(f"Wrote {writer.count} planned changes to {args.plan}")
+    return writer.count
+
+
+def apply_from_args(args, allowed_operations, default_session):
+    """
+    Apply the plan given on the command line. Actions planned without
+    an account use default_session(region) built from the CLI options.
+    """
+    def session_factory(target):
+        if target is None or not (target.account_id or target.profile):
+            return default_session(target.region if target else None)
+        return runner.create_session(target)
+
+    results = apply_plan(
+        list(read_plan(args.apply)), allowed_operations, session_factory,
+        max_workers=args.apply_workers, batch_size=args.batch_size,
+    )
+    print_apply_results(results)
+    return results
@@ -0,0 +1,207 @@
+import csv
+import json
+import os
+import threading
+from collections import Counter, namedtuple
+
+# Outcome of checking one resource. detail is a JSON-serializable dict
+# (or None) with check-specific data such as the offending policies.
+Finding = namedtuple(
+    'Finding',
+    ['tool', 'check', 'resource', 'status', 'detail', 'account_id', 'region'],
+    defaults=(None, None, None)
+)
+
+# Finding statuses
+COMPLIANT = 'compliant'
+NONCOMPLIANT = 'noncompliant'
+REMEDIATED = 'remediated'
+ERROR = 'error'
+# Skipped by an incremental scan; detail holds the last recorded status
+UNCHANGED = 'unchanged'
+
+# Records buffered by the batch writers before a CSV/Parquet write
+BATCH_SIZE = 10000
+
+
+def make_finding(tool, check, resource, status, detail=None, target=None):
+    """Build a Finding, taking the account and region from a Target."""
+    return Finding(
+        tool, check, resource, status, detail,
+        target.account_id if target else None,
+        target.region if target else None,
+    )
+
+
+def summarize(findings):
+    """Return the number of findings per status."""
+    return dict(Counter(finding.status for finding in findings))
+
+
+def write_findings(writer, findings):
+    """Write findings to writer, if any, and return them."""
+    if writer is not None:
+        for finding in findings:
+            writer.write(finding)
+    return findings
+
+
+def flat_record(finding):
+    """Return a finding as a flat dict with detail encoded as JSON text."""
+    record = finding._asdict()
+    record['detail'] = json.dumps(finding.detail, sort_keys=True, default=str)
+    return record
+
+
+class NullWriter:
+    """Writer discarding findings, used when no output file is given."""
+
+    count = 0
+
+    def write(self, finding):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class JSONLinesWriter(NullWriter):
+    """Thread-safe writer streaming findings as JSON lines."""
+
+    def __init__(self, path):
+        self.file = open(path, 'w')
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def write(self, finding):
+        line = json.dumps(finding._asdict(), sort_keys=True, default=str)
+        with self.lock:
+            self.file.write(line + '\n')
+            self.count += 1
+
+    def close(self):
+        self.file.close()
+
+
+class BatchWriter(NullWriter):
+    """
+    Thread-safe writer buffering findings and writing them batch_size at
+    a time through write_batch(records), for columnar and tabular files.
+    """
+
+    def __init__(self, path, batch_size=BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self.batch = []
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def write(self, finding):
+        with self.lock:
+            self.batch.append(flat_record(finding))
+            self.count += 1
+            if len(self.batch) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        """Write the buffered records; call with the lock held."""
+        if self.batch:
+            self.write_batch(self.batch)
+            self.batch = []
+
+    def write_batch(self, records):
+        raise NotImplementedError
+
+    def close(self):
+        with self.lock:
+            self.flush()
+
+
+class CSVWriter(BatchWriter):
+    """Writer of findings as CSV rows with a header line."""
+
+    def __init__(self, path, batch_size=BATCH_SIZE):
+        super().__init__(path, batch_size)
+        self.file = open(path, 'w', newline='')
+        self.csv = csv.DictWriter(self.file, fieldnames=Finding._fields)
+        self.csv.writeheader()
+
+    def write_batch(self, records):
+        self.csv.writerows(records)
+
+    def close(self):
+        super().close()
+        self.file.close()
+
+
+class ParquetWriter(BatchWriter):
+    """Writer of findings as a Parquet file, one row group per batch."""
+
+    def __init__(self, path, batch_size=BATCH_SIZE):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError(
+                "Parquet output needs pyarrow: pip install pyarrow"
+            ) from None
+        super().__init__(path, batch_size)
+        self.pyarrow = pyarrow
+        self.schema = pyarrow.schema(
+            [(field, pyarrow.string()) for field in Finding._fields]
+        )
+        self.parquet = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write_batch(self, records):
+        self.parquet.write_table(
+            self.pyarrow.Table.from_pylist(records, schema=self.schema)
+        )
+
+    def close(self):
+        super().close()
+        self.parquet.close()
+
+
+# Output formats and the writer class of each
+WRITERS = {
+    'jsonl': JSONLinesWriter,
+    'csv': CSVWriter,
+    'parquet': ParquetWriter,
+}
+
+
+def open_writer(path, output_format=None):
+    """
+    Open a findings writer for path, in output_format or the format
+    given by the file extension (JSON lines by default).
+    """
+    if output_format is None:
+        extension = os.path.splitext(path)[1].lstrip('.').lower()
+        output_format = extension if extension in WRITERS else 'jsonl'
+    return WRITERS[output_format](path)
+
+
+def add_output_arguments(parser):
+    """Add the structured findings output options shared by the tools."""
+    parser.add_argument(
+        '--output',
+        help="Write one record per checked resource to this file"
+    )
+    parser.add_argument(
+        '--output-format', choices=sorted(WRITERS),
+        help="Format of --output (default: from the file extension, "
+             "else jsonl)"
+    )
+
+
+def writer_from_args(args):
+    """Return the writer for the command line options, or a NullWriter."""
+    if not args.output:
+        return NullWriter()
+    return open_writer(args.output, args.output_format)
@@ -0,0 +1,184 @@
+import random
+import threading
+
+from botocore.config import Config
+
+from common import metrics as call_metrics
+from common.ratelimit import TokenBucket
+
+# Error codes AWS services return when a caller exceeds the request rate
+THROTTLE_CODES = {
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'RequestThrottledException',
+    'TooManyRequestsException',
+    'ProvisionedThroughputExceededException',
+    'TransactionInProgressException',
+    'RequestLimitExceeded',
+    'BandwidthLimitExceeded',
+    'LimitExceededException',
+    'RequestThrottled',
+    'SlowDown',
+    'PriorRequestNotComplete',
+    'EC2ThrottledException',
+}
+
+# HTTP statuses worth retrying without a throttling error code
+TRANSIENT_STATUSES = {500, 502, 503, 504}
+
+# Client config handing retries over to this module
+CLIENT_CONFIG = Config(retries={'mode': 'standard', 'total_max_attempts': 1})
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket whose rate backs off multiplicatively when the service
+    throttles and recovers additively while calls succeed.
+    """
+
+    def __init__(self, max_rate=100.0, min_rate=1.0, backoff=0.5,
+                 recovery=0.5):
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.backoff = backoff
+        self.recovery = recovery
+        self.rate = max_rate
+        self.bucket = TokenBucket(max_rate)
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        self.bucket.acquire()
+
+    def on_throttle(self):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate * self.backoff)
+            self.bucket.set_rate(self.rate)
+
+    def on_success(self):
+        with self.lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.recovery)
+                self.bucket.set_rate(self.rate)
+
+
+class RetryBudget:
+    """
+    Shared allowance of retries: each retry spends `cost` tokens and each
+    successful call refunds `refund`, so a failing dependency cannot turn
+    every call into a long retry loop.
+    """
+
+    def __init__(self, capacity=500, cost=5, refund=1):
+        self.capacity = capacity
+        self.cost = cost
+        self.refund = refund
+        self.tokens = capacity
+        self.lock = threading.Lock()
+
+    def spend(self):
+        with self.lock:
+            if self.tokens < self.cost:
+                return False
+            self.tokens -= self.cost
+            return True
+
+    def release(self):
+        with self.lock:
+            self.tokens = min(self.capacity, self.tokens + self.refund)
+
+
+class RetryPolicy:
+    """
+    Per service/region adaptive rate limits plus throttle-aware retries,
+    attached to boto3 sessions through their event system so every call,
+    including paginated ones, goes through it.
+    """
+
+    def __init__(self, max_rates=None, default_rate=100.0, max_attempts=8,
+                 base_delay=0.1, max_delay=20.0, budget=None, metrics=None):
+        self.max_rates = max_rates or {}
+        self.default_rate = default_rate
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget or RetryBudget()
+        self.metrics = metrics
+        self.limiters = {}
+        self.lock = threading.Lock()
+        self.throttles = 0
+        self.retries = 0
+
+    def limiter(self, service, region):
+        key = (service, region)
+        with self.lock:
+            if key not in self.limiters:
+                self.limiters[key] = AdaptiveRateLimiter(
+                    self.max_rates.get(service, self.default_rate)
+                )
+            return self.limiters[key]
+
+    def delay(self, attempts):
+        """Exponential backoff with full jitter."""
+        ceiling = min(self.max_delay, self.base_delay * 2 ** attempts)
+        return random.uniform(0, ceiling)
+
+    def before_call(self, model, context, **kwargs):
+        service = model.service_model.service_name
+        self.limiter(service, context.get('client_region')).acquire()
+
+    def after_call(self, http_response, model, context, **kwargs):
+        if http_response is not None and http_response.status_code < 400:
+            service = model.service_model.service_name
+            self.limiter(service, context.get('client_region')).on_success()
+            self.budget.release()
+
+    def needs_retry(self, response, operation, attempts, caught_exception,
+                    request_dict, **kwargs):
+        """Return the seconds to wait before retrying, or None to stop."""
+        throttled = False
+        if caught_exception is not None:
+            retryable = True
+        elif response is not None:
+            http_response, parsed = response
+            code = parsed.get('Error', {}).get('Code')
+            throttled = code in THROTTLE_CODES
+            retryable = (throttled
+                         or http_response.status_code in TRANSIENT_STATUSES)
+        else:
+            retryable = False
+
+        if not retryable or attempts >= self.max_attempts:
+            return None
+
+        service = operation.service_model.service_name
+        region = request_dict.get('context', {}).get('client_region')
+        limiter = self.limiter(service, region)
+        if throttled:
+            limiter.on_throttle()
+            with self.lock:
+                self.throttles += 1
+            if self.metrics:
+                self.metrics.observe_throttle(service, operation.name)
+        if not self.budget.spend():
+            return None
+        with self.lock:
+            self.retries += 1
+        # Wait for the (possibly lowered) rate before the next attempt
+        limiter.acquire()
+        delay = self.delay(attempts)
+        if self.metrics:
+            self.metrics.observe_retry(service, operation.name, delay)
+        return delay
+
+    def install(self, session):
+        """Attach the policy to a boto3 session."""
+        session.events.register('before-call', self.before_call)
+        session.events.register('after-call', self.after_call)
+        session.events.register('needs-retry', self.needs_retry)
+
+
+# Policy shared by every session of the process, so concurrent workers
+# hitting the same service and region share one adaptive rate
+DEFAULT_POLICY = RetryPolicy(max_rates={'iam': 15.0, 'sts': 50.0},
+                             metrics=call_metrics.DEFAULT_METRICS)
@@ -0,0 +1,170 @@
+import json
+import re
+from collections import namedtuple
+
+from common import inventory, results
+
+# The compliance checks of the tools as declarative rules over inventory
+# tables. A rule selects the rows of `table` matching every `where`
+# condition ([column, operator, value] or {"any": [conditions]}) and
+# every `in` semi-join ([columns, query], the columns' values must be
+# among those the query selects), and reports one noncompliant Finding
+# per `resource` value, with the `detail` columns' values.
+RULES = [
+    {
+        'name': 'ec2-ssm', 'tool': 'ec2',
+        'table': 'role_policies', 'resource': 'role_name',
+        'where': [{'any': [['policy_name', 'contains', 'SSM'],
+                           ['policy_arn', 'contains', 'AmazonSSM']]}],
+        'in': [[['account_id', 'role_name'], {
+            'table': 'profiles', 'select': ['account_id', 'role_name'],
+            'in': [[['account_id', 'profile_name'], {
+                'table': 'instances',
+                'select': ['account_id', 'profile_name'],
+            }]],
+        }]],
+        'detail': ['policy_arn'],
+    },
+    {
+        'name': 'rds-public', 'tool': 'rds',
+        'table': 'dbs', 'resource': 'identifier',
+        'where': [['publicly_accessible', 'true']],
+        'detail': ['kind'],
+    },
+    {
+        # Buckets not covered by the account with a setting turned off, as
+        # public_access_detected() of the s3 tool
+        'name': 's3-bpa', 'tool': 's3',
+        'table': 'buckets', 'resource': 'bucket',
+        'where': [['account_blocked', 'false'], ['error', 'eq', None],
+                  {'any': [['block_public_acls', 'false'],
+                           ['ignore_public_acls', 'false'],
+                           ['block_public_policy', 'false'],
+                           ['restrict_public_buckets', 'false']]}],
+    },
+]
+
+CompiledRule = namedtuple('CompiledRule', ['name', 'tool', 'evaluate'])
+
+
+def compile_predicate(operator, value=None):
+    """Return a function testing one cell for an operator and value."""
+    if operator == 'eq':
+        return lambda cell: cell == value
+    if operator == 'ne':
+        return lambda cell: cell != value
+    if operator == 'in':
+        values = frozenset(value)
+        return lambda cell: cell in values
+    if operator == 'contains':
+        return lambda cell: cell is not None and value in cell
+    if operator == 'matches':
+        search = re.compile(value).search
+        return lambda cell: cell is not None and search(cell) is not None
+    if operator == 'true':
+        return lambda cell: cell is True
+    if operator == 'false':
+        return lambda cell: not cell
+    raise ValueError(f"Unknown rule operator: {operator}")
+
+
+def compile_condition(condition):
+    """Return a function computing a condition's mask over a table."""
+    if isinstance(condition, dict):
+        alternatives = [compile_condition(c) for c in condition['any']]
+        return lambda table: [any(bits) for bits in zip(
+            *(alternative(table) for alternative in alternatives)
+        )]
+    column, operator, *value = condition
+    predicate = compile_predicate(operator, *value)
+    return lambda table: [predicate(cell) for cell in table[column]]
+
+
+def column_keys(table, columns):
+    """Return a column's values, or tuples of several columns' values."""
+    if isinstance(columns, str):
+        return table[columns]
+    return list(zip(*(table[column] for column in columns)))
+
+
+def compile_query(query):
+    """
+    Return a function of the inventory tables returning a query's table
+    and the mask of its matching rows. Semi-join values are computed once
+    per evaluation as a set, then probed per row.
+    """
+    conditions = [compile_condition(c) for c in query.get('where', [])]
+    joins = [(columns, compile_select(subquery))
+             for columns, subquery in query.get('in', [])]
+
+    def evaluate(tables):
+        table = tables.get(query['table'])
+        if not table:
+            # A snapshot without the table, e.g. of other checks only
+            return {}, []
+        mask = [True] * inventory.table_length(table)
+        for condition in conditions:
+            mask = [row and bit for row, bit in zip(mask, condition(table))]
+        for columns, select in joins:
+            values = select(tables)
+            mask = [row and key in values for row, key
+                    in zip(mask, column_keys(table, columns))]
+        return table, mask
+    return evaluate
+
+
+def compile_select(query):
+    """Return a function of the tables returning a query's selected set."""
+    evaluate = compile_query(query)
+
+    def select(tables):
+        table, mask = evaluate(tables)
+        if not table:
+            return set()
+        keys = column_keys(table, query['select'])
+        return {key for key, row in zip(keys, mask) if row}
+    return select
+
+
+def compile_rule(rule):
+    """Compile a rule into a function of the tables returning Findings."""
+    evaluate = compile_query(rule)
+    detail_columns = rule.get('detail', [])
+
+    def findings(tables):
+        table, mask = evaluate(tables)
+        groups = {}
+        for index, row in enumerate(mask):
+            if not row:
+                continue
+            key = (table['account_id'][index], table['region'][index],
+                   table[rule['resource']][index])
+            detail = groups.setdefault(
+                key, {column: set() for column in detail_columns})
+            for column in detail_columns:
+                detail[column].add(table[column][index])
+        return [
+            results.Finding(rule['tool'], rule['name'], resource,
+                            results.NONCOMPLIANT,
+                            {column: sorted(values, key=str)
+                             for column, values in detail.items()},
+                            account_id, region)
+            for (account_id, region, resource), detail in groups.items()
+        ]
+    return CompiledRule(rule['name'], rule['tool'], findings)
+
+
+def load_rules(path=None):
+    """Return the rules of a JSON file, or the built-in RULES."""
+    if path is None:
+        return RULES
+    with open(path) as rules_file:
+        return json.load(rules_file)
+
+
+def evaluate_rules(rules, tables):
+    """Compile and evaluate rules, returning their Findings."""
+    findings = []
+    for rule in (compile_rule(rule) for rule in rules):
+        findings.extend(rule.evaluate(tables))
+    return findings
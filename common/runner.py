@@ -0,0 +1,190 @@
+import json
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import zip_longest
+
+from common import sessions
+from common.ratelimit import TokenBucket
+
+# One account/region to scan. role_name is assumed in account_id when set,
+# profile selects a local AWS profile as the base credentials.
+Target = namedtuple(
+    'Target', ['account_id', 'role_name', 'region', 'profile'],
+    defaults=(None, None, None, None)
+)
+
+TargetResult = namedtuple(
+    'TargetResult', ['target', 'result', 'error', 'elapsed']
+)
+
+
+def load_targets(path):
+    """
+    Load scan targets from a JSON file, e.g.
+    [{"account_id": "111111111111", "role_name": "Audit",
+      "regions": ["us-east-1", "eu-west-1"]}]
+    """
+    with open(path) as targets_file:
+        entries = json.load(targets_file)
+
+    targets = []
+    for entry in entries:
+        for region in entry.get('regions') or [entry.get('region')]:
+            targets.append(Target(
+                account_id=entry.get('account_id'),
+                role_name=entry.get('role_name'),
+                region=region,
+                profile=entry.get('profile'),
+            ))
+    return targets
+
+
+def one_per_account(targets):
+    """Keep the first target of each account, for account-wide services."""
+    seen = set()
+    unique = []
+    for target in targets:
+        key = (target.account_id, target.role_name, target.profile)
+        if key not in seen:
+            seen.add(key)
+            unique.append(target)
+    return unique
+
+
+def interleave_accounts(targets):
+    """Order targets round-robin across accounts to spread the load."""
+    by_account = {}
+    for target in targets:
+        by_account.setdefault(target.account_id, []).append(target)
+    ordered = []
+    for group in zip_longest(*by_account.values()):
+        ordered.extend(target for target in group if target is not None)
+    return ordered
+
+
+def create_session(target):
+    """
+    Create a boto3 session for a target, assuming its role if set. The
+    credentials are cached per account/role, so workers scanning other
+    regions of the same account reuse them instead of re-assuming.
+    """
+    role_arn = None
+    if target.role_name:
+        role_arn = f"arn:aws:iam::{target.account_id}:role/{target.role_name}"
+    session = sessions.get_session(
+        profile=target.profile, role_arn=role_arn, region=target.region
+    )
+    if session is None:
+        raise RuntimeError("No AWS credentials found for the target")
+    return session
+
+
+def run_targets(targets, task, max_workers=8, per_account=0, rate_limit=0,
+                session_factory=create_session):
+    """
+    Run task(session, target) for every target on a bounded thread pool.
+
+    Each target gets its own session, created inside the worker thread,
+    since boto3 sessions must not be shared between threads. per_account
+    caps how many targets of one account run at the same time and
+    rate_limit caps AWS API calls per second across all workers.
+    Returns a TargetResult per target, in completion order.
+    """
+    limiter = TokenBucket(rate_limit) if rate_limit else None
+    slots = {}
+    if per_account:
+        for target in targets:
+            slots.setdefault(
+                target.account_id, threading.BoundedSemaphore(per_account)
+            )
+
+    def throttle(**kwargs):
+        limiter.acquire()
+    throttle_id = f'run-targets-throttle-{id(limiter)}'
+
+    def run(target):
+        start = time.monotonic()
+        slot = slots.get(target.account_id)
+        if slot:
+            slot.acquire()
+        try:
+            session = session_factory(target)
+            if limiter:
+                # Sessions may be reused across targets; the unique_id
+                # keeps it to one token per call
+                session.events.register('before-call', throttle,
+                                        unique_id=throttle_id)
+            result = task(session, target)
+            return TargetResult(target, result, None,
+                                time.monotonic() - start)
+        except Exception as e:
+            return TargetResult(target, None, e, time.monotonic() - start)
+        finally:
+            if slot:
+                slot.release()
+
+    results = []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(run, target)
+                   for target in interleave_accounts(targets)]
+        for future in as_completed(futures):
+            results.append(future.result())
+    return results
+
+
+def describe_target(target):
+    """Return a short human readable label for a target."""
+    account = target.account_id or target.profile or "default"
+    return f"{account}/{target.region or 'default'}"
+
+
+def print_summary(results):
+    """Print one line per target and the overall totals."""
+    print("\nScan summary:")
+    failed = 0
+    for result in sorted(results, key=lambda r: describe_target(r.target)):
+        if result.error is not None:
+            failed += 1
+            status = f"ERROR {result.error}"
+        else:
+            status = f"OK {result.result}"
+        print(f"  {describe_target(result.target)}: {status} "
+              f"({result.elapsed:.1f}s)")
+    print(f"{len(results) - failed} targets succeeded, {failed} failed.")
+
+
+def add_runner_arguments(parser):
+    """Add the multi-target options shared by the tools to a parser."""
+    parser.add_argument(
+        '--targets',
+        help="JSON file of account/role/region targets to scan concurrently"
+    )
+    parser.add_argument(
+        '--workers', type=int, default=8,
+        help="Number of targets scanned in parallel (default: 8)"
+    )
+    parser.add_argument(
+        '--per-account', type=int, default=0,
+        help="Maximum targets of one account scanned at once (0: no limit)"
+    )
+    parser.add_argument(
+        '--rate', type=float, default=0,
+        help="Maximum AWS API calls per second overall (0: no limit)"
+    )
+
+
+def run_from_args(args, task, account_wide=False):
+    """Run a task over the targets given on the command line."""
+    targets = load_targets(args.targets)
+    if account_wide:
+        targets = one_per_account(targets)
+    results = run_targets(
+        targets, task,
+        max_workers=args.workers,
+        per_account=args.per_account,
+        rate_limit=args.rate,
+    )
+    print_summary(results)
+    return results
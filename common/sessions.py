@@ -0,0 +1,168 @@
+import threading
+
+import boto3
+import botocore.loaders
+import botocore.session
+from botocore.credentials import CredentialProvider, RefreshableCredentials
+
+from common import metrics, retry
+
+# Name recorded in CloudTrail for assumed-role sessions
+SESSION_NAME = "globant-challenge-scan"
+
+# Resolved credentials per (profile, role_arn, external_id), shared by
+# every session the tools create so the provider chain and AssumeRole
+# run once per process instead of once per session
+_credentials = {}
+
+_credentials_locks = {}
+
+_lock = threading.Lock()
+
+# botocore data loader shared by every session the tools create. Loaders
+# cache what they parse, so each service model, endpoint ruleset and
+# paginator file is read from disk once per process, when the first
+# client of that service is built, instead of once per session.
+_loader = None
+
+
+class CachedCredentialProvider(CredentialProvider):
+    """Credential provider handing out already resolved credentials."""
+
+    METHOD = 'cached'
+    CANONICAL_NAME = 'custom-cached'
+
+    def __init__(self, credentials):
+        super().__init__()
+        self.credentials = credentials
+
+    def load(self):
+        return self.credentials
+
+
+def assume_role_refresher(base_session, role_arn, external_id=None):
+    """Return a function fetching fresh AssumeRole credentials."""
+    sts = base_session.client('sts')
+
+    def refresh():
+        params = {'RoleArn': role_arn, 'RoleSessionName': SESSION_NAME}
+        if external_id:
+            params['ExternalId'] = external_id
+        credentials = sts.assume_role(**params)['Credentials']
+        return {
+            'access_key': credentials['AccessKeyId'],
+            'secret_key': credentials['SecretAccessKey'],
+            'token': credentials['SessionToken'],
+            'expiry_time': credentials['Expiration'].isoformat(),
+        }
+    return refresh
+
+
+def resolve_credentials(profile=None, role_arn=None, external_id=None):
+    """
+    Resolve credentials from the default provider chain or a profile,
+    then assume role_arn when given. Assumed-role credentials refresh
+    themselves before they expire. Returns None if nothing is configured.
+    """
+    base_session = boto3.session.Session(profile_name=profile)
+    if base_session.get_credentials() is None:
+        return None
+    if not role_arn:
+        return base_session.get_credentials()
+
+    refresh = assume_role_refresher(base_session, role_arn, external_id)
+    return RefreshableCredentials.create_from_metadata(
+        metadata=refresh(),
+        refresh_using=refresh,
+        method='sts-assume-role',
+    )
+
+
+def get_credentials(profile=None, role_arn=None, external_id=None):
+    """
+    Return the cached credentials for a profile/role, resolving once.
+    A failed resolution (None) is not cached, so the next call retries.
+    """
+    key = (profile, role_arn, external_id)
+    with _lock:
+        if key in _credentials:
+            return _credentials[key]
+        key_lock = _credentials_locks.setdefault(key, threading.Lock())
+
+    # Resolve outside the global lock so other keys are not held up
+    with key_lock:
+        with _lock:
+            if key in _credentials:
+                return _credentials[key]
+        credentials = resolve_credentials(profile, role_arn, external_id)
+        if credentials is not None:
+            with _lock:
+                _credentials[key] = credentials
+        return credentials
+
+
+def get_loader():
+    """Return the process-wide botocore data loader, creating it once."""
+    global _loader
+    with _lock:
+        if _loader is None:
+            _loader = botocore.loaders.create_loader()
+        return _loader
+
+
+def dedupe_search_paths(loader):
+    """
+    Drop repeated loader search paths: every boto3 session appends its
+    data directory to the shared loader, which would grow per session.
+    """
+    with _lock:
+        paths = loader.search_paths
+        if len(set(paths)) < len(paths):
+            paths[:] = list(dict.fromkeys(paths))
+
+
+def get_session(profile=None, role_arn=None, region=None, external_id=None):
+    """
+    Return a new boto3 session backed by the shared cached credentials,
+    or None when no credentials can be resolved. Sessions are cheap and
+    not thread-safe, so create one per worker. API calls made through the
+    session are rate limited and retried by the shared retry policy and
+    recorded in the shared call metrics.
+    """
+    credentials = get_credentials(profile, role_arn, external_id)
+    if credentials is None:
+        return None
+
+    botocore_session = botocore.session.Session(profile=profile)
+    botocore_session.register_component('data_loader', get_loader())
+    botocore_session.get_component('credential_provider').insert_before(
+        'env', CachedCredentialProvider(credentials)
+    )
+    botocore_session.set_default_client_config(retry.CLIENT_CONFIG)
+    session = boto3.session.Session(
+        botocore_session=botocore_session, region_name=region
+    )
+    dedupe_search_paths(botocore_session.get_component('data_loader'))
+    retry.DEFAULT_POLICY.install(session)
+    metrics.DEFAULT_METRICS.install(session)
+    return session
+
+
+def clear_cache():
+    """Forget every cached credential."""
+    with _lock:
+        _credentials.clear()
+        _credentials_locks.clear()
+
+
+def add_session_arguments(parser):
+    """Add the non-interactive credential options to a parser."""
+    parser.add_argument(
+        '--profile', help="AWS profile to use instead of the default chain"
+    )
+    parser.add_argument(
+        '--role-arn', help="IAM role to assume with the base credentials"
+    )
+    parser.add_argument(
+        '--region', help="AWS region (default: from the environment/profile)"
+    )
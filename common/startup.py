@@ -0,0 +1,78 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Seconds a tool may take from interpreter start to its first clients
+STARTUP_BUDGET = 2.0
+
+# Cold starts measured per tool; the median is checked against the budget
+STARTUP_RUNS = 3
+
+# Run in a fresh interpreter: import the tool, then build a client of each
+# of its SERVICES with dummy credentials, so that imports and service
+# model loading are timed but no credential lookup or API call is made
+PROBE = """
+import importlib.util
+import sys
+
+import boto3
+
+spec = importlib.util.spec_from_file_location('tool', sys.argv[1])
+tool = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(tool)
+session = boto3.session.Session(aws_access_key_id='startup',
+                                aws_secret_access_key='probe',
+                                region_name='us-east-1')
+for service in tool.SERVICES:
+    session.client(service)
+"""
+
+
+def measure_startup(script, runs=STARTUP_RUNS):
+    """Return the wall time, in seconds, of `runs` cold starts of a tool."""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [
+        os.getcwd(), os.path.dirname(os.path.abspath(script)),
+        env.get('PYTHONPATH'),
+    ]))
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, '-c', PROBE, script], env=env,
+                       check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - started)
+    return times
+
+
+def main(argv=None):
+    """Measure the cold start of tools; fail if one is over the budget."""
+    parser = argparse.ArgumentParser(
+        description="Measure the cold start time of the tools."
+    )
+    parser.add_argument('scripts', nargs='+', help="Tool scripts to start")
+    parser.add_argument(
+        '--budget', type=float, default=STARTUP_BUDGET,
+        help=f"Maximum median cold start in seconds "
+             f"(default: {STARTUP_BUDGET})"
+    )
+    parser.add_argument(
+        '--runs', type=int, default=STARTUP_RUNS,
+        help=f"Cold starts per tool (default: {STARTUP_RUNS})"
+    )
+    args = parser.parse_args(argv)
+
+    over_budget = 0
+    for script in args.scripts:
+        median = statistics.median(measure_startup(script, args.runs))
+        verdict = "ok" if median <= args.budget else "OVER BUDGET"
+        print(f"{os.path.basename(script)}: cold start {median:.3f}s "
+              f"(budget {args.budget:.3f}s) {verdict}")
+        over_budget += median > args.budget
+    return 1 if over_budget else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
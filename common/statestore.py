@@ -0,0 +1,144 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from common import results
+
+# Seconds after which a resource is re-checked even if its change marker
+# did not move, in case a change left no trace in the data it is read from
+MAX_AGE = 86400
+
+
+def make_marker(value):
+    """Return a short stable fingerprint of any JSON-serializable value."""
+    text = json.dumps(value, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()[:32]
+
+
+def resource_key(tool, account_id, region, resource):
+    """Return the primary key of a resource; missing parts become ''."""
+    return (tool, account_id or '', region or '', resource)
+
+
+class StateStore:
+    """
+    SQLite record of the last check of every resource, so later runs only
+    re-check resources that are new, changed, not compliant or too old.
+    Safe to share between the multi-target runner's worker threads.
+    """
+
+    def __init__(self, path, max_age=MAX_AGE):
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS resource_state ('
+            ' tool TEXT NOT NULL,'
+            ' account_id TEXT NOT NULL,'
+            ' region TEXT NOT NULL,'
+            ' resource TEXT NOT NULL,'
+            ' marker TEXT NOT NULL,'
+            ' status TEXT NOT NULL,'
+            ' checked_at REAL NOT NULL,'
+            ' PRIMARY KEY (tool, account_id, region, resource))'
+        )
+
+    def last_status(self, tool, target, resource, marker):
+        """
+        Return the status recorded for a resource if it can be skipped:
+        same marker, found compliant and recently enough. Else None.
+        A remediated resource is checked again: its marker predates the
+        fix, so it cannot tell a fix that held from one that did not.
+        """
+        account_id = target.account_id if target else None
+        region = target.region if target else None
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT marker, status, checked_at FROM resource_state'
+                ' WHERE tool = ? AND account_id = ? AND region = ?'
+                ' AND resource = ?',
+                resource_key(tool, account_id, region, resource)
+            ).fetchone()
+        if row is None or row[0] != marker or row[1] != results.COMPLIANT:
+            return None
+        if self.max_age and time.time() - row[2] >= self.max_age:
+            return None
+        return row[1]
+
+    def partition(self, tool, target, markers):
+        """
+        Split {resource: marker} into the resources to check, in order,
+        and a {resource: last status} dict of the ones to skip.
+        """
+        changed = []
+        unchanged = {}
+        for resource, marker in markers.items():
+            status = self.last_status(tool, target, resource, marker)
+            if status is None:
+                changed.append(resource)
+            else:
+                unchanged[resource] = status
+        return changed, unchanged
+
+    def record_findings(self, findings, markers):
+        """Record the outcome of checked findings with their markers."""
+        now = time.time()
+        rows = [
+            resource_key(finding.tool, finding.account_id, finding.region,
+                         finding.resource)
+            + (markers[finding.resource], finding.status, now)
+            for finding in findings
+            if finding.status != results.UNCHANGED
+            and finding.resource in markers
+        ]
+        with self.lock:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO resource_state'
+                ' (tool, account_id, region, resource, marker, status,'
+                ' checked_at) VALUES (?, ?, ?, ?, ?, ?, ?)', rows
+            )
+            self.connection.commit()
+
+    def close(self):
+        """Commit and close the store."""
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def unchanged_findings(tool, check, unchanged, target=None):
+    """Return UNCHANGED findings for the resources a run skipped."""
+    return [
+        results.make_finding(tool, check, resource, results.UNCHANGED,
+                             {'last_status': status}, target)
+        for resource, status in unchanged.items()
+    ]
+
+
+def add_state_arguments(parser):
+    """Add the incremental scan options shared by the tools."""
+    parser.add_argument(
+        '--state',
+        help="SQLite file of previous results; only new or changed "
+             "resources are re-checked"
+    )
+    parser.add_argument(
+        '--state-max-age', type=float, default=MAX_AGE,
+        help=f"Seconds before an unchanged resource is re-checked anyway "
+             f"(default: {MAX_AGE}, 0: never)"
+    )
+
+
+def store_from_args(args):
+    """Return the StateStore of the command line options, or None."""
+    if not args.state:
+        return None
+    return StateStore(args.state, args.state_max_age)
@@ -0,0 +1,76 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+from common import checkpoints, results
+from common.runner import Target
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.json')
+        os.close(handle)
+        os.remove(self.path)
+        self.addCleanup(lambda: os.path.exists(self.path)
+                        and os.remove(self.path))
+        self.target = Target('111', region='us-east-1')
+
+    def finding(self, resource, status):
+        return results.make_finding('s3', 's3-bpa', resource, status,
+                                    target=self.target)
+
+    def test_resume_skips_done_resources_and_retries_errors(self):
+        with checkpoints.Checkpoint(self.path) as checkpoint:
+            checkpoint.record('s3', self.target, [
+                self.finding('fixed', results.REMEDIATED),
+                self.finding('failed', results.ERROR),
+            ], token='page-2')
+
+        with checkpoints.Checkpoint(self.path, resume=True) as checkpoint:
+            todo, done = checkpoint.partition(
+                's3', self.target, ['fixed', 'failed', 'new'])
+            token = checkpoint.token('s3', self.target)
+
+        self.assertEqual(todo, ['failed', 'new'])
+        self.assertEqual(done, {'fixed': results.REMEDIATED})
+        self.assertEqual(token, 'page-2')
+
+    def test_fresh_run_ignores_the_old_checkpoint(self):
+        with checkpoints.Checkpoint(self.path) as checkpoint:
+            checkpoint.record('s3', self.target,
+                              [self.finding('fixed', results.REMEDIATED)])
+
+        checkpoint = checkpoints.Checkpoint(self.path)
+
+        self.assertEqual(checkpoint.done('s3', self.target), {})
+
+    def test_progress_is_saved_every_interval(self):
+        checkpoint = checkpoints.Checkpoint(self.path, interval=0)
+        checkpoint.record('s3', self.target,
+                          [self.finding('fixed', results.COMPLIANT)])
+
+        # Written without close(), as if the process was killed here
+        resumed = checkpoints.Checkpoint(self.path, resume=True)
+        self.assertEqual(resumed.done('s3', self.target),
+                         {'fixed': results.COMPLIANT})
+
+    def test_targets_are_kept_apart(self):
+        checkpoint = checkpoints.Checkpoint(self.path)
+        checkpoint.record('s3', self.target,
+                          [self.finding('fixed', results.COMPLIANT)])
+
+        self.assertEqual(
+            checkpoint.done('s3', self.target._replace(region='eu-west-1')),
+            {})
+        self.assertEqual(checkpoint.done('rds', self.target), {})
+
+    def test_resume_needs_a_checkpoint_file(self):
+        with self.assertRaises(RuntimeError):
+            checkpoints.checkpoint_from_args(
+                MagicMock(checkpoint=None, resume=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
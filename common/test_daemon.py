@@ -0,0 +1,128 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+from common import daemon, results
+from common.runner import Target
+
+
+def cloudtrail(event_name, account_id='111', **request):
+    """Return a CloudTrail record of an API call."""
+    return {'eventName': event_name, 'recipientAccountId': account_id,
+            'awsRegion': 'us-east-1', 'requestParameters': request}
+
+
+class TestDaemon(unittest.TestCase):
+
+    def setUp(self):
+        self.handler = MagicMock(side_effect=lambda session, record, target: [
+            results.make_finding('s3', 's3-bpa', record['requestParameters']
+                                 ['bucketName'], results.COMPLIANT,
+                                 target=target)
+        ])
+        self.session_factory = MagicMock()
+        self.writer = MagicMock()
+        self.service = daemon.Daemon({'CreateBucket': self.handler},
+                                     self.session_factory, self.writer)
+
+    def test_file_events_are_read_line_by_line(self):
+        handle, path = tempfile.mkstemp(suffix='.jsonl')
+        with os.fdopen(handle, 'w') as events_file:
+            events_file.write(json.dumps(cloudtrail('CreateBucket')) + '\n\n')
+            events_file.write(json.dumps(cloudtrail('ListBuckets')) + '\n')
+        self.addCleanup(os.remove, path)
+
+        events = list(daemon.iter_file_events(path))
+
+        self.assertEqual([event['eventName'] for event, _ in events],
+                         ['CreateBucket', 'ListBuckets'])
+
+    def test_eventbridge_events_are_unwrapped(self):
+        event = {'detail-type': 'AWS API Call via CloudTrail',
+                 'detail': cloudtrail('CreateBucket', bucketName='b1')}
+
+        self.assertTrue(self.service.handle(event))
+
+        finding = self.writer.write.call_args[0][0]
+        self.assertEqual(finding.resource, 'b1')
+        self.assertEqual(finding.account_id, '111')
+
+    def test_failed_and_unknown_calls_are_ignored(self):
+        failed = dict(cloudtrail('CreateBucket', bucketName='b1'),
+                      errorCode='AccessDenied')
+
+        self.assertTrue(self.service.handle(failed))
+        self.assertTrue(self.service.handle(cloudtrail('ListBuckets')))
+        self.handler.assert_not_called()
+
+    def test_one_session_per_target(self):
+        self.service.run([(cloudtrail('CreateBucket', bucketName='b1'), None),
+                          (cloudtrail('CreateBucket', bucketName='b2'), None)])
+
+        self.session_factory.assert_called_once_with(
+            Target('111', region='us-east-1'))
+        self.assertEqual(self.service.handled, 2)
+
+    def test_handler_errors_do_not_stop_the_service(self):
+        self.handler.side_effect = [RuntimeError("Throttling"), []]
+
+        self.service.run([(cloudtrail('CreateBucket', bucketName='b1'), None),
+                          (cloudtrail('CreateBucket', bucketName='b2'), None)])
+
+        self.assertEqual((self.service.handled, self.service.failed), (1, 1))
+
+    def test_only_handled_sqs_messages_are_deleted(self):
+        self.handler.side_effect = [RuntimeError("Throttling"), []]
+        sqs = MagicMock()
+        sqs.receive_message.side_effect = [{'Messages': [
+            {'MessageId': 'm1', 'ReceiptHandle': 'r1',
+             'Body': json.dumps(cloudtrail('CreateBucket', bucketName='b1'))},
+            {'MessageId': 'm2', 'ReceiptHandle': 'r2', 'Body': 'not json'},
+            {'MessageId': 'm3', 'ReceiptHandle': 'r3',
+             'Body': json.dumps(cloudtrail('CreateBucket', bucketName='b2'))},
+        ]}, KeyboardInterrupt]
+
+        with self.assertRaises(KeyboardInterrupt):
+            self.service.run(daemon.iter_sqs_events(sqs, 'queue'))
+
+        # The failed event stays queued for redelivery
+        self.assertEqual(
+            [call[1]['ReceiptHandle']
+             for call in sqs.delete_message.call_args_list],
+            ['r2', 'r3'])
+
+    def test_events_with_error_findings_are_not_deleted(self):
+        self.handler.side_effect = [[
+            results.make_finding('rds', 'rds-public', 'db', results.ERROR,
+                                 {'error': 'InvalidDBInstanceState'})
+        ]]
+        sqs = MagicMock()
+        sqs.receive_message.side_effect = [{'Messages': [
+            {'MessageId': 'm1', 'ReceiptHandle': 'r1',
+             'Body': json.dumps(cloudtrail('CreateBucket', bucketName='b1'))},
+        ]}, KeyboardInterrupt]
+
+        with self.assertRaises(KeyboardInterrupt):
+            self.service.run(daemon.iter_sqs_events(sqs, 'queue'))
+
+        sqs.delete_message.assert_not_called()
+        self.assertEqual((self.service.handled, self.service.failed), (0, 1))
+        self.writer.write.assert_called_once()
+
+    def test_accounts_outside_targets_are_rejected(self):
+        handle, path = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(handle, 'w') as targets_file:
+            json.dump([{'account_id': '111'}], targets_file)
+        self.addCleanup(os.remove, path)
+        args = MagicMock(targets=path)
+
+        factory = daemon.session_factory_from_args(args, MagicMock())
+
+        with self.assertRaises(RuntimeError):
+            factory(Target('222', region='us-east-1'))
+
+
+if __name__ == '__main__':
+    unittest.main()
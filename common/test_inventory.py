@@ -0,0 +1,56 @@
+import os
+import tempfile
+import unittest
+
+from common import inventory
+from common.runner import Target
+
+
+class TestInventory(unittest.TestCase):
+
+    def test_make_table_is_columnar_and_targeted(self):
+        table = inventory.make_table(
+            [('db-1', True), ('db-2', False)],
+            ('identifier', 'publicly_accessible'),
+            Target('111', region='us-east-1')
+        )
+
+        self.assertEqual(table, {
+            'account_id': ['111', '111'],
+            'region': ['us-east-1', 'us-east-1'],
+            'identifier': ['db-1', 'db-2'],
+            'publicly_accessible': [True, False],
+        })
+        self.assertEqual(inventory.table_length(table), 2)
+
+    def test_account_wide_tables_merge_once(self):
+        def collect(region):
+            target = Target('111', region=region)
+            return {
+                'instances': inventory.make_table(
+                    [(f'i-{region}',)], ('instance_id',), target),
+                'roles': inventory.make_table(
+                    [('Role',)], ('role_name',), target, regional=False),
+            }
+
+        tables = inventory.merge_tables(
+            [collect('us-east-1'), collect('eu-west-1')])
+
+        self.assertEqual(tables['instances']['region'],
+                         ['us-east-1', 'eu-west-1'])
+        self.assertEqual(tables['roles'],
+                         {'account_id': ['111'], 'region': [None],
+                          'role_name': ['Role']})
+
+    def test_snapshot_round_trip(self):
+        tables = {'dbs': inventory.make_table(
+            [('db-1', True)], ('identifier', 'publicly_accessible'))}
+        with tempfile.TemporaryDirectory() as tmp:
+            for name in ('inventory.json', 'inventory.json.gz'):
+                path = os.path.join(tmp, name)
+                inventory.write_snapshot(path, tables)
+                self.assertEqual(inventory.read_snapshot(path), tables)
+
+
+if __name__ == '__main__':
+    unittest.main()
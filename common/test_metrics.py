@@ -0,0 +1,91 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+from botocore.credentials import Credentials
+
+from common import metrics, retry, sessions
+from common.test_retry import LIST_ROLES, THROTTLED, fake_http
+
+
+class TestHistogram(unittest.TestCase):
+
+    def test_quantiles_come_from_bucket_bounds(self):
+        histogram = metrics.Histogram(buckets=(0.1, 1.0))
+        for value in (0.05, 0.05, 0.5, 5.0):
+            histogram.observe(value)
+
+        self.assertEqual(histogram.counts, [2, 1, 1])
+        self.assertEqual(histogram.quantile(0.5), 0.1)
+        self.assertEqual(histogram.quantile(0.75), 1.0)
+        self.assertEqual(histogram.quantile(1.0), float('inf'))
+
+
+class TestBotoInstrumentation(unittest.TestCase):
+
+    def setUp(self):
+        sessions.clear_cache()
+        self.addCleanup(sessions.clear_cache)
+        self.metrics = metrics.Metrics()
+        policy = retry.RetryPolicy(base_delay=0, metrics=self.metrics)
+        patcher = patch.object(retry, 'DEFAULT_POLICY', policy)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch.object(metrics, 'DEFAULT_METRICS', self.metrics)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_client(self, responses):
+        with patch.object(sessions, 'resolve_credentials',
+                          return_value=Credentials('key', 'secret')):
+            session = sessions.get_session(region='us-east-1')
+        session.events.register('before-send', fake_http(responses, []))
+        return session.client('iam')
+
+    def test_calls_throttles_and_retries_are_recorded(self):
+        client = self.make_client(
+            [(400, THROTTLED), (200, LIST_ROLES), (200, LIST_ROLES)]
+        )
+        client.list_roles()
+        client.list_roles()
+
+        stats = self.metrics.operations[('iam', 'ListRoles')]
+        self.assertEqual(stats.calls, 2)
+        self.assertEqual(stats.errors, 0)
+        self.assertEqual(stats.throttles, 1)
+        self.assertEqual(stats.retries, 1)
+        self.assertEqual(stats.latency.count, 2)
+
+    def test_prometheus_file(self):
+        self.make_client([(200, LIST_ROLES)]).list_roles()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'scan.prom')
+            metrics.report_from_args(MagicMock(metrics=path), self.metrics)
+            with open(path) as prom_file:
+                text = prom_file.read()
+
+        self.assertIn('scan_calls_total{service="iam",operation="ListRoles"}'
+                      ' 1', text)
+        self.assertIn('scan_call_duration_seconds_bucket{service="iam",'
+                      'operation="ListRoles",le="+Inf"} 1', text)
+
+
+class TestRequestsHook(unittest.TestCase):
+
+    def test_responses_are_recorded_per_method(self):
+        recorder = metrics.Metrics()
+        hook = recorder.response_hook('http')
+        response = MagicMock(status_code=404)
+        response.request.method = 'HEAD'
+        response.elapsed.total_seconds.return_value = 0.2
+
+        hook(response)
+
+        stats = recorder.operations[('http', 'HEAD')]
+        self.assertEqual((stats.calls, stats.errors), (1, 1))
+        self.assertEqual(stats.latency.sum, 0.2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+from common import plan
+from common.runner import Target
+
+
+class TestPlan(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.jsonl')
+        os.close(handle)
+        self.addCleanup(os.remove, self.path)
+
+    def test_plan_round_trip(self):
+        target = Target('111', 'Audit', 'us-east-1')
+        with plan.PlanWriter(self.path) as writer:
+            writer.write(plan.plan_action(
+                's3', 's3', 'put_public_access_block', 'bucket',
+                {'Bucket': 'bucket'}, target
+            ))
+
+        actions = list(plan.read_plan(self.path))
+        self.assertEqual(len(actions), 1)
+        self.assertEqual(plan.group_by_target(actions), {target: actions})
+
+    def test_apply_runs_allowed_operations_per_target(self):
+        actions = [
+            plan.plan_action('rds', 'rds', 'modify_db_instance', f'db-{n}',
+                             {'DBInstanceIdentifier': f'db-{n}'},
+                             Target(str(n % 2), region='us-east-1'))
+            for n in range(10)
+        ]
+        sessions = {}
+
+        def session_factory(target):
+            sessions[target] = MagicMock()
+            return sessions[target]
+
+        results = plan.apply_plan(
+            actions, {('rds', 'modify_db_instance')}, session_factory,
+            batch_size=3
+        )
+
+        self.assertEqual(len(results), 10)
+        self.assertTrue(all(error is None for _, error in results))
+        self.assertEqual(len(sessions), 2)
+        for session in sessions.values():
+            session.client.assert_called_once_with('rds')
+            self.assertEqual(
+                session.client.return_value.modify_db_instance.call_count, 5
+            )
+
+    def test_apply_rejects_operations_not_allowed(self):
+        session = MagicMock()
+        action = plan.plan_action('s3', 's3', 'delete_bucket', 'bucket',
+                                  {'Bucket': 'bucket'})
+
+        [(_, error)] = plan.apply_plan([action], set(), lambda t: session)
+
+        self.assertIsInstance(error, ValueError)
+        session.client.return_value.delete_bucket.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import csv
+import json
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import MagicMock
+
+from common import results
+from common.runner import Target
+
+
+def make_findings(count):
+    """Return count findings alternating between two statuses."""
+    target = Target('111', region='us-east-1')
+    return [
+        results.make_finding(
+            's3', 's3-bpa', f'bucket-{n}',
+            results.COMPLIANT if n % 2 else results.REMEDIATED,
+            {'settings': {'BlockPublicAcls': bool(n % 2)}}, target
+        )
+        for n in range(count)
+    ]
+
+
+class TestResults(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def path(self, name):
+        return os.path.join(self.tmp.name, name)
+
+    def test_finding_takes_account_and_region_from_target(self):
+        finding = make_findings(1)[0]
+        self.assertEqual(finding.account_id, '111')
+        self.assertEqual(finding.region, 'us-east-1')
+        self.assertFalse(hasattr(finding, '__dict__'))
+
+    def test_summarize_counts_statuses(self):
+        self.assertEqual(results.summarize(make_findings(5)),
+                         {'remediated': 3, 'compliant': 2})
+
+    def test_json_lines_are_streamed(self):
+        path = self.path('findings.jsonl')
+        with results.open_writer(path) as writer:
+            self.assertIsInstance(writer, results.JSONLinesWriter)
+            writer.write(make_findings(1)[0])
+            self.assertEqual(writer.count, 1)
+
+        with open(path) as output:
+            records = [json.loads(line) for line in output]
+        self.assertEqual(records[0]['resource'], 'bucket-0')
+        self.assertEqual(records[0]['detail'],
+                         {'settings': {'BlockPublicAcls': False}})
+
+    def test_csv_is_written_in_batches(self):
+        path = self.path('findings.csv')
+        writer = results.open_writer(path)
+        writer.batch_size = 4
+        writer.write_batch = MagicMock(wraps=writer.write_batch)
+
+        threads = [
+            threading.Thread(target=results.write_findings,
+                             args=(writer, make_findings(5)))
+            for _ in range(2)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        writer.close()
+
+        # 10 records: two full batches of 4 plus the remainder on close
+        self.assertEqual(writer.write_batch.call_count, 3)
+        with open(path, newline='') as output:
+            rows = list(csv.DictReader(output))
+        self.assertEqual(len(rows), 10)
+        self.assertEqual(json.loads(rows[0]['detail']),
+                         {'settings': {'BlockPublicAcls': False}})
+
+    def test_output_format_overrides_extension(self):
+        path = self.path('findings.out')
+        with results.open_writer(path, 'csv') as writer:
+            self.assertIsInstance(writer, results.CSVWriter)
+
+    def test_parquet_needs_pyarrow(self):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            with self.assertRaises(RuntimeError):
+                results.open_writer(self.path('findings.parquet'))
+            return
+
+        path = self.path('findings.parquet')
+        with results.open_writer(path) as writer:
+            results.write_findings(writer, make_findings(3))
+        import pyarrow.parquet
+        self.assertEqual(pyarrow.parquet.read_table(path).num_rows, 3)
+
+    def test_no_output_discards_findings(self):
+        args = MagicMock(output=None)
+        with results.writer_from_args(args) as writer:
+            results.write_findings(writer, make_findings(2))
+        self.assertIsInstance(writer, results.NullWriter)
+
+
+if __name__ == '__main__':
+    unittest.main()
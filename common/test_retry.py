@@ -0,0 +1,104 @@
+import unittest
+from unittest.mock import patch
+
+from botocore.awsrequest import AWSResponse
+from botocore.credentials import Credentials
+from botocore.exceptions import ClientError
+
+from common import retry, sessions
+
+THROTTLED = (b'<ErrorResponse><Error><Type>Sender</Type>'
+             b'<Code>Throttling</Code><Message>Rate exceeded</Message>'
+             b'</Error></ErrorResponse>')
+
+LIST_ROLES = (b'<ListRolesResponse><ListRolesResult><Roles/>'
+              b'<IsTruncated>false</IsTruncated></ListRolesResult>'
+              b'</ListRolesResponse>')
+
+
+class RawBody:
+    """Minimal urllib3-like body for AWSResponse."""
+
+    def __init__(self, body):
+        self.body = body
+
+    def stream(self, *args, **kwargs):
+        yield self.body
+
+
+def fake_http(responses, calls):
+    """before-send handler answering with the queued (status, body)."""
+    def send(request, **kwargs):
+        status, body = responses.pop(0)
+        calls.append(status)
+        return AWSResponse(request.url, status, {}, RawBody(body))
+    return send
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def setUp(self):
+        sessions.clear_cache()
+        self.addCleanup(sessions.clear_cache)
+        self.policy = retry.RetryPolicy(base_delay=0)
+        patcher = patch.object(retry, 'DEFAULT_POLICY', self.policy)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_client(self, responses, calls):
+        with patch.object(sessions, 'resolve_credentials',
+                          return_value=Credentials('key', 'secret')):
+            session = sessions.get_session(region='us-east-1')
+        session.events.register('before-send', fake_http(responses, calls))
+        return session.client('iam')
+
+    def test_throttled_calls_are_retried_and_slow_down(self):
+        calls = []
+        client = self.make_client(
+            [(400, THROTTLED), (400, THROTTLED), (200, LIST_ROLES)], calls
+        )
+
+        self.assertEqual(client.list_roles()['Roles'], [])
+        self.assertEqual(calls, [400, 400, 200])
+        self.assertEqual(self.policy.throttles, 2)
+        limiter = self.policy.limiter('iam', client.meta.region_name)
+        self.assertLess(limiter.rate, limiter.max_rate)
+
+    def test_exhausted_budget_surfaces_the_error(self):
+        self.policy.budget = retry.RetryBudget(capacity=5, cost=5)
+        calls = []
+        client = self.make_client([(400, THROTTLED)] * 3, calls)
+
+        with self.assertRaises(ClientError) as raised:
+            client.list_roles()
+
+        self.assertEqual(raised.exception.response['Error']['Code'],
+                         'Throttling')
+        self.assertEqual(calls, [400, 400])
+
+    def test_non_throttling_errors_are_not_retried(self):
+        calls = []
+        body = (b'<ErrorResponse><Error><Code>NoSuchEntity</Code>'
+                b'<Message>missing</Message></Error></ErrorResponse>')
+        client = self.make_client([(404, body)], calls)
+
+        with self.assertRaises(ClientError):
+            client.list_roles()
+        self.assertEqual(calls, [404])
+
+
+class TestAdaptiveRateLimiter(unittest.TestCase):
+
+    def test_backs_off_and_recovers(self):
+        limiter = retry.AdaptiveRateLimiter(max_rate=10, min_rate=1,
+                                            backoff=0.5, recovery=1)
+        limiter.on_throttle()
+        limiter.on_throttle()
+        self.assertEqual(limiter.rate, 2.5)
+        for _ in range(20):
+            limiter.on_success()
+        self.assertEqual(limiter.rate, 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+import json
+import os
+import tempfile
+import unittest
+
+from common import inventory, results, rules
+from common.runner import Target
+
+ACCOUNT = Target('111', region='us-east-1')
+OTHER_ACCOUNT = Target('222', region='us-east-1')
+
+
+def make_tables():
+    """Return an inventory of two accounts with one offender per check."""
+    def role_tables(target, profile_name):
+        return {
+            'instances': inventory.make_table(
+                [('i-1', 'running', profile_name)],
+                ('instance_id', 'state', 'profile_name'), target),
+            'profiles': inventory.make_table(
+                [('web', 'WebRole')], ('profile_name', 'role_name'),
+                target, regional=False),
+            'role_policies': inventory.make_table(
+                [('WebRole', 'ReadOnly', 'arn:aws:iam::aws:policy/ReadOnly'),
+                 ('WebRole', 'Custom',
+                  'arn:aws:iam::aws:policy/AmazonSSMFullAccess')],
+                ('role_name', 'policy_name', 'policy_arn'),
+                target, regional=False),
+        }
+
+    tables = inventory.merge_tables([
+        role_tables(ACCOUNT, 'web'),
+        # The same role exists in the other account, but no instance uses it
+        role_tables(OTHER_ACCOUNT, None),
+    ])
+    tables['dbs'] = inventory.make_table(
+        [('db-1', 'instance', True, 'available'),
+         ('db-2', 'instance', False, 'available')],
+        ('identifier', 'kind', 'publicly_accessible', 'status'), ACCOUNT)
+    tables['buckets'] = inventory.make_table(
+        [('flagged', False, True, False, True, True, None),
+         ('clean', False, True, True, True, True, None),
+         ('unread', False, None, None, None, None, 'AccessDenied'),
+         ('covered', True, None, None, None, None, None)],
+        ('bucket', 'account_blocked', 'block_public_acls',
+         'ignore_public_acls', 'block_public_policy',
+         'restrict_public_buckets', 'error'), ACCOUNT)
+    return tables
+
+
+class TestRules(unittest.TestCase):
+
+    def test_builtin_rules_flag_each_offender(self):
+        findings = rules.evaluate_rules(rules.RULES, make_tables())
+
+        self.assertEqual(
+            sorted((f.check, f.resource, f.account_id) for f in findings),
+            [('ec2-ssm', 'WebRole', '111'), ('rds-public', 'db-1', '111'),
+             ('s3-bpa', 'flagged', '111')]
+        )
+        self.assertTrue(all(f.status == results.NONCOMPLIANT
+                            for f in findings))
+        ec2 = next(f for f in findings if f.check == 'ec2-ssm')
+        self.assertEqual(ec2.detail, {'policy_arn': [
+            'arn:aws:iam::aws:policy/AmazonSSMFullAccess']})
+
+    def test_operators(self):
+        tables = {'items': {'account_id': [None] * 3, 'region': [None] * 3,
+                            'name': ['alpha', 'beta', None]}}
+        for condition, expected in [
+            (['name', 'eq', 'beta'], ['beta']),
+            (['name', 'ne', 'beta'], ['alpha', None]),
+            (['name', 'in', ['alpha', 'gamma']], ['alpha']),
+            (['name', 'matches', '^b'], ['beta']),
+            ({'any': [['name', 'contains', 'lp'],
+                      ['name', 'eq', 'beta']]}, ['alpha', 'beta']),
+        ]:
+            rule = {'name': 'r', 'tool': 't', 'table': 'items',
+                    'resource': 'name', 'where': [condition]}
+            findings = rules.evaluate_rules([rule], tables)
+            self.assertEqual([f.resource for f in findings], expected)
+
+    def test_unknown_operator_is_rejected(self):
+        rule = {'name': 'r', 'tool': 't', 'table': 'items',
+                'resource': 'name', 'where': [['name', 'like', 'a%']]}
+        with self.assertRaises(ValueError):
+            rules.compile_rule(rule)
+
+    def test_missing_table_matches_nothing(self):
+        self.assertEqual(rules.evaluate_rules(rules.RULES, {}), [])
+
+    def test_rules_load_from_json(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'rules.json')
+            with open(path, 'w') as rules_file:
+                json.dump(rules.RULES[1:2], rules_file)
+            self.assertEqual(rules.load_rules(path), rules.RULES[1:2])
+        self.assertIs(rules.load_rules(), rules.RULES)
+
+
+if __name__ == '__main__':
+    unittest.main()
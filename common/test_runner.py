@@ -0,0 +1,132 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+from botocore.hooks import HierarchicalEmitter
+
+from common import runner
+from common.ratelimit import TokenBucket
+
+
+class TestTargets(unittest.TestCase):
+
+    def test_load_targets_expands_regions(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'targets.json')
+            with open(path, 'w') as targets_file:
+                json.dump([
+                    {'account_id': '111', 'role_name': 'Audit',
+                     'regions': ['us-east-1', 'eu-west-1']},
+                    {'account_id': '222', 'region': 'sa-east-1'},
+                ], targets_file)
+            targets = runner.load_targets(path)
+
+        self.assertEqual(targets, [
+            runner.Target('111', 'Audit', 'us-east-1'),
+            runner.Target('111', 'Audit', 'eu-west-1'),
+            runner.Target('222', None, 'sa-east-1'),
+        ])
+
+    def test_interleave_and_one_per_account(self):
+        targets = [runner.Target('a', region='r1'),
+                   runner.Target('a', region='r2'),
+                   runner.Target('b', region='r1')]
+
+        self.assertEqual(
+            [(t.account_id, t.region)
+             for t in runner.interleave_accounts(targets)],
+            [('a', 'r1'), ('b', 'r1'), ('a', 'r2')]
+        )
+        self.assertEqual(len(runner.one_per_account(targets)), 2)
+
+
+class TestRunTargets(unittest.TestCase):
+
+    def test_results_and_errors_are_aggregated(self):
+        def task(session, target):
+            if target.region == 'bad':
+                raise RuntimeError("boom")
+            return target.region
+
+        targets = [runner.Target('1', region='good'),
+                   runner.Target('2', region='bad')]
+        results = runner.run_targets(
+            targets, task, session_factory=lambda target: MagicMock()
+        )
+
+        by_region = {r.target.region: r for r in results}
+        self.assertEqual(by_region['good'].result, 'good')
+        self.assertIsNone(by_region['good'].error)
+        self.assertIsInstance(by_region['bad'].error, RuntimeError)
+
+    def test_each_target_gets_its_own_session(self):
+        sessions = []
+
+        def factory(target):
+            session = MagicMock()
+            sessions.append((threading.get_ident(), session))
+            return session
+
+        seen = []
+        targets = [runner.Target(str(n), region='r') for n in range(6)]
+        runner.run_targets(targets, lambda s, t: seen.append(s),
+                           max_workers=3, session_factory=factory)
+
+        self.assertEqual(len({id(s) for s in seen}), 6)
+
+    def test_per_account_limit(self):
+        lock = threading.Lock()
+        running = {'now': 0, 'max': 0}
+
+        def task(session, target):
+            with lock:
+                running['now'] += 1
+                running['max'] = max(running['max'], running['now'])
+            time.sleep(0.02)
+            with lock:
+                running['now'] -= 1
+
+        targets = [runner.Target('same', region=str(n)) for n in range(6)]
+        runner.run_targets(targets, task, max_workers=6, per_account=2,
+                           session_factory=lambda target: MagicMock())
+
+        self.assertLessEqual(running['max'], 2)
+
+    def test_rate_limit_hooks_session_events(self):
+        session = MagicMock()
+        runner.run_targets([runner.Target('1')], lambda s, t: None,
+                           rate_limit=5, session_factory=lambda t: session)
+
+        session.events.register.assert_called_once()
+        self.assertEqual(session.events.register.call_args[0][0],
+                         'before-call')
+
+    def test_reused_session_is_throttled_once_per_call(self):
+        session = MagicMock(events=HierarchicalEmitter())
+        with patch.object(runner, 'TokenBucket') as bucket:
+            runner.run_targets(
+                [runner.Target('1'), runner.Target('1')],
+                lambda s, t: s.events.emit('before-call.s3.ListBuckets'),
+                max_workers=1, rate_limit=5,
+                session_factory=lambda t: session)
+
+        # Two calls, one token each
+        self.assertEqual(bucket.return_value.acquire.call_count, 2)
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_acquire_waits_for_refill(self):
+        bucket = TokenBucket(rate=50, burst=1)
+        start = time.monotonic()
+        for _ in range(3):
+            bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.03)
+
+
+if __name__ == "__main__":
+    unittest.main()
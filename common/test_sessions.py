@@ -0,0 +1,103 @@
+import datetime
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+
+from botocore.credentials import Credentials
+
+from common import sessions
+
+
+class TestSessions(unittest.TestCase):
+
+    def setUp(self):
+        sessions.clear_cache()
+        self.addCleanup(sessions.clear_cache)
+
+    def test_credentials_are_resolved_once(self):
+        credentials = Credentials('key', 'secret')
+        with patch.object(sessions, 'resolve_credentials',
+                          return_value=credentials) as resolve:
+            threads = [
+                threading.Thread(target=sessions.get_credentials,
+                                 args=(None, 'arn:aws:iam::1:role/Audit'))
+                for _ in range(8)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        resolve.assert_called_once_with(None, 'arn:aws:iam::1:role/Audit',
+                                        None)
+
+    def test_sessions_share_the_cached_credentials(self):
+        credentials = Credentials('key', 'secret')
+        with patch.object(sessions, 'resolve_credentials',
+                          return_value=credentials):
+            first = sessions.get_session(region='us-east-1')
+            second = sessions.get_session(region='eu-west-1')
+
+        self.assertIsNot(first, second)
+        self.assertEqual(first.region_name, 'us-east-1')
+        self.assertIs(first.get_credentials(), credentials)
+        self.assertIs(second.get_credentials(), credentials)
+
+    def test_sessions_share_one_data_loader(self):
+        with patch.object(sessions, 'resolve_credentials',
+                          return_value=Credentials('key', 'secret')):
+            first = sessions.get_session(region='us-east-1')
+            second = sessions.get_session(region='eu-west-1')
+
+        loader = first._session.get_component('data_loader')
+        self.assertIs(loader, sessions.get_loader())
+        self.assertIs(second._session.get_component('data_loader'), loader)
+
+    def test_loader_search_paths_do_not_grow(self):
+        with patch.object(sessions, 'resolve_credentials',
+                          return_value=Credentials('key', 'secret')):
+            sessions.get_session()
+            paths = list(sessions.get_loader().search_paths)
+            for _ in range(5):
+                sessions.get_session()
+
+        self.assertEqual(sessions.get_loader().search_paths, paths)
+
+    def test_no_credentials_returns_none(self):
+        with patch.object(sessions, 'resolve_credentials', return_value=None):
+            self.assertIsNone(sessions.get_session())
+
+    def test_missing_credentials_are_not_cached(self):
+        credentials = Credentials('key', 'secret')
+        with patch.object(sessions, 'resolve_credentials',
+                          side_effect=[None, credentials]):
+            self.assertIsNone(sessions.get_credentials('audit'))
+            self.assertIs(sessions.get_credentials('audit'), credentials)
+
+    def test_assume_role_refresher(self):
+        base_session = MagicMock()
+        expiration = datetime.datetime(2030, 1, 1,
+                                       tzinfo=datetime.timezone.utc)
+        base_session.client.return_value.assume_role.return_value = {
+            'Credentials': {
+                'AccessKeyId': 'AK', 'SecretAccessKey': 'SK',
+                'SessionToken': 'TOKEN', 'Expiration': expiration,
+            }
+        }
+
+        refresh = sessions.assume_role_refresher(
+            base_session, 'arn:aws:iam::1:role/Audit', external_id='ext'
+        )
+
+        self.assertEqual(refresh(), {
+            'access_key': 'AK', 'secret_key': 'SK', 'token': 'TOKEN',
+            'expiry_time': expiration.isoformat(),
+        })
+        base_session.client.return_value.assume_role.assert_called_once_with(
+            RoleArn='arn:aws:iam::1:role/Audit',
+            RoleSessionName=sessions.SESSION_NAME, ExternalId='ext'
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
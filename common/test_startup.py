@@ -0,0 +1,30 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from common import startup
+
+
+class TestStartup(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.script = tempfile.mkstemp(suffix='.py')
+        with os.fdopen(handle, 'w') as script:
+            script.write("SERVICES = ('sts',)\n")
+        self.addCleanup(os.remove, self.script)
+
+    def test_cold_starts_are_timed_in_fresh_interpreters(self):
+        times = startup.measure_startup(self.script, runs=2)
+
+        self.assertEqual(len(times), 2)
+        self.assertTrue(all(seconds > 0 for seconds in times))
+
+    def test_over_budget_fails(self):
+        with patch.object(startup, 'measure_startup', return_value=[3.0]):
+            self.assertEqual(startup.main([self.script, '--budget', '2']), 1)
+            self.assertEqual(startup.main([self.script, '--budget', '4']), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+from common import results, statestore
+from common.runner import Target
+
+
+class TestStateStore(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.addCleanup(os.remove, self.path)
+        self.target = Target('111', region='us-east-1')
+        self.markers = {
+            'same': statestore.make_marker({'CreationDate': 1}),
+            'failed': statestore.make_marker({'CreationDate': 2}),
+            'fixed': statestore.make_marker({'CreationDate': 3}),
+        }
+        with statestore.StateStore(self.path) as store:
+            store.record_findings([
+                results.make_finding('s3', 's3-bpa', 'same',
+                                     results.COMPLIANT, target=self.target),
+                results.make_finding('s3', 's3-bpa', 'failed',
+                                     results.ERROR, target=self.target),
+                results.make_finding('s3', 's3-bpa', 'fixed',
+                                     results.REMEDIATED, target=self.target),
+            ], self.markers)
+
+    def test_only_compliant_resources_are_skipped(self):
+        markers = dict(self.markers, new='x')
+        with statestore.StateStore(self.path) as store:
+            changed, unchanged = store.partition('s3', self.target, markers)
+
+        self.assertEqual(changed, ['failed', 'fixed', 'new'])
+        self.assertEqual(unchanged, {'same': results.COMPLIANT})
+
+    def test_changed_marker_is_rechecked(self):
+        with statestore.StateStore(self.path) as store:
+            self.assertIsNone(store.last_status(
+                's3', self.target, 'same', statestore.make_marker('other')
+            ))
+
+    def test_state_is_kept_per_target(self):
+        with statestore.StateStore(self.path) as store:
+            changed, _ = store.partition(
+                's3', Target('222', region='us-east-1'), self.markers
+            )
+        self.assertEqual(changed, ['same', 'failed', 'fixed'])
+
+    def test_old_results_expire(self):
+        later = time.time() + statestore.MAX_AGE + 1
+        with statestore.StateStore(self.path) as store, \
+                patch('time.time', return_value=later):
+            self.assertIsNone(store.last_status(
+                's3', self.target, 'same', self.markers['same']
+            ))
+
+    def test_unchanged_findings_are_not_recorded_again(self):
+        skipped = statestore.unchanged_findings(
+            's3', 's3-bpa', {'same': results.COMPLIANT}, self.target
+        )
+        self.assertEqual(skipped[0].detail, {'last_status': 'compliant'})
+
+        later = time.time() + statestore.MAX_AGE + 1
+        with statestore.StateStore(self.path) as store:
+            store.record_findings(skipped, self.markers)
+            with patch('time.time', return_value=later):
+                # The original check time still counts towards max_age
+                self.assertIsNone(store.last_status(
+                    's3', self.target, 'same', self.markers['same']
+                ))
+
+
+if __name__ == '__main__':
+    unittest.main()
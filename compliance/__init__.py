@@ -0,0 +1 @@
+"""One command line running the ec2, rds and s3 checks in one process."""
@@ -0,0 +1,5 @@
+import sys
+
+from compliance import cli
+
+sys.exit(cli.main())
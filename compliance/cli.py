@@ -0,0 +1,268 @@
+import argparse
+import importlib
+import os
+import sys
+import threading
+import time
+from collections import Counter, namedtuple
+
+from common import (checkpoints, inventory, metrics, results, rules, runner,
+                    sessions, statestore)
+from common.runner import Target
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# A check the scan command can run: the tool module implementing it, the
+# directory holding the module and whether it is account-wide (one
+# region per account is enough)
+Check = namedtuple('Check', ['app_dir', 'module', 'account_wide'])
+
+CHECKS = {
+    'ec2-ssm': Check('ec2/app', 'EC2_remove_SSM_policy', False),
+    'rds-public': Check('rds/app', 'check_rds', False),
+    's3-bpa': Check('s3/app', 's3_block_public_access', True),
+}
+
+# One check of one target; it carries the Target fields so the runner
+# can schedule, throttle and authenticate it like a plain Target
+CheckTarget = namedtuple('CheckTarget', Target._fields + ('check',),
+                         defaults=(None,) * (len(Target._fields) + 1))
+
+
+def load_check(name):
+    """Import the tool module of a check, only once it is selected."""
+    check = CHECKS[name]
+    app_dir = os.path.join(ROOT, check.app_dir)
+    if app_dir not in sys.path:
+        sys.path.insert(0, app_dir)
+    return importlib.import_module(check.module)
+
+
+def parse_checks(value):
+    """Parse a comma-separated list of check names."""
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in names if name not in CHECKS]
+    if unknown or not names:
+        raise argparse.ArgumentTypeError(
+            f"unknown checks {', '.join(unknown) or '(none)'}; choose from "
+            f"{', '.join(CHECKS)}"
+        )
+    return names
+
+
+def check_targets(checks, targets):
+    """Return one CheckTarget per check and target, in check order."""
+    jobs = []
+    for name in checks:
+        selected = targets
+        if CHECKS[name].account_wide:
+            selected = runner.one_per_account(targets)
+        jobs.extend(CheckTarget(*target, check=name) for target in selected)
+    return jobs
+
+
+def target_of(job):
+    """Return the plain Target of a CheckTarget."""
+    return Target(*job[:len(Target._fields)])
+
+
+class SessionPool:
+    """
+    Session factory for the runner. Sessions are not thread-safe, so each
+    worker thread keeps one per target and reuses it, with the clients
+    the tools cache on it, for every check of that target it runs.
+    """
+
+    def __init__(self, create_session):
+        self.create_session = create_session
+        self.local = threading.local()
+
+    def __call__(self, job):
+        cached = getattr(self.local, 'sessions', None)
+        if cached is None:
+            cached = self.local.sessions = {}
+        target = target_of(job)
+        if target not in cached:
+            cached[target] = self.create_session(target)
+        return cached[target]
+
+
+def session_factory_from_args(args):
+    """Return the function creating the session of a target."""
+    if args.targets:
+        return runner.create_session
+
+    def default_session(target):
+        session = sessions.get_session(args.profile, args.role_arn,
+                                       target.region)
+        if session is None:
+            raise RuntimeError("No AWS credentials found")
+        return session
+    return default_session
+
+
+def print_summary(outcomes):
+    """Print one line per check and target and the overall totals."""
+    print("\nScan summary:")
+    failed = 0
+    for outcome in sorted(outcomes, key=lambda o: (
+            o.target.check, runner.describe_target(o.target))):
+        if outcome.error is not None:
+            failed += 1
+            status = f"ERROR {outcome.error}"
+        else:
+            status = f"OK {outcome.result}"
+        print(f"  {outcome.target.check} "
+              f"{runner.describe_target(outcome.target)}: {status} "
+              f"({outcome.elapsed:.1f}s)")
+    print(f"{len(outcomes) - failed} checks succeeded, {failed} failed.")
+    return failed
+
+
+def targets_from_args(args):
+    """Return the targets of --targets, or the command line account."""
+    if args.targets:
+        return runner.load_targets(args.targets)
+    return [Target(region=args.region, profile=args.profile)]
+
+
+def scan(args):
+    """Run the selected checks over every target on one worker pool."""
+    modules = {name: load_check(name) for name in args.checks}
+    targets = targets_from_args(args)
+
+    checkpoint = checkpoints.checkpoint_from_args(args)
+    writer = results.writer_from_args(args)
+    store = statestore.store_from_args(args)
+
+    def task(session, job):
+        return modules[job.check].scan_target(
+            session, target_of(job), writer=writer, store=store,
+            checkpoint=checkpoint
+        )
+
+    try:
+        outcomes = runner.run_targets(
+            check_targets(args.checks, targets), task,
+            max_workers=args.workers,
+            per_account=args.per_account,
+            rate_limit=args.rate,
+            session_factory=SessionPool(session_factory_from_args(args)),
+        )
+    finally:
+        writer.close()
+        if store is not None:
+            store.close()
+        if checkpoint is not None:
+            checkpoint.close()
+    return print_summary(outcomes)
+
+
+def snapshot(args):
+    """Collect the inventory of the selected checks into a snapshot file."""
+    modules = {name: load_check(name) for name in args.checks}
+    parts = []
+    lock = threading.Lock()
+
+    def task(session, job):
+        tables = modules[job.check].collect_inventory(session,
+                                                      target_of(job))
+        with lock:
+            parts.append(tables)
+        return {name: inventory.table_length(table)
+                for name, table in tables.items()}
+
+    outcomes = runner.run_targets(
+        check_targets(args.checks, targets_from_args(args)), task,
+        max_workers=args.workers,
+        per_account=args.per_account,
+        rate_limit=args.rate,
+        session_factory=SessionPool(session_factory_from_args(args)),
+    )
+    tables = inventory.merge_tables(parts)
+    inventory.write_snapshot(args.snapshot, tables)
+    print(f"\nWrote {args.snapshot}: " + ', '.join(
+        f"{inventory.table_length(table)} {name}"
+        for name, table in sorted(tables.items())
+    ))
+    return print_summary(outcomes)
+
+
+def evaluate(args):
+    """Evaluate the rules over a snapshot, without any AWS call."""
+    tables = inventory.read_snapshot(args.snapshot)
+    started = time.perf_counter()
+    findings = rules.evaluate_rules(rules.load_rules(args.rules), tables)
+    elapsed = time.perf_counter() - started
+
+    with results.writer_from_args(args) as writer:
+        results.write_findings(writer, findings)
+    for finding in findings:
+        print(f"{finding.check}: {finding.resource} is {finding.status}")
+    counts = Counter(finding.check for finding in findings)
+    print("\nEvaluation summary:")
+    for name, count in sorted(counts.items()):
+        print(f"  {name}: {count} noncompliant")
+    print(f"{len(findings)} findings in {elapsed:.3f}s.")
+    return 0
+
+
+def add_check_arguments(parser):
+    """Add the check selection and target options of the AWS commands."""
+    parser.add_argument(
+        '--checks', type=parse_checks, default=list(CHECKS),
+        help=f"Comma-separated checks to run (default: all of "
+             f"{','.join(CHECKS)})"
+    )
+    runner.add_runner_arguments(parser)
+    sessions.add_session_arguments(parser)
+    metrics.add_metrics_arguments(parser)
+
+
+def main(argv=None):
+    """Run a command of the unified compliance CLI."""
+    parser = argparse.ArgumentParser(
+        prog='python -m compliance',
+        description="Run the ec2, rds and s3 compliance checks together."
+    )
+    commands = parser.add_subparsers(dest='command', required=True)
+    scan_parser = commands.add_parser(
+        'scan', help="Check and remediate the selected checks"
+    )
+    add_check_arguments(scan_parser)
+    results.add_output_arguments(scan_parser)
+    statestore.add_state_arguments(scan_parser)
+    checkpoints.add_checkpoint_arguments(scan_parser)
+    scan_parser.set_defaults(run=scan)
+
+    snapshot_parser = commands.add_parser(
+        'snapshot', help="Export the inventory the checks read, read-only"
+    )
+    snapshot_parser.add_argument(
+        'snapshot', help="Inventory snapshot file to write (.json or .json.gz)"
+    )
+    add_check_arguments(snapshot_parser)
+    snapshot_parser.set_defaults(run=snapshot)
+
+    evaluate_parser = commands.add_parser(
+        'evaluate', help="Evaluate the compliance rules over a snapshot"
+    )
+    evaluate_parser.add_argument(
+        'snapshot', help="Inventory snapshot file written by snapshot"
+    )
+    evaluate_parser.add_argument(
+        '--rules',
+        help="JSON file of rules to evaluate (default: the built-in rules "
+             "of every check)"
+    )
+    results.add_output_arguments(evaluate_parser)
+    evaluate_parser.set_defaults(run=evaluate)
+    args = parser.parse_args(argv)
+
+    if args.run is evaluate:
+        return evaluate(args)
+    try:
+        failed = args.run(args)
+    finally:
+        metrics.report_from_args(args, metrics.DEFAULT_METRICS)
+    return 1 if failed else 0
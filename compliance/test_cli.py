@@ -0,0 +1,100 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+from common import inventory
+from compliance import cli
+
+
+class TestScan(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.targets = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(handle, 'w') as targets_file:
+            json.dump([{'account_id': '111', 'role_name': 'Audit',
+                        'regions': ['us-east-1', 'eu-west-1']}],
+                      targets_file)
+        self.addCleanup(os.remove, self.targets)
+        self.modules = {name: MagicMock() for name in cli.CHECKS}
+        for name, module in self.modules.items():
+            module.scan_target.return_value = {'compliant': 1}
+
+    def scan(self, *argv):
+        return self.scan_command('scan', *argv)
+
+    def scan_command(self, command, *argv):
+        new_session = MagicMock(side_effect=lambda target: MagicMock())
+        with patch.object(cli, 'load_check', side_effect=self.modules.get), \
+                patch.object(cli.runner, 'create_session',
+                             new_session) as create, \
+                patch.object(cli.metrics, 'report_from_args'), \
+                patch('builtins.print'):
+            status = cli.main([command] + list(argv) +
+                              ['--targets', self.targets])
+        return status, create
+
+    def test_selected_checks_run_over_every_target(self):
+        status, _ = self.scan('--checks', 'ec2-ssm,s3-bpa')
+
+        self.assertEqual(status, 0)
+        ec2_regions = sorted(
+            call[0][1].region
+            for call in self.modules['ec2-ssm'].scan_target.call_args_list
+        )
+        self.assertEqual(ec2_regions, ['eu-west-1', 'us-east-1'])
+        # Account-wide checks run once per account
+        self.modules['s3-bpa'].scan_target.assert_called_once()
+        self.modules['rds-public'].scan_target.assert_not_called()
+
+    def test_worker_sessions_are_shared_across_checks(self):
+        _, create = self.scan('--workers', '1')
+
+        # Five checks of two targets, one session per target
+        self.assertEqual(create.call_count, 2)
+        sessions = {call[0][0] for module in self.modules.values()
+                    for call in module.scan_target.call_args_list}
+        self.assertEqual(len(sessions), 2)
+
+    def test_failed_check_sets_the_exit_status(self):
+        self.modules['rds-public'].scan_target.side_effect = RuntimeError(
+            "AccessDenied")
+
+        status, _ = self.scan('--checks', 'rds-public')
+
+        self.assertEqual(status, 1)
+
+    def test_unknown_checks_are_rejected(self):
+        with self.assertRaises(SystemExit), patch('sys.stderr'):
+            cli.main(['scan', '--checks', 'ec2-ssm,iam-mfa'])
+
+    def test_snapshot_is_evaluated_offline(self):
+        def collect(session, target):
+            return {'dbs': inventory.make_table(
+                [('db-1', 'instance', True, 'available')],
+                ('identifier', 'kind', 'publicly_accessible', 'status'),
+                target)}
+        self.modules['rds-public'].collect_inventory.side_effect = collect
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'inventory.json.gz')
+            status, create = self.scan_command(
+                'snapshot', path, '--checks', 'rds-public')
+            output = os.path.join(tmp, 'findings.jsonl')
+            with patch.object(cli.runner, 'create_session') as offline, \
+                    patch('builtins.print'):
+                evaluated = cli.main(['evaluate', path, '--output', output])
+            with open(output) as findings_file:
+                findings = [json.loads(line) for line in findings_file]
+
+        self.assertEqual((status, evaluated), (0, 0))
+        offline.assert_not_called()
+        self.assertEqual(
+            sorted((f['resource'], f['region']) for f in findings),
+            [('db-1', 'eu-west-1'), ('db-1', 'us-east-1')]
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,3 @@
+"""
+Makes the repository root importable so plain ``pytest`` finds ``common``.
+"""
@@ -1,18 +1,67 @@
+import argparse
 import boto3
+import contextlib
+import functools
 import getpass
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-# Initialize clients for EC2 and IAM
+from common import (checkpoints, daemon, inventory, metrics, plan, results,
+                    runner, sessions, statestore)
 
-ec2_client = None
-
-iam_client = None
+# EC2 and IAM clients plus per-run caches, kept per thread so the
+# multi-target runner can scan several accounts and regions at once.
+# Populated by initialize_clients().
+state = threading.local()
 
 # Define the SSM policy ARN (adjust as needed)
 SSM_POLICY_ARN = "arn:aws:iam::aws:policy/AmazonSSMFullAccess"
 
+# API calls an apply phase may execute from a plan file
+PLAN_OPERATIONS = {('iam', 'detach_role_policy')}
+
+# Optional on-disk cache of the profile -> roles index, reused between runs
+PROFILE_CACHE_PATH = os.environ.get("SSM_PROFILE_CACHE")
+PROFILE_CACHE_TTL = int(os.environ.get("SSM_PROFILE_CACHE_TTL", "900"))
+
+# Server-side inventory filters, e.g. SSM_INSTANCE_STATES="running,stopped",
+# SSM_INSTANCE_TAGS="env=prod,team=web", SSM_ONLY_WITH_PROFILE=1
+INSTANCE_STATES = os.environ.get("SSM_INSTANCE_STATES", "")
+INSTANCE_TAGS = os.environ.get("SSM_INSTANCE_TAGS", "")
+ONLY_WITH_PROFILE = os.environ.get("SSM_ONLY_WITH_PROFILE", "") == "1"
+
+# SSM_IAM_SNAPSHOT=1 loads every role, its instance profiles and attached
+# policies with one get_account_authorization_details sweep instead of a
+# list_attached_role_policies call per role
+IAM_SNAPSHOT = os.environ.get("SSM_IAM_SNAPSHOT", "") == "1"
+
+# SSM_REVERSE_LOOKUP=1 starts from the SSM-related managed policies and
+# only reads the roles, profiles and instances they are attached to, so a
+# scan costs in proportion to the violations instead of the fleet size
+REVERSE_LOOKUP = os.environ.get("SSM_REVERSE_LOOKUP", "") == "1"
+
+# Instance profile ARNs per describe_instances filter in a reverse lookup
+PROFILE_FILTER_SIZE = 200
+
+# Parallel detach_role_policy calls when applying the collected detach set
+DETACH_WORKERS = int(os.environ.get("SSM_DETACH_WORKERS", "8"))
+
+# AWS services whose clients a scan builds (see common/startup.py)
+SERVICES = ('ec2', 'iam')
+
+
+def authenticate_aws(profile=None, role_arn=None, region=None):
+    """
+    Create a session from the default credential chain, a profile or an
+    assumed role, prompting for credentials only if none are configured.
+    """
+    session = sessions.get_session(profile, role_arn, region)
+    if session is not None:
+        return session
 
-def authenticate_aws():
-    """Prompt the user for AWS credentials and create a session."""
     print("Please provide your AWS credentials:")
     aws_access_key_id = input("AWS Access Key ID: ")
     aws_secret_access_key = getpass.getpass("AWS Secret Access Key: ")
@@ -27,113 +76,933 @@ def authenticate_aws():
     return session
 
 
-def initialize_clients(session):
-    """Initialize EC2 and IAM clients using the provided session."""
-    global ec2_client, iam_client
-    ec2_client = session.client('ec2')
-    iam_client = session.client('iam')
+def initialize_clients(session, profile_cache_path=PROFILE_CACHE_PATH,
+                       store=None, target=None, iam_snapshot=IAM_SNAPSHOT):
+    """
+    Initialize EC2 and IAM clients and reset the per-run caches. With a
+    StateStore, roles checked recently by an earlier run of the same
+    target are skipped. With iam_snapshot, IAM is read in one sweep.
+    """
+    state.ec2_client = session.client('ec2')
+    state.iam_client = session.client('iam')
+    state.profile_cache_path = profile_cache_path
+    state.iam_snapshot = iam_snapshot
+    state.store = store
+    state.target = target
+    state.unchanged_roles = {}
+    state.resumed_roles = {}
+    state.profile_roles = None
+    state.profile_roles_live = False
+    state.role_ssm_policies = {}
+    state.role_policy_arns = {}
+    state.detach_set = {}
+    state.role_status = {}
+    state.processed_roles = set()
+    state.failed_roles = set()
+    state.regions = None
+    state.region_ec2_clients = {}
 
 
 def get_instance_profiles():
     """Retrieve all instance profiles and their associated roles."""
-    paginator = iam_client.get_paginator('list_instance_profiles')
+    paginator = state.iam_client.get_paginator('list_instance_profiles')
     profiles = []
     for page in paginator.paginate():
         profiles.extend(page['InstanceProfiles'])
     return profiles
 
 
-def list_ec2_instances():
+def build_profile_role_index(profiles):
+    """Map each instance profile name to the names of its roles."""
+    return {
+        profile['InstanceProfileName']: [
+            role['RoleName'] for role in profile['Roles']
+        ]
+        for profile in profiles
+    }
+
+
+def load_profile_role_index(cache_path=None, ttl=PROFILE_CACHE_TTL):
+    """Return the profile -> roles index, using the on-disk cache if fresh."""
+    if cache_path and ttl > 0 and os.path.exists(cache_path):
+        try:
+            with open(cache_path) as cache_file:
+                cached = json.load(cache_file)
+            if time.time() - cached['created'] < ttl:
+                print(f"Using cached instance profiles from {cache_path}")
+                return cached['profiles']
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Ignoring unreadable profile cache {cache_path}: {e}")
+
+    index = build_profile_role_index(get_instance_profiles())
+
+    if cache_path:
+        # The regions of an account share the file and may write it at
+        # once, so replace it atomically from a per-thread temporary file
+        temporary = f"{cache_path}.{threading.get_ident()}.tmp"
+        try:
+            with open(temporary, 'w') as cache_file:
+                json.dump({'created': time.time(), 'profiles': index},
+                          cache_file)
+            os.replace(temporary, cache_path)
+        except OSError as e:
+            print(f"Could not write profile cache {cache_path}: {e}")
+    return index
+
+
+def get_role_details():
+    """Return every IAM role with its instance profiles and policies."""
+    paginator = state.iam_client.get_paginator(
+        'get_account_authorization_details'
+    )
+    role_details = []
+    for page in paginator.paginate(Filter=['Role']):
+        role_details.extend(page['RoleDetailList'])
+    return role_details
+
+
+def build_iam_snapshot(role_details):
+    """
+    Index get_account_authorization_details roles: return the profile ->
+    roles index and the SSM-related policies of every role.
+    """
+    profile_roles = {}
+    ssm_policies = {}
+    for role in role_details:
+        for profile in role.get('InstanceProfileList', []):
+            profile_roles[profile['InstanceProfileName']] = [
+                profile_role['RoleName'] for profile_role in profile['Roles']
+            ]
+        ssm_policies[role['RoleName']] = [
+            policy for policy in role.get('AttachedManagedPolicies', [])
+            if is_ssm_policy(policy)
+        ]
+    return profile_roles, ssm_policies
+
+
+def load_iam_snapshot():
+    """Fill the per-run IAM caches from one account-wide sweep."""
+    role_details = get_role_details()
+    profile_roles, ssm_policies = build_iam_snapshot(role_details)
+    print(f"Loaded {len(ssm_policies)} roles and {len(profile_roles)} "
+          "instance profiles from the IAM snapshot")
+    state.profile_roles = profile_roles
+    state.profile_roles_live = True
+    state.role_ssm_policies.update(ssm_policies)
+    state.role_policy_arns.update(
+        (role['RoleName'], {policy['PolicyArn'] for policy
+                            in role.get('AttachedManagedPolicies', [])})
+        for role in role_details
+    )
+
+
+def load_profile_roles():
+    """Build the profile -> roles index of the run if not built yet."""
+    if state.profile_roles is not None:
+        return
+    if state.iam_snapshot:
+        load_iam_snapshot()
+    else:
+        state.profile_roles = load_profile_role_index(
+            state.profile_cache_path)
+        state.profile_roles_live = not state.profile_cache_path
+
+
+def get_profile_roles(profile_name):
+    """Return the role names of a profile, building the index once per run."""
+    cache_path = state.profile_cache_path
+    load_profile_roles()
+    if (profile_name not in state.profile_roles
+            and not state.profile_roles_live):
+        # The cached index may predate this profile; rebuild it from IAM once
+        state.profile_roles = load_profile_role_index(cache_path, ttl=0)
+        state.profile_roles_live = True
+    return state.profile_roles.get(profile_name, [])
+
+
+def build_instance_filters(states=None, tags=None,
+                           with_instance_profile=False):
+    """Build describe_instances Filters for state, tags and profile."""
+    filters = []
+    if states:
+        filters.append({'Name': 'instance-state-name', 'Values': list(states)})
+    for key, value in (tags or {}).items():
+        filters.append({'Name': f'tag:{key}', 'Values': [value]})
+    if with_instance_profile:
+        filters.append({'Name': 'iam-instance-profile.arn', 'Values': ['*']})
+    return filters
+
+
+def filters_from_env():
+    """Build the inventory filters configured through the environment."""
+    states = [name.strip() for name in INSTANCE_STATES.split(',')
+              if name.strip()]
+    tags = dict(
+        tag.split('=', 1) for tag in INSTANCE_TAGS.split(',') if '=' in tag
+    )
+    return build_instance_filters(states, tags, ONLY_WITH_PROFILE)
+
+
+def iter_ec2_instances(filters=None, starting_token=None, on_page=None,
+                       ec2_client=None):
+    """
+    Yield EC2 instances page by page, filtered server-side. Once every
+    instance of a page has been handled, on_page(next_token) is called
+    with the NextToken of the following page (None after the last one).
+    ec2_client defaults to the client of the run's region.
+    """
+    ec2_client = ec2_client or state.ec2_client
+    paginator = ec2_client.get_paginator('describe_instances')
+    params = {'PaginationConfig': {'PageSize': 1000}}
+    if starting_token:
+        params['PaginationConfig']['StartingToken'] = starting_token
+    if filters:
+        params['Filters'] = filters
+    for page in paginator.paginate(**params):
+        for reservation in page['Reservations']:
+            for instance in reservation['Instances']:
+                yield instance
+        if on_page is not None:
+            on_page(page.get('NextToken'))
+
+
+def print_instance(instance):
+    """Print the ID and state of an EC2 instance."""
+    print(f"Instance ID: {instance['InstanceId']}, "
+          f"State: {instance['State']['Name']}")
+
+
+def list_ec2_instances(instances=None):
     """List all EC2 instances in the specified region."""
-    instances = ec2_client.describe_instances()['Reservations']
-    for reservation in instances:
-        for instance in reservation['Instances']:
-            print(f"Instance ID: {instance['InstanceId']}, "
-                  f"State: {instance['State']['Name']}")
+    if instances is None:
+        instances = iter_ec2_instances(filters_from_env())
+    for instance in instances:
+        print_instance(instance)
 
 
-def check_ec2_ssm_role(role_name):
-    """Check if the IAM role has any SSM-related policies."""
-    try:
-        attached_policies = iam_client.list_attached_role_policies(
-            RoleName=role_name
-        )['AttachedPolicies']
+def get_attached_policies(role_name):
+    """Return every managed policy attached to an IAM role, all pages."""
+    paginator = state.iam_client.get_paginator('list_attached_role_policies')
+    attached_policies = []
+    for page in paginator.paginate(RoleName=role_name):
+        attached_policies.extend(page['AttachedPolicies'])
+    return attached_policies
+
+
+def is_ssm_policy(policy):
+    """Return True if an attached policy is SSM-related."""
+    return "SSM" in policy['PolicyName'] or "AmazonSSM" in policy['PolicyArn']
+
+
+def role_ssm_policies(role_name):
+    """
+    Return the SSM-related policies of a role, fetched once per run so the
+    check and the detach share one lookup. Returns None when the policies
+    could not be retrieved; failures are not cached so a later instance
+    retries them.
+    """
+    if role_name not in state.role_ssm_policies:
+        try:
+            attached_policies = get_attached_policies(role_name)
+        except Exception as e:
+            print(f"Error retrieving policies for role {role_name}: {e}")
+            return None
         print(f"Attached policies for role {role_name}: "
               f"{[policy['PolicyName'] for policy in attached_policies]}")
+        state.role_policy_arns[role_name] = {
+            policy['PolicyArn'] for policy in attached_policies
+        }
+        state.role_ssm_policies[role_name] = [
+            policy for policy in attached_policies if is_ssm_policy(policy)
+        ]
+    return state.role_ssm_policies[role_name]
 
-        for policy in attached_policies:
-            # Check for any SSM-related policy
-            if "SSM" in policy['PolicyName'] or "AmazonSSM" in policy['PolicyArn']:
-                return True
-        return False
+
+def check_ec2_ssm_role(role_name):
+    """
+    Check if the IAM role has any SSM-related policies.
+    Returns None when the policies could not be retrieved.
+    """
+    ssm_policies = role_ssm_policies(role_name)
+    if ssm_policies is None:
+        return None
+    return bool(ssm_policies)
+
+
+def error_code(error):
+    """Return the AWS error code of a botocore ClientError, or None."""
+    return getattr(error, 'response', {}).get('Error', {}).get('Code')
+
+
+def detach_policy(iam_client, role_name, policy):
+    """Detach one policy from a role. Returns False if it failed."""
+    try:
+        iam_client.detach_role_policy(
+            RoleName=role_name,
+            PolicyArn=policy['PolicyArn']
+        )
+        print(f"Detached policy {policy['PolicyName']} from role: {role_name}")
+        return True
     except Exception as e:
-        print(f"Error retrieving policies for role {role_name}: {e}")
+        if error_code(e) == 'NoSuchEntity':
+            # IAM is global: another region of the account detached it
+            print(f"Policy {policy['PolicyName']} was already detached "
+                  f"from role: {role_name}")
+            return True
+        print(f"Error detaching policy {policy['PolicyName']} "
+              f"from role {role_name}: {e}")
         return False
 
 
 def detach_ssm_policy_from_role(role_name):
-    """Detach all SSM-related policies from the specified IAM role."""
-    try:
-        attached_policies = iam_client.list_attached_role_policies(
-            RoleName=role_name
-        )['AttachedPolicies']
-        for policy in attached_policies:
-            # Dynamically detect and detach any SSM-related policy
-            if "SSM" in policy['PolicyName'] or "AmazonSSM" in policy['PolicyArn']:
-                iam_client.detach_role_policy(
-                    RoleName=role_name,
-                    PolicyArn=policy['PolicyArn']
-                )
-                print(f"Detached policy {policy['PolicyName']} from role: {role_name}")
-    except Exception as e:
-        print(f"Error detaching policies from role {role_name}: {e}")
+    """
+    Detach all SSM-related policies from the specified IAM role.
+    Returns False if any of them could not be detached.
+    """
+    ssm_policies = role_ssm_policies(role_name)
+    if ssm_policies is None:
+        return False
+    return all([detach_policy(state.iam_client, role_name, policy)
+                for policy in ssm_policies])
+
 
+def role_marker(role_name):
+    """
+    Return the change marker of a role: a fingerprint of its attached
+    policy ARNs, or None when they are not known without checking the
+    role (they are known up front only from the IAM snapshot).
+    """
+    arns = state.role_policy_arns.get(role_name)
+    if arns is None:
+        return None
+    return statestore.make_marker(sorted(arns))
 
-def remove_ec2_ssm_roles():
+
+def role_unchanged(role_name):
+    """Return True if the state store allows skipping a role this run."""
+    if state.store is None:
+        return False
+    marker = role_marker(role_name)
+    if marker is None:
+        return False
+    last_status = state.store.last_status(
+        'ec2', state.target, role_name, marker
+    )
+    if last_status is None:
+        return False
+    state.unchanged_roles[role_name] = last_status
+    return True
+
+
+def queue_instance_ssm_roles(instance):
+    """
+    Check the roles of a single instance and add their SSM-related
+    policies to the detach set applied by apply_detach_set().
+    """
+    instance_id = instance['InstanceId']
+    iam_role = instance.get('IamInstanceProfile')
+
+    if iam_role:
+        profile_arn = iam_role['Arn']
+        profile_name = profile_arn.split('/')[-1]
+        print(f"Extracted profile name: {profile_name}")
+
+        for role_name in get_profile_roles(profile_name):
+            print(f"Found role {role_name} for profile {profile_name}")
+            if role_name in state.processed_roles:
+                print(f"Role {role_name} was already processed.")
+                continue
+            if role_unchanged(role_name):
+                print(f"Role {role_name} was checked by a recent run.")
+                state.processed_roles.add(role_name)
+                state.role_status[role_name] = (results.UNCHANGED,
+                                                instance_id)
+                continue
+            ssm_policies = role_ssm_policies(role_name)
+            if ssm_policies is None:
+                print(f"Could not check role {role_name} of instance "
+                      f"{instance_id}.")
+                state.failed_roles.add(role_name)
+                state.role_status[role_name] = (results.ERROR, instance_id)
+                continue
+            state.processed_roles.add(role_name)
+            state.failed_roles.discard(role_name)
+            if ssm_policies:
+                print(f"Instance {instance_id} role {role_name} "
+                      "has an SSM-related policy. Removing it...")
+                state.detach_set[role_name] = ssm_policies
+                status = results.NONCOMPLIANT
+            else:
+                print(f"Instance {instance_id} role {role_name} "
+                      "does not have any SSM-related policy.")
+                status = results.COMPLIANT
+            state.role_status[role_name] = (status, instance_id)
+    else:
+        print(f"No IAM Instance Profile found for instance {instance_id}.")
+
+
+def apply_detach_set(max_workers=DETACH_WORKERS):
+    """
+    Detach every queued policy in parallel and empty the detach set.
+    Roles with a failed detach are added to failed_roles, the others are
+    marked as remediated. Returns the number of detach calls made.
+    """
+    detach_set, state.detach_set = state.detach_set, {}
+    jobs = [(role_name, policy) for role_name, policies in detach_set.items()
+            for policy in policies]
+    if not jobs:
+        return 0
+
+    # Worker threads do not see this thread's state, so pass the client
+    iam_client = state.iam_client
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        outcomes = pool.map(
+            lambda job: detach_policy(iam_client, *job), jobs
+        )
+        for (role_name, policy), detached in zip(jobs, outcomes):
+            if not detached:
+                state.failed_roles.add(role_name)
+            elif role_name in state.role_policy_arns:
+                # Record the marker of the role as the detach left it
+                state.role_policy_arns[role_name].discard(
+                    policy['PolicyArn'])
+    for role_name in detach_set:
+        if role_name in state.failed_roles:
+            status = results.ERROR
+        else:
+            status = results.REMEDIATED
+        instance_id = state.role_status[role_name][1]
+        state.role_status[role_name] = (status, instance_id)
+    return len(jobs)
+
+
+def role_findings(target=None):
+    """Return one Finding per role checked since initialize_clients()."""
+    findings = []
+    for role_name, (status, instance_id) in state.role_status.items():
+        detail = {'instance_id': instance_id}
+        if role_name in state.unchanged_roles:
+            detail['last_status'] = state.unchanged_roles[role_name]
+        if role_name in state.resumed_roles:
+            detail['resumed'] = True
+        ssm_policies = state.role_ssm_policies.get(role_name)
+        if ssm_policies:
+            detail['policies'] = [policy['PolicyArn']
+                                  for policy in ssm_policies]
+        findings.append(results.make_finding(
+            'ec2', 'ec2-ssm', role_name, status, detail, target
+        ))
+    return findings
+
+
+def finish_scan(target=None, writer=None):
+    """
+    Return the role findings of the scan, recording them in the state
+    store and writing them to writer when given.
+    """
+    findings = role_findings(target)
+    if state.store is not None:
+        markers = {finding.resource: role_marker(finding.resource)
+                   for finding in findings}
+        state.store.record_findings(findings, {
+            role_name: marker for role_name, marker in markers.items()
+            if marker is not None
+        })
+    return results.write_findings(writer, findings)
+
+
+def remove_ec2_ssm_roles(instances=None):
     """Remove all SSM-related policies from roles associated with EC2 instances."""
     print("Retrieving EC2 instances...")
-    instances = ec2_client.describe_instances()['Reservations']
-
-    for reservation in instances:
-        for instance in reservation['Instances']:
-            instance_id = instance['InstanceId']
-            iam_role = instance.get('IamInstanceProfile')
-
-            if iam_role:
-                # Debug: Print the full IAM instance profile details
-                print(f"IAM Instance Profile for {instance_id}: {iam_role}")
-
-                profile_arn = iam_role['Arn']
-                profile_name = profile_arn.split('/')[-1]
-                print(f"Extracted profile name: {profile_name}")
-
-                profiles = get_instance_profiles()
-
-                for profile in profiles:
-                    if profile['InstanceProfileName'] == profile_name:
-                        for role in profile['Roles']:
-                            role_name = role['RoleName']
-                            print(f"Found role {role_name} for profile {profile_name}")
-                            if check_ec2_ssm_role(role_name):
-                                print(f"Instance {instance_id} role {role_name} "
-                                      "has an SSM-related policy. Removing it...")
-                                detach_ssm_policy_from_role(role_name)
-                            else:
-                                print(f"Instance {instance_id} role {role_name} "
-                                      "does not have any SSM-related policy.")
-            else:
-                print(f"No IAM Instance Profile found for instance {instance_id}.")
+    if instances is None:
+        instances = iter_ec2_instances(filters_from_env())
+    for instance in instances:
+        queue_instance_ssm_roles(instance)
+    apply_detach_set()
 
 
-def main():
-    """Main function to process EC2 instances."""
-    session = authenticate_aws()
-    initialize_clients(session)
+def scan_ec2_instances(instances):
+    """
+    List and check instances in a single pass over the inventory, then
+    detach the collected SSM-related policies in one parallel batch.
+    """
+    scanned = 0
+    for instance in instances:
+        print_instance(instance)
+        queue_instance_ssm_roles(instance)
+        scanned += 1
+    apply_detach_set()
+    return scanned
+
+
+def list_ssm_policies():
+    """
+    Return the SSM-related managed policies attached to any entity of
+    the account, SSM_POLICY_ARN included, as attached policy entries.
+    """
+    policies = {SSM_POLICY_ARN: {'PolicyName': SSM_POLICY_ARN.split('/')[-1],
+                                 'PolicyArn': SSM_POLICY_ARN}}
+    paginator = state.iam_client.get_paginator('list_policies')
+    for page in paginator.paginate(OnlyAttached=True):
+        for policy in page['Policies']:
+            entry = {'PolicyName': policy['PolicyName'],
+                     'PolicyArn': policy['Arn']}
+            if is_ssm_policy(entry):
+                policies[policy['Arn']] = entry
+    return list(policies.values())
+
+
+def roles_with_policies(policies):
+    """Map each role holding one of policies to the ones it holds."""
+    role_policies = {}
+    paginator = state.iam_client.get_paginator('list_entities_for_policy')
+    for policy in policies:
+        for page in paginator.paginate(PolicyArn=policy['PolicyArn'],
+                                       EntityFilter='Role'):
+            for role in page['PolicyRoles']:
+                role_policies.setdefault(role['RoleName'], []).append(policy)
+    return role_policies
+
+
+def get_role_profiles(role_name):
+    """Return the names of the instance profiles holding a role."""
+    paginator = state.iam_client.get_paginator(
+        'list_instance_profiles_for_role'
+    )
+    return [profile['InstanceProfileName']
+            for page in paginator.paginate(RoleName=role_name)
+            for profile in page['InstanceProfiles']]
+
+
+def iter_profile_instances(profile_names):
+    """Yield the instances using any of the given instance profiles."""
+    # The profile filter below replaces SSM_ONLY_WITH_PROFILE's wildcard
+    filters = [entry for entry in filters_from_env()
+               if entry['Name'] != 'iam-instance-profile.arn']
+    profile_names = sorted(profile_names)
+    for start in range(0, len(profile_names), PROFILE_FILTER_SIZE):
+        chunk = profile_names[start:start + PROFILE_FILTER_SIZE]
+        yield from iter_ec2_instances(filters + [{
+            'Name': 'iam-instance-profile.arn',
+            'Values': [f'*/{profile_name}' for profile_name in chunk],
+        }])
+
+
+def scan_policy_first():
+    """
+    Reverse lookup: find the roles holding SSM-related policies, then the
+    instance profiles holding those roles, then the instances using the
+    profiles, and fix only those. Roles without SSM-related policies are
+    never read, so unlike a fleet scan no compliant findings are made.
+    Returns the number of instances checked.
+    """
+    role_policies = roles_with_policies(list_ssm_policies())
+    print(f"{len(role_policies)} roles hold SSM-related policies.")
+    profile_roles = {}
+    for role_name in role_policies:
+        for profile_name in get_role_profiles(role_name):
+            profile_roles.setdefault(profile_name, []).append(role_name)
+
+    # Seed the per-run caches, so the regular instance check reuses them
+    state.profile_roles = profile_roles
+    state.profile_roles_live = True
+    state.role_ssm_policies.update(role_policies)
+    return scan_ec2_instances(iter_profile_instances(profile_roles))
+
+
+def resume_roles(checkpoint, target=None):
+    """
+    Restore the roles an interrupted run of a target finished, so they
+    are not checked again. Returns True if that run completed the scan.
+    """
+    state.resumed_roles = checkpoint.done('ec2', target)
+    for role_name, status in state.resumed_roles.items():
+        state.processed_roles.add(role_name)
+        state.role_status[role_name] = (status, None)
+    return checkpoint.is_complete('ec2', target)
+
+
+def scan_account(checkpoint=None, target=None):
+    """
+    Scan the account with the configured lookup direction. With a
+    Checkpoint, progress is saved after each page of instances and an
+    interrupted scan resumes at the page it was on.
+    """
+    if checkpoint is None:
+        if REVERSE_LOOKUP:
+            return scan_policy_first()
+        return scan_ec2_instances(iter_ec2_instances(filters_from_env()))
+
+    if resume_roles(checkpoint, target):
+        print("The interrupted run already finished this target.")
+        return 0
+    if REVERSE_LOOKUP:
+        scanned = scan_policy_first()
+    else:
+        def on_page(next_token):
+            # The page's roles are final once their detaches are applied
+            apply_detach_set()
+            checkpoint.record('ec2', target, role_findings(target),
+                              token=next_token)
+
+        token = checkpoints.starting_token(checkpoint.token('ec2', target))
+        scanned = scan_ec2_instances(
+            iter_ec2_instances(filters_from_env(), token, on_page)
+        )
+    checkpoint.record('ec2', target, role_findings(target), complete=True)
+    return scanned
+
+
+def profile_cache_for(target):
+    """Return the profile cache file of a target's account."""
+    cache_path = PROFILE_CACHE_PATH
+    if cache_path and target and target.account_id:
+        # IAM is account-wide, so keep one profile cache file per account
+        cache_path = f"{cache_path}.{target.account_id}"
+    return cache_path
+
+
+def scan_target(session, target, writer=None, store=None, checkpoint=None):
+    """Scan one account/region target for the multi-target runner."""
+    initialize_clients(session, profile_cache_for(target), store, target)
+    scan_account(checkpoint, target)
+    findings = finish_scan(target, writer)
+    if state.failed_roles:
+        # Report the target as failed instead of as clean
+        raise RuntimeError(f"{len(state.failed_roles)} roles could not be "
+                           f"checked or fixed: {sorted(state.failed_roles)}")
+    return results.summarize(findings)
+
+
+# Guards the sets of detaches already planned by the targets of a run
+_claimed_lock = threading.Lock()
+
+
+def claim_detach(claimed, key):
+    """Add key to claimed, returning False if it was already there."""
+    with _claimed_lock:
+        if key in claimed:
+            return False
+        claimed.add(key)
+        return True
+
+
+def plan_instance_ssm_roles(instance, target=None, claimed=None):
+    """
+    Return the detach actions needed for the roles of one instance.
+    claimed is a set shared by the targets of a run: IAM is global, so
+    the regions of an account plan each role's detach only once.
+    """
+    actions = []
+    iam_role = instance.get('IamInstanceProfile')
+    if not iam_role:
+        return actions
+
+    profile_name = iam_role['Arn'].split('/')[-1]
+    for role_name in get_profile_roles(profile_name):
+        if role_name in state.processed_roles:
+            continue
+        state.processed_roles.add(role_name)
+        ssm_policies = role_ssm_policies(role_name)
+        if ssm_policies is None:
+            raise RuntimeError(f"Could not retrieve policies of {role_name}")
+        for policy in ssm_policies:
+            account_id = target.account_id if target else None
+            key = (account_id, role_name, policy['PolicyArn'])
+            if claimed is not None and not claim_detach(claimed, key):
+                continue
+            actions.append(plan.plan_action(
+                'ec2', 'iam', 'detach_role_policy', role_name,
+                {'RoleName': role_name, 'PolicyArn': policy['PolicyArn']},
+                target
+            ))
+    return actions
+
+
+def plan_target(session, target, writer, claimed=None):
+    """
+    Write the changes a scan of one target would make, read-only.
+    claimed is passed on to plan_instance_ssm_roles().
+    """
+    initialize_clients(session, profile_cache_for(target))
+    planned = 0
+    for instance in iter_ec2_instances(filters_from_env()):
+        for action in plan_instance_ssm_roles(instance, target, claimed):
+            writer.write(action)
+            planned += 1
+    return planned
+
+
+def collect_inventory(session, target=None):
+    """
+    Return the inventory tables of a target: its instances, and the
+    account's instance profiles, roles and attached policies read from
+    one get_account_authorization_details sweep.
+    """
+    initialize_clients(session, None, target=target)
+    instances = (
+        (instance['InstanceId'], instance['State']['Name'],
+         instance['IamInstanceProfile']['Arn'].split('/')[-1]
+         if instance.get('IamInstanceProfile') else None)
+        for instance in iter_ec2_instances(filters_from_env())
+    )
+    role_details = get_role_details()
+    # IAM is account-wide, so its tables have no region
+    return {
+        'instances': inventory.make_table(
+            instances, ('instance_id', 'state', 'profile_name'), target),
+        'profiles': inventory.make_table(
+            ((profile['InstanceProfileName'], role['RoleName'])
+             for role in role_details
+             for profile in role.get('InstanceProfileList', [])),
+            ('profile_name', 'role_name'), target, regional=False),
+        'roles': inventory.make_table(
+            ((role['RoleName'],) for role in role_details),
+            ('role_name',), target, regional=False),
+        'role_policies': inventory.make_table(
+            ((role['RoleName'], policy['PolicyName'], policy['PolicyArn'])
+             for role in role_details
+             for policy in role.get('AttachedManagedPolicies', [])),
+            ('role_name', 'policy_name', 'policy_arn'), target,
+            regional=False),
+    }
+
+
+# Warm per-target state of the service mode, kept between events
+_target_states = {}
 
-    print("Listing EC2 instances...")
-    list_ec2_instances()
+# Regions of each account in --targets, searched by IAM events
+_account_regions = {}
 
-    remove_ec2_ssm_roles()
+
+@contextlib.contextmanager
+def target_state(session, target):
+    """Use a target's warm clients and caches while handling an event."""
+    if target in _target_states:
+        vars(state).update(_target_states[target])
+    else:
+        initialize_clients(session, profile_cache_for(target),
+                           target=target)
+    try:
+        yield
+    finally:
+        _target_states[target] = dict(vars(state))
+
+
+def profiles_with_role(role_name):
+    """Return the names of the instance profiles holding a role."""
+    def matching():
+        return [profile_name
+                for profile_name, roles in state.profile_roles.items()
+                if role_name in roles]
+
+    load_profile_roles()
+    profiles = matching()
+    if not profiles and not state.profile_roles_live:
+        # The cached index may predate the role; rebuild it from IAM once
+        state.profile_roles = load_profile_role_index(
+            state.profile_cache_path, ttl=0)
+        state.profile_roles_live = True
+        profiles = matching()
+    return profiles
+
+
+def account_regions(target=None):
+    """
+    Return the regions of an account to search for instances: those of
+    --targets in service mode, else the regions enabled in the account.
+    """
+    account_id = target.account_id if target else None
+    if account_id in _account_regions:
+        return _account_regions[account_id]
+    if state.regions is None:
+        response = state.ec2_client.describe_regions()
+        state.regions = [region['RegionName']
+                         for region in response['Regions']]
+    return state.regions
+
+
+def find_role_instance(session, profiles, target=None):
+    """
+    Return an instance using any of the instance profiles, in the event's
+    region first, then in the account's other regions, or None. IAM is
+    global and its events are all recorded in us-east-1, while the role
+    may only be used in other regions.
+    """
+    filters = [{
+        'Name': 'iam-instance-profile.arn',
+        'Values': [f'*/{profile_name}' for profile_name in profiles],
+    }]
+    home = target.region if target else None
+    for instance in iter_ec2_instances(filters):
+        return instance
+    for region in account_regions(target):
+        if region == home:
+            continue
+        if region not in state.region_ec2_clients:
+            state.region_ec2_clients[region] = session.client(
+                'ec2', region_name=region)
+        for instance in iter_ec2_instances(
+                filters, ec2_client=state.region_ec2_clients[region]):
+            return instance
+    return None
+
+
+def check_roles_of(instances, role_names=None, target=None):
+    """
+    Check and fix the roles of instances, returning the findings of
+    role_names, or of every role of the instances when None.
+    """
+    checked = set(role_names or ())
+    for instance in instances:
+        queue_instance_ssm_roles(instance)
+        if role_names is None:
+            profile = instance.get('IamInstanceProfile')
+            if profile:
+                checked.update(
+                    get_profile_roles(profile['Arn'].split('/')[-1]))
+    apply_detach_set()
+    return [finding for finding in role_findings(target)
+            if finding.resource in checked]
+
+
+def handle_role_event(session, record, target=None):
+    """Re-check a role whose policies or instance profiles changed."""
+    role_name = daemon.request_parameter(record, 'roleName')
+    policy_arn = daemon.request_parameter(record, 'policyArn')
+    if not role_name or (policy_arn and not is_ssm_policy(
+            {'PolicyName': policy_arn.split('/')[-1],
+             'PolicyArn': policy_arn})):
+        return []
+
+    with target_state(session, target):
+        if record['eventName'] == 'AddRoleToInstanceProfile':
+            # Rebuild the profile index on the next lookup
+            state.profile_roles = None
+        # The role changed, so forget what earlier events learned about it
+        state.role_ssm_policies.pop(role_name, None)
+        state.processed_roles.discard(role_name)
+
+        profiles = profiles_with_role(role_name)
+        if not profiles:
+            return []
+        # Only roles reachable from an instance, in any region, are in scope
+        instance = find_role_instance(session, profiles, target)
+        if instance is None:
+            return []
+        return check_roles_of([instance], [role_name], target)
+
+
+def event_instance_ids(record):
+    """Return the IDs of the instances a CloudTrail EC2 record names."""
+    ids = []
+    response = record.get('responseElements') or {}
+    for item in (response.get('instancesSet') or {}).get('items', []):
+        ids.append(item['instanceId'])
+    for value in response.values():
+        association = isinstance(value, dict) and value.get(
+            'iamInstanceProfileAssociation')
+        if association:
+            ids.append(association['instanceId'])
+    request = daemon.request_parameter(
+        record, 'AssociateIamInstanceProfileRequest') or {}
+    if request.get('InstanceId'):
+        ids.append(request['InstanceId'])
+    return sorted(set(ids))
+
+
+def handle_instance_event(session, record, target=None):
+    """Check the roles of instances launched or given a new profile."""
+    instance_ids = event_instance_ids(record)
+    if not instance_ids:
+        return []
+    with target_state(session, target):
+        instances = list(iter_ec2_instances(
+            [{'Name': 'instance-id', 'Values': instance_ids}]
+        ))
+        return check_roles_of(instances, target=target)
+
+
+# CloudTrail events that can give an instance an SSM-enabled role
+EVENT_HANDLERS = {
+    'AttachRolePolicy': handle_role_event,
+    'AddRoleToInstanceProfile': handle_role_event,
+    'RunInstances': handle_instance_event,
+    'AssociateIamInstanceProfile': handle_instance_event,
+    'ReplaceIamInstanceProfileAssociation': handle_instance_event,
+}
+
+
+def run(args):
+    """Run the apply, plan, service, multi-target or single account mode."""
+    def default_session(region=None):
+        return authenticate_aws(args.profile, args.role_arn,
+                                region or args.region)
+
+    if args.apply:
+        plan.apply_from_args(args, PLAN_OPERATIONS, default_session)
+        return
+
+    if args.plan:
+        plan.plan_from_args(args, functools.partial(
+            plan_target, claimed=set()
+        ), default_session)
+        return
+
+    if args.events or args.queue_url:
+        if args.targets:
+            for target in runner.load_targets(args.targets):
+                _account_regions.setdefault(target.account_id, []).append(
+                    target.region)
+        with results.writer_from_args(args) as writer:
+            daemon.run_from_args(args, EVENT_HANDLERS, default_session,
+                                 writer)
+        return
+
+    checkpoint = checkpoints.checkpoint_from_args(args)
+    writer = results.writer_from_args(args)
+    store = statestore.store_from_args(args)
+    try:
+        if args.targets:
+            runner.run_from_args(args, functools.partial(
+                scan_target, writer=writer, store=store,
+                checkpoint=checkpoint
+            ))
+            return
+
+        session = default_session()
+        initialize_clients(session, store=store)
+
+        print("Listing and checking EC2 instances...")
+        scan_account(checkpoint)
+        finish_scan(writer=writer)
+    finally:
+        writer.close()
+        if store is not None:
+            store.close()
+        if checkpoint is not None:
+            checkpoint.close()
+
+
+def main(argv=None):
+    """Main function to process EC2 instances."""
+    parser = argparse.ArgumentParser(
+        description="Remove SSM-related policies from EC2 instance roles."
+    )
+    runner.add_runner_arguments(parser)
+    sessions.add_session_arguments(parser)
+    plan.add_plan_arguments(parser)
+    results.add_output_arguments(parser)
+    statestore.add_state_arguments(parser)
+    checkpoints.add_checkpoint_arguments(parser)
+    daemon.add_daemon_arguments(parser)
+    metrics.add_metrics_arguments(parser)
+    args = parser.parse_args(argv)
+
+    try:
+        run(args)
+    finally:
+        metrics.report_from_args(args, metrics.DEFAULT_METRICS)
 
 
 if __name__ == "__main__":
@@ -1,7 +1,13 @@
 import boto3
+import botocore.exceptions
+import os
+import tempfile
 import unittest
 from unittest.mock import patch, MagicMock
 
+from common import checkpoints, results, rules, statestore
+from common.runner import Target
+
 # Initialize clients for EC2 and IAM
 
 ec2_client = None
@@ -184,5 +190,469 @@ class TestEC2SSMPolicy(unittest.TestCase):
             PolicyArn='arn:aws:iam::aws:policy/AmazonSSMManagedInstanceCore'
         )
 
+
+def make_session(ec2=None, iam=None):
+    """Return a mock session whose clients are the given mocks."""
+    session = MagicMock()
+    clients = {'ec2': ec2 or MagicMock(), 'iam': iam or MagicMock()}
+    session.client.side_effect = lambda name: clients[name]
+    return session
+
+
+def make_iam(profile_pages, policy_pages):
+    """Return a mock IAM client with one paginator per operation."""
+    iam = MagicMock()
+    paginators = {
+        'list_instance_profiles': MagicMock(),
+        'list_attached_role_policies': MagicMock(),
+        'get_account_authorization_details': MagicMock(),
+        'list_policies': MagicMock(),
+        'list_entities_for_policy': MagicMock(),
+        'list_instance_profiles_for_role': MagicMock(),
+    }
+    paginators['list_instance_profiles'].paginate.return_value = profile_pages
+    paginators['list_attached_role_policies'].paginate.side_effect = (
+        lambda **kwargs: iter(policy_pages)
+    )
+    iam.get_paginator.side_effect = lambda name: paginators[name]
+    iam.paginators = paginators
+    return iam
+
+
+class TestProfileRoleCache(unittest.TestCase):
+
+    def setUp(self):
+        import EC2_remove_SSM_policy as module
+        self.module = module
+        self.iam = make_iam(
+            [{'InstanceProfiles': [
+                {'InstanceProfileName': 'shared',
+                 'Roles': [{'RoleName': 'SharedRole'}]},
+                {'InstanceProfileName': 'other', 'Roles': []},
+            ]}],
+            [{'AttachedPolicies': [
+                {'PolicyName': 'AmazonSSMManagedInstanceCore',
+                 'PolicyArn': 'arn:aws:iam::aws:policy/'
+                              'AmazonSSMManagedInstanceCore'}
+            ]}]
+        )
+        self.profiles = self.iam.paginators['list_instance_profiles']
+        self.policies = self.iam.paginators['list_attached_role_policies']
+        self.ec2 = MagicMock()
+        self.ec2.get_paginator.return_value.paginate.return_value = [{
+            'Reservations': [{'Instances': [
+                {'InstanceId': f'i-{n}', 'State': {'Name': 'running'},
+                 'IamInstanceProfile': {
+                    'Arn': 'arn:aws:iam::123456789012:'
+                           'instance-profile/shared'}}
+                for n in range(5)
+            ]}]
+        }]
+        module.initialize_clients(make_session(self.ec2, self.iam))
+
+    def test_profiles_listed_once_per_run(self):
+        self.module.remove_ec2_ssm_roles()
+        self.profiles.paginate.assert_called_once()
+
+    def test_shared_role_checked_and_detached_once(self):
+        self.module.remove_ec2_ssm_roles()
+        # One lookup shared by the check and the detach, not one per instance
+        self.policies.paginate.assert_called_once_with(RoleName='SharedRole')
+        self.iam.list_attached_role_policies.assert_not_called()
+        self.iam.detach_role_policy.assert_called_once_with(
+            RoleName='SharedRole',
+            PolicyArn='arn:aws:iam::aws:policy/AmazonSSMManagedInstanceCore'
+        )
+
+    def test_policies_are_read_from_every_page(self):
+        self.policies.paginate.side_effect = lambda **kwargs: iter([
+            {'AttachedPolicies': [
+                {'PolicyName': 'ReadOnly',
+                 'PolicyArn': 'arn:aws:iam::aws:policy/ReadOnly'}]},
+            {'AttachedPolicies': [
+                {'PolicyName': 'AmazonSSMFullAccess',
+                 'PolicyArn': 'arn:aws:iam::aws:policy/AmazonSSMFullAccess'}]},
+        ])
+
+        self.module.remove_ec2_ssm_roles()
+
+        self.iam.detach_role_policy.assert_called_once_with(
+            RoleName='SharedRole',
+            PolicyArn='arn:aws:iam::aws:policy/AmazonSSMFullAccess'
+        )
+
+    def test_detach_set_is_applied_after_the_scan(self):
+        self.module.initialize_clients(make_session(self.ec2, self.iam))
+        instances = list(self.module.iter_ec2_instances())
+        for instance in instances:
+            self.module.queue_instance_ssm_roles(instance)
+
+        self.iam.detach_role_policy.assert_not_called()
+        self.assertEqual(self.module.apply_detach_set(max_workers=4), 1)
+        self.iam.detach_role_policy.assert_called_once()
+        self.assertEqual(self.module.state.detach_set, {})
+
+    def test_failed_detach_marks_role_failed(self):
+        self.iam.detach_role_policy.side_effect = RuntimeError("AccessDenied")
+
+        self.module.remove_ec2_ssm_roles()
+
+        self.assertEqual(self.module.state.failed_roles, {'SharedRole'})
+
+    def test_scan_target_writes_role_findings(self):
+        writer = MagicMock()
+        target = MagicMock(account_id='111', region='us-east-1')
+
+        summary = self.module.scan_target(
+            make_session(self.ec2, self.iam), target, writer
+        )
+
+        self.assertEqual(summary, {'remediated': 1})
+        finding = writer.write.call_args[0][0]
+        self.assertEqual(finding.resource, 'SharedRole')
+        self.assertEqual(finding.account_id, '111')
+        self.assertEqual(finding.detail, {
+            'instance_id': 'i-0',
+            'policies': ['arn:aws:iam::aws:policy/'
+                         'AmazonSSMManagedInstanceCore']
+        })
+
+    def test_regions_of_one_account_detach_once(self):
+        no_such_entity = botocore.exceptions.ClientError(
+            {'Error': {'Code': 'NoSuchEntity'}}, 'DetachRolePolicy'
+        )
+        self.iam.detach_role_policy.side_effect = [None, no_such_entity]
+        summaries = []
+        for region in ('us-east-1', 'eu-west-1'):
+            target = Target('111', region=region)
+            summaries.append(self.module.scan_target(
+                make_session(self.ec2, self.iam), target
+            ))
+
+        # The second region finds the policy already detached
+        self.assertEqual(summaries, [{'remediated': 1}] * 2)
+
+        claimed = set()
+        writer = MagicMock()
+        planned = [
+            self.module.plan_target(make_session(self.ec2, self.iam),
+                                    Target('111', region=region), writer,
+                                    claimed)
+            for region in ('us-east-1', 'eu-west-1')
+        ]
+        self.assertEqual(planned, [1, 0])
+
+    def test_failed_role_lookup_is_retried_not_cached(self):
+        pages = self.policies.paginate.side_effect
+        self.policies.paginate.side_effect = [
+            RuntimeError("Throttling"), pages(), pages()
+        ]
+
+        self.module.remove_ec2_ssm_roles()
+
+        self.assertEqual(self.policies.paginate.call_count, 2)
+        self.iam.detach_role_policy.assert_called_once()
+        self.assertEqual(self.module.state.failed_roles, set())
+
+    def test_fresh_disk_cache_skips_iam(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache_path = os.path.join(tmp, 'profiles.json')
+            first = self.module.load_profile_role_index(cache_path)
+            second = self.module.load_profile_role_index(cache_path)
+
+        self.assertEqual(first, second)
+        self.assertEqual(first['shared'], ['SharedRole'])
+        self.profiles.paginate.assert_called_once()
+
+    def test_plan_lists_detaches_without_mutating(self):
+        writer = MagicMock()
+        planned = self.module.plan_target(
+            make_session(self.ec2, self.iam), None, writer
+        )
+
+        self.assertEqual(planned, 1)
+        action = writer.write.call_args[0][0]
+        self.assertEqual(action['operation'], 'detach_role_policy')
+        self.assertEqual(action['params'], {
+            'RoleName': 'SharedRole',
+            'PolicyArn': 'arn:aws:iam::aws:policy/AmazonSSMManagedInstanceCore'
+        })
+        self.iam.detach_role_policy.assert_not_called()
+
+    def test_iam_snapshot_replaces_per_role_lookups(self):
+        snapshot = self.iam.paginators['get_account_authorization_details']
+        snapshot.paginate.return_value = [{'RoleDetailList': [
+            {'RoleName': 'SharedRole',
+             'InstanceProfileList': [
+                 {'InstanceProfileName': 'shared',
+                  'Roles': [{'RoleName': 'SharedRole'}]}],
+             'AttachedManagedPolicies': [
+                 {'PolicyName': 'ReadOnly',
+                  'PolicyArn': 'arn:aws:iam::aws:policy/ReadOnly'},
+                 {'PolicyName': 'AmazonSSMFullAccess',
+                  'PolicyArn': SSM_POLICY_ARN}]},
+        ]}]
+        self.module.initialize_clients(make_session(self.ec2, self.iam),
+                                       iam_snapshot=True)
+
+        self.module.remove_ec2_ssm_roles()
+
+        snapshot.paginate.assert_called_once_with(Filter=['Role'])
+        self.profiles.paginate.assert_not_called()
+        self.policies.paginate.assert_not_called()
+        self.iam.detach_role_policy.assert_called_once_with(
+            RoleName='SharedRole',
+            PolicyArn='arn:aws:iam::aws:policy/AmazonSSMFullAccess'
+        )
+
+    def test_state_store_skips_roles_until_their_policies_change(self):
+        snapshot = self.iam.paginators['get_account_authorization_details']
+        policies = [{'PolicyName': 'ReadOnly',
+                     'PolicyArn': 'arn:aws:iam::aws:policy/ReadOnly'}]
+        snapshot.paginate.side_effect = lambda **kwargs: [{'RoleDetailList': [
+            {'RoleName': 'SharedRole',
+             'InstanceProfileList': [
+                 {'InstanceProfileName': 'shared',
+                  'Roles': [{'RoleName': 'SharedRole'}]}],
+             'AttachedManagedPolicies': list(policies)}]}]
+        handle, path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+
+        def scan(iam_snapshot=True):
+            with statestore.StateStore(path) as store:
+                self.module.initialize_clients(
+                    make_session(self.ec2, self.iam), None, store,
+                    iam_snapshot=iam_snapshot)
+                self.module.scan_account()
+                return [(f.resource, f.status)
+                        for f in self.module.finish_scan()]
+
+        self.assertEqual(scan(), [('SharedRole', 'compliant')])
+        self.assertEqual(scan(), [('SharedRole', 'unchanged')])
+        # Without the snapshot the policies are unknown before the check
+        self.assertEqual(scan(iam_snapshot=False),
+                         [('SharedRole', 'remediated')])
+        policies.append({
+            'PolicyName': 'AmazonSSMFullAccess',
+            'PolicyArn': 'arn:aws:iam::aws:policy/AmazonSSMFullAccess'})
+        self.assertEqual(scan(), [('SharedRole', 'remediated')])
+
+    def test_inventory_feeds_the_offline_rules(self):
+        snapshot = self.iam.paginators['get_account_authorization_details']
+        snapshot.paginate.return_value = [{'RoleDetailList': [
+            {'RoleName': 'SharedRole',
+             'InstanceProfileList': [
+                 {'InstanceProfileName': 'shared',
+                  'Roles': [{'RoleName': 'SharedRole'}]}],
+             'AttachedManagedPolicies': [
+                 {'PolicyName': 'AmazonSSMFullAccess',
+                  'PolicyArn': SSM_POLICY_ARN}]},
+            {'RoleName': 'UnusedRole',
+             'AttachedManagedPolicies': [
+                 {'PolicyName': 'AmazonSSMFullAccess',
+                  'PolicyArn': SSM_POLICY_ARN}]},
+        ]}]
+        target = MagicMock(account_id='111', region='us-east-1')
+
+        tables = self.module.collect_inventory(
+            make_session(self.ec2, self.iam), target)
+        findings = rules.evaluate_rules(rules.RULES, tables)
+
+        self.assertEqual(len(tables['instances']['instance_id']), 5)
+        self.assertEqual(tables['profiles']['region'], [None])
+        # Only roles in use by an instance are reported
+        self.assertEqual([(f.check, f.resource, f.account_id)
+                          for f in findings],
+                         [('ec2-ssm', 'SharedRole', '111')])
+        self.iam.detach_role_policy.assert_not_called()
+
+    def test_reverse_lookup_starts_from_ssm_policies(self):
+        self.iam.paginators['list_policies'].paginate.return_value = [
+            {'Policies': [
+                {'PolicyName': 'ReadOnly',
+                 'Arn': 'arn:aws:iam::aws:policy/ReadOnly'},
+                {'PolicyName': 'AmazonSSMManagedInstanceCore',
+                 'Arn': 'arn:aws:iam::aws:policy/'
+                        'AmazonSSMManagedInstanceCore'},
+            ]}
+        ]
+        entities = self.iam.paginators['list_entities_for_policy']
+        entities.paginate.side_effect = lambda PolicyArn, **kwargs: [
+            {'PolicyRoles': [{'RoleName': 'SharedRole'}]
+             if PolicyArn.endswith('InstanceCore') else []}
+        ]
+        role_profiles = self.iam.paginators['list_instance_profiles_for_role']
+        role_profiles.paginate.return_value = [
+            {'InstanceProfiles': [{'InstanceProfileName': 'shared'}]}
+        ]
+
+        self.module.scan_policy_first()
+
+        # The ReadOnly policy and the per-role listings are never read
+        self.assertEqual(
+            sorted(call[1]['PolicyArn']
+                   for call in entities.paginate.call_args_list),
+            ['arn:aws:iam::aws:policy/AmazonSSMFullAccess',
+             'arn:aws:iam::aws:policy/AmazonSSMManagedInstanceCore']
+        )
+        self.profiles.paginate.assert_not_called()
+        self.policies.paginate.assert_not_called()
+        kwargs = self.ec2.get_paginator.return_value.paginate.call_args[1]
+        self.assertEqual(kwargs['Filters'], [
+            {'Name': 'iam-instance-profile.arn', 'Values': ['*/shared']}
+        ])
+        self.iam.detach_role_policy.assert_called_once_with(
+            RoleName='SharedRole',
+            PolicyArn='arn:aws:iam::aws:policy/AmazonSSMManagedInstanceCore'
+        )
+
+    def test_checkpoint_is_saved_after_each_page(self):
+        pages = self.ec2.get_paginator.return_value.paginate.return_value
+        pages[0]['NextToken'] = 'page-2'
+        pages.append({'Reservations': []})
+        checkpoint = MagicMock()
+        checkpoint.done.return_value = {}
+        checkpoint.is_complete.return_value = False
+        checkpoint.token.return_value = None
+
+        self.module.scan_account(checkpoint)
+
+        first = checkpoint.record.call_args_list[0]
+        self.assertEqual([(f.resource, f.status) for f in first[0][2]],
+                         [('SharedRole', 'remediated')])
+        self.assertEqual(first[1], {'token': 'page-2'})
+        self.assertEqual(checkpoint.record.call_args[1], {'complete': True})
+
+    def test_resumed_scan_skips_done_pages_and_roles(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'checkpoint.json')
+            with checkpoints.Checkpoint(path) as checkpoint:
+                checkpoint.record('ec2', None, [results.make_finding(
+                    'ec2', 'ec2-ssm', 'SharedRole', results.REMEDIATED
+                )], token='page-2')
+            checkpoint = checkpoints.Checkpoint(path, resume=True)
+
+            self.module.scan_account(checkpoint)
+
+        kwargs = self.ec2.get_paginator.return_value.paginate.call_args[1]
+        self.assertEqual(kwargs['PaginationConfig']['StartingToken'],
+                         checkpoints.starting_token('page-2'))
+        self.policies.paginate.assert_not_called()
+        self.iam.detach_role_policy.assert_not_called()
+        finding = self.module.role_findings()[0]
+        self.assertEqual(finding.status, results.REMEDIATED)
+        self.assertTrue(finding.detail['resumed'])
+
+    def test_expired_disk_cache_is_rebuilt(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache_path = os.path.join(tmp, 'profiles.json')
+            self.module.load_profile_role_index(cache_path)
+            self.module.load_profile_role_index(cache_path, ttl=0)
+
+        self.assertEqual(self.profiles.paginate.call_count, 2)
+
+    def test_policy_attach_event_rechecks_the_role(self):
+        self.module._target_states.clear()
+        self.module.remove_ec2_ssm_roles()
+        self.iam.detach_role_policy.reset_mock()
+        record = {'eventName': 'AttachRolePolicy', 'requestParameters': {
+            'roleName': 'SharedRole',
+            'policyArn': 'arn:aws:iam::aws:policy/AmazonSSMManagedInstanceCore'
+        }}
+
+        findings = self.module.handle_role_event(
+            make_session(self.ec2, self.iam), record)
+
+        self.assertEqual([(f.resource, f.status) for f in findings],
+                         [('SharedRole', 'remediated')])
+        self.iam.detach_role_policy.assert_called_once()
+        filters = self.ec2.get_paginator.return_value.paginate.call_args[1]
+        self.assertEqual(filters['Filters'], [{
+            'Name': 'iam-instance-profile.arn', 'Values': ['*/shared']
+        }])
+
+    def test_iam_event_finds_instances_in_other_regions(self):
+        self.module._target_states.clear()
+        home = MagicMock()
+        home.get_paginator.return_value.paginate.return_value = [
+            {'Reservations': []}]
+        home.describe_regions.return_value = {'Regions': [
+            {'RegionName': 'us-east-1'}, {'RegionName': 'eu-west-1'}]}
+        session = MagicMock()
+        session.client.side_effect = lambda name, region_name=None: (
+            self.iam if name == 'iam'
+            else self.ec2 if region_name == 'eu-west-1' else home)
+        # IAM events are recorded in us-east-1, wherever the role is used
+        record = {'eventName': 'AttachRolePolicy',
+                  'awsRegion': 'us-east-1', 'requestParameters': {
+                      'roleName': 'SharedRole',
+                      'policyArn': 'arn:aws:iam::aws:policy/'
+                                   'AmazonSSMManagedInstanceCore'}}
+        target = self.module.runner.Target('111', region='us-east-1')
+
+        findings = self.module.handle_role_event(session, record, target)
+
+        self.assertEqual([(f.resource, f.status) for f in findings],
+                         [('SharedRole', 'remediated')])
+        self.iam.detach_role_policy.assert_called_once()
+        session.client.assert_any_call('ec2', region_name='eu-west-1')
+
+    def test_unrelated_policy_events_are_ignored(self):
+        record = {'eventName': 'AttachRolePolicy', 'requestParameters': {
+            'roleName': 'SharedRole',
+            'policyArn': 'arn:aws:iam::aws:policy/ReadOnlyAccess'
+        }}
+
+        self.assertEqual(self.module.handle_role_event(MagicMock(), record),
+                         [])
+
+
+class TestInstanceInventory(unittest.TestCase):
+
+    def setUp(self):
+        import EC2_remove_SSM_policy as module
+        self.module = module
+        self.ec2 = MagicMock()
+        self.ec2.get_paginator.return_value.paginate.return_value = [
+            {'Reservations': [{'Instances': [
+                {'InstanceId': 'i-1', 'State': {'Name': 'running'}},
+            ]}]},
+            {'Reservations': [{'Instances': [
+                {'InstanceId': 'i-2', 'State': {'Name': 'running'}},
+                {'InstanceId': 'i-3', 'State': {'Name': 'stopped'}},
+            ]}]},
+        ]
+        module.initialize_clients(make_session(ec2=self.ec2))
+
+    def test_iter_ec2_instances_reads_every_page(self):
+        ids = [i['InstanceId'] for i in self.module.iter_ec2_instances()]
+        self.assertEqual(ids, ['i-1', 'i-2', 'i-3'])
+        self.ec2.get_paginator.assert_called_once_with('describe_instances')
+
+    def test_filters_are_sent_server_side(self):
+        filters = self.module.build_instance_filters(
+            states=['running'], tags={'env': 'prod'},
+            with_instance_profile=True
+        )
+        list(self.module.iter_ec2_instances(filters))
+
+        self.assertEqual(filters, [
+            {'Name': 'instance-state-name', 'Values': ['running']},
+            {'Name': 'tag:env', 'Values': ['prod']},
+            {'Name': 'iam-instance-profile.arn', 'Values': ['*']},
+        ])
+        kwargs = self.ec2.get_paginator.return_value.paginate.call_args[1]
+        self.assertEqual(kwargs['Filters'], filters)
+
+    def test_main_scans_inventory_once(self):
+        with patch.object(self.module, 'authenticate_aws',
+                          return_value=make_session(ec2=self.ec2)):
+            self.module.main([])
+
+        self.ec2.get_paginator.return_value.paginate.assert_called_once()
+        self.ec2.describe_instances.assert_not_called()
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,36 +1,423 @@
+import argparse
+import contextlib
+import os
 import re
+import socket
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
 import requests
+from requests.adapters import HTTPAdapter
+
+from common import metrics
+from url_cache import URLCache
+
+# Checker defaults: total concurrent requests, concurrent requests per host
+# and per-request timeout in seconds
+MAX_WORKERS = 32
+PER_HOST_LIMIT = 4
+TIMEOUT = 10
+
+# Status codes meaning the server does not support HEAD, retried with GET
+HEAD_UNSUPPORTED = {405, 501}
+
+# Number of hosts whose connection pools are kept open
+HOST_POOLS = 256
+
+# Requests per second started against the same host (0: no limit)
+HOST_RATE = 10
+
+# URLs read ahead per worker, so that URLs of the same host are grouped
+# and scheduled round-robin across hosts
+READ_AHEAD = 8
+
+# Throttled requests are retried after the Retry-After delay (capped),
+# or after a doubling backoff when a 429 response has none
+RETRY_STATUSES = {429, 503}
+RETRY_LIMIT = 3
+RETRY_BACKOFF = 1.0
+MAX_RETRY_AFTER = 60.0
+
+# Seconds a DNS resolution is reused
+DNS_TTL = 300
+
+# Regular expression to find URLs
+URL_PATTERN = re.compile(r'https?://[^\s]+')
+
+# Streaming extraction: characters read per chunk, longest text carried
+# over between chunks and how many recent URLs are remembered for dedup
+CHUNK_SIZE = 1024 * 1024
+MAX_CARRY = 64 * 1024
+SEEN_LIMIT = 100000
+
+
+# Set remembering only the most recently added items
+class BoundedSet:
+    def __init__(self, limit):
+        self.limit = limit
+        self.items = OrderedDict()
+
+    def add(self, item):
+        """Add item and return True if it was not already present."""
+        if item in self.items:
+            self.items.move_to_end(item)
+            return False
+        self.items[item] = None
+        if len(self.items) > self.limit:
+            self.items.popitem(last=False)
+        return True
+
+
+# Split text at its last whitespace: the part after it may be a URL that
+# continues in the next chunk
+def split_carry(text):
+    for index in range(len(text) - 1, -1, -1):
+        if text[index].isspace():
+            return text[:index + 1], text[index + 1:]
+    if len(text) > MAX_CARRY:
+        return text, ''
+    return '', text
+
+
+# Yield unique URLs from the file as it is read, chunk by chunk
+def iter_urls(file_path, chunk_size=CHUNK_SIZE, seen_limit=SEEN_LIMIT):
+    seen = BoundedSet(seen_limit)
+    carry = ''
+    with open(file_path, 'r', errors='replace') as file:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+            text, carry = split_carry(carry + chunk)
+            for url in URL_PATTERN.findall(text):
+                if seen.add(url):
+                    yield url
+    for url in URL_PATTERN.findall(carry):
+        if seen.add(url):
+            yield url
+
 
 # Extract URLs from the file
 def extract_urls(file_path):
-    with open(file_path, 'r') as file:
-        content = file.read()
-    # Regular expression to find URLs
-    urls = re.findall(r'https?://[^\s]+', content)
-    return urls
+    return list(iter_urls(file_path))
+
+
+# Create a requests session keeping up to per_host connections per host,
+# recording every response in the shared call metrics
+def create_http_session(per_host=PER_HOST_LIMIT):
+    session = requests.Session()
+    session.hooks['response'].append(
+        metrics.DEFAULT_METRICS.response_hook('http'))
+    adapter = HTTPAdapter(pool_connections=HOST_POOLS, pool_maxsize=per_host)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+# Cache of name resolutions shared by every connection of a run, so a
+# host is resolved once per ttl instead of once per new connection.
+# urllib3 resolves through socket.getaddrinfo, so installed() replaces
+# it process-wide, for every thread, until the check_urls() generator is
+# exhausted or closed
+class DNSCache:
+    def __init__(self, ttl=DNS_TTL):
+        self.ttl = ttl
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.resolve = socket.getaddrinfo
+
+    def getaddrinfo(self, *args, **kwargs):
+        key = (args, tuple(sorted(kwargs.items())))
+        now = time.monotonic()
+        with self.lock:
+            cached = self.entries.get(key)
+        if cached is not None and now - cached[0] < self.ttl:
+            return cached[1]
+        # Failures are not cached
+        addresses = self.resolve(*args, **kwargs)
+        with self.lock:
+            self.entries[key] = (now, addresses)
+        return addresses
+
+    @contextlib.contextmanager
+    def installed(self):
+        """Route every name lookup of the process through the cache."""
+        original = socket.getaddrinfo
+        self.resolve = original
+        socket.getaddrinfo = self.getaddrinfo
+        try:
+            yield self
+        finally:
+            socket.getaddrinfo = original
+
+
+# Return the host a URL is scheduled under
+def host_of(url):
+    return urlsplit(url).netloc.lower()
+
+
+# URLs waiting for one host, its requests in flight and the earliest
+# time its next request may start
+class HostQueue:
+    def __init__(self):
+        self.jobs = deque()
+        self.active = 0
+        self.ready_at = 0.0
+
+
+# Schedule queued URLs round-robin across hosts, starting a request only
+# when its host is under its concurrency limit, rate and Retry-After delay
+class HostScheduler:
+    def __init__(self, per_host=PER_HOST_LIMIT, host_rate=HOST_RATE):
+        self.per_host = per_host
+        self.interval = 1.0 / host_rate if host_rate else 0.0
+        self.hosts = {}
+        # Hosts with queued URLs, in round-robin order
+        self.order = deque()
+        self.queued = 0
+
+    def add(self, url, job, front=False):
+        """Queue a job for the host of url; retries go to the front."""
+        host = host_of(url)
+        queue = self.hosts.setdefault(host, HostQueue())
+        if not queue.jobs:
+            self.order.append(host)
+        if front:
+            queue.jobs.appendleft(job)
+        else:
+            queue.jobs.append(job)
+        self.queued += 1
+
+    def next_ready(self, now):
+        """Return (host, job) of the next host allowed to start, or None."""
+        for _ in range(len(self.order)):
+            host = self.order[0]
+            self.order.rotate(-1)
+            queue = self.hosts[host]
+            if queue.active >= self.per_host or queue.ready_at > now:
+                continue
+            job = queue.jobs.popleft()
+            if not queue.jobs:
+                # The host was just rotated to the end
+                self.order.pop()
+            queue.active += 1
+            queue.ready_at = max(queue.ready_at, now) + self.interval
+            self.queued -= 1
+            return host, job
+        return None
+
+    def release(self, host, now, delay=0.0):
+        """Record a finished request, deferring the host by delay."""
+        queue = self.hosts[host]
+        queue.active -= 1
+        queue.ready_at = max(queue.ready_at, now + delay)
+        if not queue.jobs and not queue.active and queue.ready_at <= now:
+            del self.hosts[host]
+
+    def wakeup(self, now):
+        """Return the seconds until a deferred host may start, or None."""
+        delays = [self.hosts[host].ready_at - now for host in self.order
+                  if self.hosts[host].active < self.per_host]
+        return max(min(delays), 0.0) if delays else None
+
+
+# Return the seconds to wait before retrying a throttled response, or
+# None when it is not throttled
+def retry_delay(status, headers, attempt):
+    if status not in RETRY_STATUSES:
+        return None
+    value = headers.get('Retry-After')
+    if value is None:
+        if status != 429:
+            return None
+        delay = RETRY_BACKOFF * 2 ** attempt
+    elif value.strip().isdigit():
+        delay = float(value)
+    else:
+        try:
+            delay = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(delay, 0.0), MAX_RETRY_AFTER)
+
+
+# Fetch one URL: HEAD first, GET when HEAD is not supported.
+# Returns the status (or error text) and the response headers
+def fetch_response(session, url, timeout=TIMEOUT, headers=None):
+    method = 'HEAD'
+    started = time.monotonic()
+    try:
+        response = session.head(url, timeout=timeout, allow_redirects=True,
+                                headers=headers)
+        if response.status_code in HEAD_UNSUPPORTED:
+            method = 'GET'
+            started = time.monotonic()
+            # stream=True stops requests from downloading the body
+            with session.get(url, timeout=timeout, stream=True,
+                             headers=headers) as response:
+                return response.status_code, response.headers
+        return response.status_code, response.headers
+    except requests.RequestException as e:
+        # Failed requests never reach the response hook
+        metrics.DEFAULT_METRICS.observe_call(
+            'http', method, time.monotonic() - started, error=True)
+        return str(e), {}
+
+
+# Fetch the status of one URL
+def fetch_status(session, url, timeout=TIMEOUT):
+    return fetch_response(session, url, timeout)[0]
+
+
+# Record a check in the cache; 304 means the cached status still applies.
+# Throttling and server errors are transient, so they are not cached
+def update_cache(cache, url, status, headers, entry):
+    etag = headers.get('ETag')
+    last_modified = headers.get('Last-Modified')
+    if status == 304 and entry is not None:
+        status = entry.status
+        etag = etag or entry.etag
+        last_modified = last_modified or entry.last_modified
+    if (isinstance(status, int) and status < 500
+            and status not in RETRY_STATUSES):
+        cache.put(url, status, etag, last_modified)
+    return status
+
+
+# Check URLs concurrently, yielding (url, status) as each one completes.
+# URLs read ahead are grouped by host and started round-robin across
+# hosts, so a host's requests reuse its warm connections while no single
+# host is hammered; throttled requests are retried after Retry-After.
+# With a cache, fresh results are reused and stale ones revalidated
+def check_urls(urls, max_workers=MAX_WORKERS, per_host=PER_HOST_LIMIT,
+               timeout=TIMEOUT, cache=None, host_rate=HOST_RATE):
+    scheduler = HostScheduler(per_host, host_rate)
+    # Read a bounded number of URLs ahead so input is consumed lazily
+    read_ahead = max_workers * READ_AHEAD
+    urls = iter(urls)
+    exhausted = False
+    # Future -> (host, (url, cache entry, attempt))
+    pending = {}
+
+    with DNSCache().installed(), create_http_session(per_host) as session, \
+            ThreadPoolExecutor(max_workers=max_workers) as pool:
+
+        def check(url, entry):
+            headers = cache.validators(entry) if entry else None
+            return fetch_response(session, url, timeout, headers)
+
+        while True:
+            while not exhausted and scheduler.queued < read_ahead:
+                url = next(urls, None)
+                if url is None:
+                    exhausted = True
+                    break
+                entry = cache.get(url) if cache is not None else None
+                if entry is not None and cache.is_fresh(entry):
+                    yield url, entry.status
+                    continue
+                scheduler.add(url, (url, entry, 0))
+
+            now = time.monotonic()
+            while len(pending) < max_workers:
+                ready = scheduler.next_ready(now)
+                if ready is None:
+                    break
+                host, (url, entry, attempt) = ready
+                future = pool.submit(check, url, entry)
+                pending[future] = ready
+
+            if not pending:
+                if not scheduler.queued:
+                    if exhausted:
+                        return
+                    continue
+                # Every queued host is waiting out its rate or Retry-After
+                time.sleep(scheduler.wakeup(now) or 0.0)
+                continue
+
+            # With every worker busy only a finished request frees a slot;
+            # otherwise also wake up when a deferred host may start
+            timeout = None
+            if len(pending) < max_workers:
+                timeout = scheduler.wakeup(now)
+            done, _ = wait(pending, timeout=timeout,
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                host, (url, entry, attempt) = pending.pop(future)
+                status, headers = future.result()
+                delay = retry_delay(status, headers, attempt)
+                if delay is not None and attempt < RETRY_LIMIT:
+                    scheduler.add(url, (url, entry, attempt + 1), front=True)
+                    scheduler.release(host, time.monotonic(), delay)
+                    continue
+                scheduler.release(host, time.monotonic())
+                if cache is not None:
+                    status = update_cache(cache, url, status, headers, entry)
+                yield url, status
+
+
+# Print URLs as they are located while passing them on to the checker
+def report_located(urls):
+    for url in urls:
+        print(f"Located URL: {url}", flush=True)
+        yield url
+
 
 # Fetch content and return HTTP error codes
 def fetch_http_codes(urls):
-    results = {}
-    for url in urls:
-        try:
-            response = requests.get(url, timeout=10)
-            results[url] = response.status_code
-        except requests.RequestException as e:
-            results[url] = str(e)
-    return results
+    return dict(check_urls(urls))
+
 
 # Main execution
-file_path = '/home/denis/Documentos/Projetos/python/globant-challenge/file.txt'
-urls = extract_urls(file_path)
-
-# Print located URLs
-print("Located URLs:")
-for url in urls:
-    print(url)
-
-# Fetch and print HTTP error codes
-http_results = fetch_http_codes(urls)
-print("\nHTTP Error Codes:")
-for url, status in http_results.items():
-    print(f"{url}: {status}")
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Extract URLs from a file and report their HTTP status."
+    )
+    parser.add_argument(
+        'file_path', nargs='?',
+        default=os.path.join(os.path.dirname(__file__), 'file.txt'),
+        help="File to extract URLs from (default: file.txt next to the script)"
+    )
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS,
+                        help="Concurrent requests overall")
+    parser.add_argument('--per-host', type=int, default=PER_HOST_LIMIT,
+                        help="Concurrent requests per host")
+    parser.add_argument('--host-rate', type=float, default=HOST_RATE,
+                        help="Requests started per second per host "
+                             "(0: no limit)")
+    parser.add_argument('--timeout', type=float, default=TIMEOUT,
+                        help="Per-request timeout in seconds")
+    parser.add_argument('--cache',
+                        help="SQLite file caching results between runs")
+    parser.add_argument('--cache-ttl', type=float, default=86400,
+                        help="Seconds a cached result is reused as is")
+    parser.add_argument('--cache-size', type=int, default=100000,
+                        help="Maximum number of cached URLs")
+    metrics.add_metrics_arguments(parser)
+    args = parser.parse_args(argv)
+
+    cache = None
+    if args.cache:
+        cache = URLCache(args.cache, args.cache_ttl, args.cache_size)
+
+    try:
+        # Fetching starts while the file is still being scanned
+        urls = report_located(iter_urls(args.file_path))
+
+        # Fetch and print HTTP error codes as they complete
+        for url, status in check_urls(urls, args.workers, args.per_host,
+                                      args.timeout, cache, args.host_rate):
+            print(f"HTTP status {url}: {status}", flush=True)
+    finally:
+        if cache is not None:
+            cache.close()
+        metrics.report_from_args(args, metrics.DEFAULT_METRICS)
+
+
+if __name__ == '__main__':
+    main()
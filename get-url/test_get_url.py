@@ -0,0 +1,273 @@
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+import requests
+
+import get_url
+from url_cache import URLCache
+
+
+def make_response(status_code):
+    response = MagicMock()
+    response.status_code = status_code
+    response.__enter__.return_value = response
+    return response
+
+
+class TestIterUrls(unittest.TestCase):
+
+    def write(self, content):
+        handle, path = tempfile.mkstemp(suffix='.txt')
+        with os.fdopen(handle, 'w') as file:
+            file.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_urls_spanning_chunks_are_kept_whole(self):
+        path = self.write("see https://example.com/a/long/path and "
+                          "http://other.example/x\nend")
+
+        for chunk_size in (1, 3, 7, 1024):
+            self.assertEqual(
+                list(get_url.iter_urls(path, chunk_size=chunk_size)),
+                ['https://example.com/a/long/path', 'http://other.example/x']
+            )
+
+    def test_duplicates_are_dropped(self):
+        path = self.write("http://a/ http://b/ http://a/ http://b/")
+
+        self.assertEqual(get_url.extract_urls(path),
+                         ['http://a/', 'http://b/'])
+
+    def test_bounded_set_forgets_oldest(self):
+        seen = get_url.BoundedSet(2)
+        self.assertTrue(seen.add('a'))
+        self.assertTrue(seen.add('b'))
+        self.assertFalse(seen.add('a'))
+        self.assertTrue(seen.add('c'))
+        self.assertTrue(seen.add('b'))
+
+
+class TestFetchStatus(unittest.TestCase):
+
+    def test_head_is_used_first(self):
+        session = MagicMock()
+        session.head.return_value = make_response(200)
+
+        self.assertEqual(get_url.fetch_status(session, 'http://a/'), 200)
+        session.get.assert_not_called()
+
+    def test_get_fallback_when_head_unsupported(self):
+        session = MagicMock()
+        session.head.return_value = make_response(405)
+        session.get.return_value = make_response(404)
+
+        self.assertEqual(get_url.fetch_status(session, 'http://a/'), 404)
+        self.assertTrue(session.get.call_args[1]['stream'])
+
+    def test_errors_are_reported_as_text(self):
+        session = MagicMock()
+        session.head.side_effect = requests.ConnectionError("refused")
+
+        self.assertEqual(get_url.fetch_status(session, 'http://a/'),
+                         "refused")
+
+
+class TestCheckUrls(unittest.TestCase):
+
+    def test_per_host_limit(self):
+        lock = threading.Lock()
+        running = {'now': 0, 'max': 0}
+
+        def fake_fetch(session, url, timeout, headers):
+            with lock:
+                running['now'] += 1
+                running['max'] = max(running['max'], running['now'])
+            time.sleep(0.01)
+            with lock:
+                running['now'] -= 1
+            return 200, {}
+
+        urls = [f'http://same.example/{n}' for n in range(12)]
+        with patch.object(get_url, 'fetch_response',
+                          side_effect=fake_fetch):
+            results = dict(get_url.check_urls(urls, max_workers=8,
+                                              per_host=2))
+
+        self.assertEqual(set(results), set(urls))
+        self.assertLessEqual(running['max'], 2)
+
+    def test_results_stream_before_input_is_exhausted(self):
+        consumed = []
+
+        def urls():
+            for n in range(100):
+                consumed.append(n)
+                yield f'http://host{n}.example/'
+
+        with patch.object(get_url, 'fetch_response',
+                          return_value=(200, {})):
+            first = next(get_url.check_urls(urls(), max_workers=2))
+
+        self.assertEqual(first[1], 200)
+        self.assertLess(len(consumed), 100)
+
+    def test_hosts_are_scheduled_round_robin(self):
+        started = []
+
+        def fake_fetch(session, url, timeout, headers):
+            started.append(url)
+            return 200, {}
+
+        urls = ['http://a.example/1', 'http://a.example/2',
+                'http://a.example/3', 'http://b.example/1']
+        with patch.object(get_url, 'fetch_response', side_effect=fake_fetch):
+            list(get_url.check_urls(urls, max_workers=1, host_rate=0))
+
+        self.assertEqual(started[:2], ['http://a.example/1',
+                                       'http://b.example/1'])
+
+    def test_throttled_requests_are_retried_after_retry_after(self):
+        responses = [(429, {'Retry-After': '0'}), (200, {})]
+
+        with patch.object(get_url, 'fetch_response',
+                          side_effect=responses) as fetch:
+            results = list(get_url.check_urls(['http://a.example/']))
+
+        self.assertEqual(results, [('http://a.example/', 200)])
+        self.assertEqual(fetch.call_count, 2)
+
+    def test_busy_workers_block_instead_of_polling(self):
+        def slow_fetch(session, url, timeout, headers):
+            time.sleep(0.05)
+            return 200, {}
+
+        urls = [f'http://host{n % 20}.example/{n}' for n in range(60)]
+        with patch.object(get_url, 'fetch_response', side_effect=slow_fetch), \
+                patch.object(get_url, 'wait', wraps=get_url.wait) as waits:
+            results = dict(get_url.check_urls(urls, max_workers=4))
+
+        self.assertEqual(len(results), 60)
+        # About one wake-up per finished request, not a spin
+        self.assertLess(waits.call_count, 120)
+
+    def test_retries_are_bounded(self):
+        with patch.object(get_url, 'fetch_response',
+                          return_value=(503, {'Retry-After': '0'})) as fetch:
+            results = list(get_url.check_urls(['http://a.example/']))
+
+        self.assertEqual(results, [('http://a.example/', 503)])
+        self.assertEqual(fetch.call_count, get_url.RETRY_LIMIT + 1)
+
+
+class TestHostScheduler(unittest.TestCase):
+
+    def test_host_rate_spaces_requests(self):
+        scheduler = get_url.HostScheduler(per_host=4, host_rate=2)
+        for n in range(2):
+            scheduler.add(f'http://a/{n}', n)
+
+        self.assertEqual(scheduler.next_ready(100.0), ('a', 0))
+        self.assertIsNone(scheduler.next_ready(100.0))
+        self.assertEqual(scheduler.wakeup(100.0), 0.5)
+        self.assertEqual(scheduler.next_ready(100.5), ('a', 1))
+
+    def test_retry_after_defers_the_host(self):
+        scheduler = get_url.HostScheduler(per_host=1, host_rate=0)
+        scheduler.add('http://a/', 'job')
+        host, job = scheduler.next_ready(0.0)
+        scheduler.add('http://a/', job, front=True)
+        scheduler.release(host, 0.0, delay=30)
+
+        self.assertIsNone(scheduler.next_ready(10.0))
+        self.assertEqual(scheduler.next_ready(30.0), ('a', 'job'))
+
+    def test_retry_delay(self):
+        self.assertEqual(get_url.retry_delay(429, {'Retry-After': '5'}, 0),
+                         5.0)
+        self.assertEqual(get_url.retry_delay(429, {}, 2),
+                         get_url.RETRY_BACKOFF * 4)
+        self.assertEqual(get_url.retry_delay(
+            503, {'Retry-After': 'Mon, 01 Jan 2024 00:00:00 GMT'}, 0), 0.0)
+        self.assertIsNone(get_url.retry_delay(503, {}, 0))
+        self.assertIsNone(get_url.retry_delay(200, {}, 0))
+
+
+class TestDNSCache(unittest.TestCase):
+
+    def test_resolutions_are_reused_within_ttl(self):
+        resolve = MagicMock(return_value=['address'])
+        with patch('socket.getaddrinfo', resolve):
+            with get_url.DNSCache().installed():
+                for _ in range(3):
+                    addresses = socket.getaddrinfo('a.example', 443)
+            restored = socket.getaddrinfo
+
+        self.assertEqual(addresses, ['address'])
+        resolve.assert_called_once_with('a.example', 443)
+        self.assertIs(restored, resolve)
+
+
+class TestURLCache(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(handle)
+        self.addCleanup(os.remove, self.path)
+
+    def test_fresh_entries_skip_the_request(self):
+        with URLCache(self.path) as cache:
+            cache.put('http://a/', 200)
+
+        with URLCache(self.path) as cache, \
+                patch.object(get_url, 'fetch_response') as fetch:
+            results = list(get_url.check_urls(['http://a/'], cache=cache))
+
+        self.assertEqual(results, [('http://a/', 200)])
+        fetch.assert_not_called()
+
+    def test_stale_entries_are_revalidated(self):
+        with URLCache(self.path, ttl=0) as cache:
+            cache.put('http://a/', 404, etag='"v1"',
+                      last_modified='Mon, 01 Jan 2024 00:00:00 GMT')
+            with patch.object(get_url, 'fetch_response',
+                              return_value=(304, {})) as fetch:
+                results = list(get_url.check_urls(['http://a/'],
+                                                  cache=cache))
+
+        self.assertEqual(results, [('http://a/', 404)])
+        self.assertEqual(fetch.call_args[0][3], {
+            'If-None-Match': '"v1"',
+            'If-Modified-Since': 'Mon, 01 Jan 2024 00:00:00 GMT',
+        })
+
+    def test_transient_errors_are_not_cached(self):
+        with URLCache(self.path) as cache:
+            for status in (404, 429, 500, 503):
+                get_url.update_cache(cache, f'http://a/{status}', status,
+                                     {}, None)
+
+            self.assertEqual(cache.get('http://a/404').status, 404)
+            for status in (429, 500, 503):
+                self.assertIsNone(cache.get(f'http://a/{status}'))
+
+    def test_size_cap_drops_least_recently_used(self):
+        with URLCache(self.path, max_entries=2) as cache:
+            for url in ('http://a/', 'http://b/', 'http://c/'):
+                cache.put(url, 200)
+                time.sleep(0.001)
+            cache.get('http://a/')
+            cache.prune()
+
+            self.assertIsNotNone(cache.get('http://a/'))
+            self.assertIsNone(cache.get('http://b/'))
+            self.assertIsNotNone(cache.get('http://c/'))
+
+
+if __name__ == '__main__':
+    unittest.main()
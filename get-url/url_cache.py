@@ -0,0 +1,86 @@
+import sqlite3
+import time
+from collections import namedtuple
+
+# Cached outcome of a URL check
+CacheEntry = namedtuple(
+    'CacheEntry', ['url', 'status', 'etag', 'last_modified', 'checked_at']
+)
+
+
+# Persistent cache of URL check results, with a TTL and an LRU size cap
+class URLCache:
+    def __init__(self, path, ttl=86400, max_entries=100000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS url_status ('
+            ' url TEXT PRIMARY KEY,'
+            ' status INTEGER NOT NULL,'
+            ' etag TEXT,'
+            ' last_modified TEXT,'
+            ' checked_at REAL NOT NULL,'
+            ' used_at REAL NOT NULL)'
+        )
+        self.connection.execute(
+            'CREATE INDEX IF NOT EXISTS url_status_used_at'
+            ' ON url_status (used_at)'
+        )
+
+    def get(self, url):
+        """Return the CacheEntry of a URL, or None, marking it as used."""
+        row = self.connection.execute(
+            'SELECT url, status, etag, last_modified, checked_at'
+            ' FROM url_status WHERE url = ?', (url,)
+        ).fetchone()
+        if row is None:
+            return None
+        self.connection.execute(
+            'UPDATE url_status SET used_at = ? WHERE url = ?',
+            (time.time(), url)
+        )
+        return CacheEntry(*row)
+
+    def is_fresh(self, entry):
+        """Return True if the entry is recent enough to skip the request."""
+        return time.time() - entry.checked_at < self.ttl
+
+    def validators(self, entry):
+        """Return the conditional request headers for a stale entry."""
+        headers = {}
+        if entry.etag:
+            headers['If-None-Match'] = entry.etag
+        if entry.last_modified:
+            headers['If-Modified-Since'] = entry.last_modified
+        return headers
+
+    def put(self, url, status, etag=None, last_modified=None):
+        """Store the result of a check."""
+        now = time.time()
+        self.connection.execute(
+            'INSERT OR REPLACE INTO url_status'
+            ' (url, status, etag, last_modified, checked_at, used_at)'
+            ' VALUES (?, ?, ?, ?, ?, ?)',
+            (url, status, etag, last_modified, now, now)
+        )
+
+    def prune(self):
+        """Drop the least recently used entries beyond max_entries."""
+        self.connection.execute(
+            'DELETE FROM url_status WHERE url IN ('
+            ' SELECT url FROM url_status ORDER BY used_at DESC'
+            ' LIMIT -1 OFFSET ?)', (self.max_entries,)
+        )
+
+    def close(self):
+        """Prune, commit and close the cache."""
+        self.prune()
+        self.connection.commit()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,8 +1,54 @@
+import argparse
 import boto3
+import functools
 import getpass
+import time
+import weakref
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from common import (checkpoints, daemon, inventory, metrics, plan, results,
+                    runner, sessions, statestore)
+from common.ratelimit import TokenBucket
+
+# Remediation queue defaults: parallel modify calls, modify calls per
+# second, and how often/how long to poll for the changes to apply
+MODIFY_WORKERS = 8
+MODIFY_RATE = 5
+POLL_INTERVAL = 15
+POLL_TIMEOUT = 900
+
+# describe_db_* accept at most 100 identifiers per filter
+POLL_BATCH_SIZE = 100
+
+# A queued change: kind is 'instance' or 'cluster'
+Remediation = namedtuple('Remediation', ['kind', 'identifier'])
+
+# RDS client per session, reused by the service mode between events
+_rds_clients = weakref.WeakKeyDictionary()
+
+# API calls an apply phase may execute from a plan file
+PLAN_OPERATIONS = {('rds', 'modify_db_instance'), ('rds', 'modify_db_cluster')}
+
+# AWS services whose clients a scan builds (see common/startup.py)
+SERVICES = ('rds',)
+
+
+def authenticate_aws(profile=None, role_arn=None, region=None):
+    """
+    Create a session from the default credential chain, a profile or an
+    assumed role, prompting securely only if no credentials are configured.
+    """
+    try:
+        session = sessions.get_session(profile, role_arn, region)
+    except Exception as e:
+        print(f"Error resolving AWS credentials: {e}")
+        return None
+    if session is not None:
+        print(f"Authenticated using configured credentials in region: "
+              f"{session.region_name}")
+        return session
 
-def authenticate_aws():
-    """Prompt the user for AWS credentials and create a session securely."""
     print("Please provide your AWS credentials:")
     aws_access_key_id = input("AWS Access Key ID: ").strip()
     aws_secret_access_key = getpass.getpass("AWS Secret Access Key: ").strip()  # Hide input for sensitive information
@@ -21,43 +67,452 @@ def authenticate_aws():
         print(f"Error authenticating AWS session: {e}")
         return None
 
-def check_and_remove_rds_public_access():
+
+def iter_db_instances(rds_client):
+    """Yield every RDS instance, including Aurora cluster members."""
+    paginator = rds_client.get_paginator('describe_db_instances')
+    for page in paginator.paginate():
+        for db_instance in page['DBInstances']:
+            yield db_instance
+
+
+def iter_db_clusters(rds_client):
+    """Yield every RDS cluster."""
+    paginator = rds_client.get_paginator('describe_db_clusters')
+    for page in paginator.paginate():
+        for db_cluster in page['DBClusters']:
+            yield db_cluster
+
+
+def db_marker(db):
+    """
+    Return the change marker of a DB instance or cluster: its exposure,
+    status and pending modifications, as read from the describe call.
+    """
+    return statestore.make_marker([
+        db.get('PubliclyAccessible'),
+        db.get('DBInstanceStatus', db.get('Status')),
+        db.get('PendingModifiedValues'),
+    ])
+
+
+def check_db_resources(rds_client, markers=None):
+    """
+    Yield (Remediation, publicly_accessible) for every DB and cluster,
+    storing the change marker of each in `markers` when given.
+    """
+    for db_instance in iter_db_instances(rds_client):
+        instance_id = db_instance['DBInstanceIdentifier']
+        if markers is not None:
+            markers[instance_id] = db_marker(db_instance)
+        print(f"Checking RDS instance: {instance_id}")
+
+        if db_instance['PubliclyAccessible']:
+            print(f"Instance {instance_id} is publicly accessible. "
+                  "Queueing public access removal...")
+        else:
+            print(f"Instance {instance_id} is not publicly accessible. "
+                  "No changes needed.")
+        yield (Remediation('instance', instance_id),
+               bool(db_instance['PubliclyAccessible']))
+
+    # Aurora exposure is set on the member instances above; only Multi-AZ
+    # DB clusters report PubliclyAccessible at the cluster level
+    for db_cluster in iter_db_clusters(rds_client):
+        cluster_id = db_cluster['DBClusterIdentifier']
+        if markers is not None:
+            markers[cluster_id] = db_marker(db_cluster)
+        if db_cluster.get('PubliclyAccessible'):
+            print(f"Cluster {cluster_id} is publicly accessible. "
+                  "Queueing public access removal...")
+        yield (Remediation('cluster', cluster_id),
+               bool(db_cluster.get('PubliclyAccessible')))
+
+
+def find_public_resources(rds_client):
+    """Return the Remediation queue of publicly accessible DBs."""
+    return [remediation for remediation, public
+            in check_db_resources(rds_client) if public]
+
+
+def remediation_call(remediation):
+    """Return the modify operation and parameters for a Remediation."""
+    if remediation.kind == 'cluster':
+        return 'modify_db_cluster', {
+            'DBClusterIdentifier': remediation.identifier,
+            'PubliclyAccessible': False,
+            'ApplyImmediately': True,
+        }
+    return 'modify_db_instance', {
+        'DBInstanceIdentifier': remediation.identifier,
+        'PubliclyAccessible': False,
+        'ApplyImmediately': True,
+    }
+
+
+def remove_public_access(rds_client, remediation):
+    """Submit the modification disabling public access for one DB."""
+    operation, params = remediation_call(remediation)
+    getattr(rds_client, operation)(**params)
+
+
+def submit_remediations(rds_client, queue, max_workers=MODIFY_WORKERS,
+                        rate=MODIFY_RATE, errors=None, on_submitted=None):
+    """
+    Submit queued modifications concurrently under a rate limit and
+    return the ones submitted. Failures are recorded in `errors`, a dict
+    of Remediation to exception, when given; on_submitted(remediation) is
+    called as each submission succeeds.
+    """
+    limiter = TokenBucket(rate) if rate else None
+
+    def submit(remediation):
+        if limiter:
+            limiter.acquire()
+        try:
+            remove_public_access(rds_client, remediation)
+            return remediation, None
+        except Exception as e:
+            return remediation, e
+
+    submitted = []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for remediation, error in pool.map(submit, queue):
+            name = f"RDS {remediation.kind}: {remediation.identifier}"
+            if error is not None:
+                print(f"Error removing public access for {name}: {error}")
+                if errors is not None:
+                    errors[remediation] = error
+            else:
+                print(f"Public access removed for {name}")
+                submitted.append(remediation)
+                if on_submitted is not None:
+                    on_submitted(remediation)
+    return submitted
+
+
+def pending_in_batch(rds_client, kind, identifiers):
+    """Return the identifiers of a batch that are not private yet."""
+    if kind == 'cluster':
+        paginator = rds_client.get_paginator('describe_db_clusters')
+        name, key, filter_name = ('DBClusters', 'DBClusterIdentifier',
+                                  'db-cluster-id')
+    else:
+        paginator = rds_client.get_paginator('describe_db_instances')
+        name, key, filter_name = ('DBInstances', 'DBInstanceIdentifier',
+                                  'db-instance-id')
+
+    pending = set(identifiers)
+    filters = [{'Name': filter_name, 'Values': list(identifiers)}]
+    for page in paginator.paginate(Filters=filters):
+        for db in page[name]:
+            if not db.get('PubliclyAccessible') and db.get(
+                    'DBInstanceStatus', db.get('Status')) == 'available':
+                pending.discard(db[key])
+    return pending
+
+
+def wait_for_remediations(rds_client, remediations, interval=POLL_INTERVAL,
+                          timeout=POLL_TIMEOUT):
+    """
+    Poll the submitted modifications in batches of up to 100 identifiers
+    until they are applied. Returns the remediations still pending.
+    """
+    pending = set(remediations)
+    deadline = time.monotonic() + timeout
+    while pending:
+        for kind in ('instance', 'cluster'):
+            identifiers = sorted(r.identifier for r in pending
+                                 if r.kind == kind)
+            for start in range(0, len(identifiers), POLL_BATCH_SIZE):
+                batch = identifiers[start:start + POLL_BATCH_SIZE]
+                still_pending = pending_in_batch(rds_client, kind, batch)
+                for identifier in set(batch) - still_pending:
+                    print(f"Public access change applied for RDS {kind}: "
+                          f"{identifier}")
+                    pending.discard(Remediation(kind, identifier))
+        if not pending or time.monotonic() >= deadline:
+            break
+        time.sleep(interval)
+
+    for remediation in sorted(pending):
+        print(f"Still waiting on RDS {remediation.kind}: "
+              f"{remediation.identifier}")
+    return pending
+
+
+def db_finding(remediation, status, detail=None, target=None):
+    """Return the Finding of a checked DB instance or cluster."""
+    return results.make_finding(
+        'rds', 'rds-public', remediation.identifier, status,
+        dict(detail or {}, kind=remediation.kind), target
+    )
+
+
+def remediate_public_access(session, wait=False, max_workers=MODIFY_WORKERS,
+                            rate=MODIFY_RATE, target=None, store=None,
+                            checkpoint=None):
+    """
+    Find and fix publicly accessible DBs, returning one Finding per DB
+    instance and cluster. With a StateStore, DBs unchanged since the last
+    run are not modified again; with a Checkpoint, DBs done by an
+    interrupted run are not either. Discovery errors are raised rather
+    than printed.
+    """
+    # Create an RDS client from the authenticated session
+    rds_client = session.client('rds')
+
+    markers = {}
+    checked = list(check_db_resources(rds_client, markers))
+    unchanged = {}
+    if store is not None:
+        _, unchanged = store.partition('rds', target, markers)
+        checked = [(remediation, public) for remediation, public in checked
+                   if remediation.identifier not in unchanged]
+        print(f"{len(unchanged)} RDS resources unchanged since the last "
+              f"run.")
+    done = {}
+    if checkpoint is not None:
+        identifiers = [remediation.identifier for remediation, _ in checked]
+        _, done = checkpoint.partition('rds', target, identifiers)
+        checked = [(remediation, public) for remediation, public in checked
+                   if remediation.identifier not in done]
+        print(f"{len(done)} RDS resources done by the interrupted run.")
+
+        def record_submitted(remediation):
+            checkpoint.record('rds', target, [
+                db_finding(remediation, results.REMEDIATED, target=target)
+            ])
+    queue = [remediation for remediation, public in checked if public]
+    errors = {}
+    submitted = submit_remediations(
+        rds_client, queue, max_workers, rate, errors,
+        on_submitted=record_submitted if checkpoint is not None else None
+    )
+    pending = set()
+    if wait and submitted:
+        pending = wait_for_remediations(rds_client, submitted)
+
+    findings = statestore.unchanged_findings('rds', 'rds-public', unchanged,
+                                             target)
+    findings.extend(checkpoints.resumed_findings('rds', 'rds-public', done,
+                                                 target))
+    for remediation, public in checked:
+        if not public:
+            findings.append(db_finding(remediation, results.COMPLIANT,
+                                       target=target))
+        elif remediation in errors:
+            findings.append(db_finding(
+                remediation, results.ERROR,
+                {'error': str(errors[remediation])}, target
+            ))
+        else:
+            findings.append(db_finding(
+                remediation, results.REMEDIATED,
+                {'pending': remediation in pending} if wait else None, target
+            ))
+    if store is not None:
+        store.record_findings(findings, markers)
+    if checkpoint is not None:
+        checkpoint.record('rds', target, findings)
+    return findings
+
+
+def check_and_remove_rds_public_access(session=None, wait=False,
+                                       max_workers=MODIFY_WORKERS,
+                                       rate=MODIFY_RATE, profile=None,
+                                       role_arn=None, region=None,
+                                       writer=None, store=None,
+                                       checkpoint=None):
+    """
+    Remove public access from every publicly accessible RDS instance,
+    returning the identifiers fixed.
+    """
     # Authenticate AWS session
-    session = authenticate_aws()
+    if session is None:
+        session = authenticate_aws(profile, role_arn, region)
     if not session:
         print("AWS authentication failed. Exiting.")
         return
 
-    # Create an RDS client from the authenticated session
-    rds_client = session.client('rds')
-
+    findings = []
     try:
-        # Retrieve all RDS instances
-        response = rds_client.describe_db_instances()
-        db_instances = response['DBInstances']
-
-        for db_instance in db_instances:
-            instance_id = db_instance['DBInstanceIdentifier']
-            publicly_accessible = db_instance['PubliclyAccessible']
-
-            print(f"Checking RDS instance: {instance_id}")
-            
-            if publicly_accessible:
-                print(f"Instance {instance_id} is publicly accessible. Removing public access...")
-
-                # Modify the RDS instance to disable public access
-                rds_client.modify_db_instance(
-                    DBInstanceIdentifier=instance_id,
-                    PubliclyAccessible=False,
-                    ApplyImmediately=True
-                )
+        findings = remediate_public_access(session, wait, max_workers, rate,
+                                           store=store, checkpoint=checkpoint)
+    except Exception as e:
+        print(f"Error: {e}")
+    results.write_findings(writer, findings)
+    return [finding.resource for finding in findings
+            if finding.status == results.REMEDIATED]
+
+
+def scan_target(session, target, writer=None, **options):
+    """Scan one account/region target for the multi-target runner."""
+    findings = remediate_public_access(session, target=target, **options)
+    results.write_findings(writer, findings)
+    return results.summarize(findings)
+
+
+def get_rds_client(session):
+    """Return the cached RDS client of a session, creating it once."""
+    if session not in _rds_clients:
+        _rds_clients[session] = session.client('rds')
+    return _rds_clients[session]
+
+
+def describe_db(rds_client, remediation):
+    """Return the description of one DB instance or cluster."""
+    if remediation.kind == 'cluster':
+        return rds_client.describe_db_clusters(
+            DBClusterIdentifier=remediation.identifier)['DBClusters'][0]
+    return rds_client.describe_db_instances(
+        DBInstanceIdentifier=remediation.identifier)['DBInstances'][0]
 
-                print(f"Public access removed for RDS instance: {instance_id}")
+
+def handle_db_event(session, record, target=None):
+    """Re-check the DB instance or cluster named by a CloudTrail record."""
+    identifier = daemon.request_parameter(record, 'dBInstanceIdentifier')
+    remediation = Remediation('instance', identifier)
+    if identifier is None:
+        identifier = daemon.request_parameter(record, 'dBClusterIdentifier')
+        remediation = Remediation('cluster', identifier)
+    if identifier is None:
+        return []
+
+    rds_client = get_rds_client(session)
+    if not describe_db(rds_client, remediation).get('PubliclyAccessible'):
+        return [db_finding(remediation, results.COMPLIANT, target=target)]
+    if daemon.request_parameter(record, 'publiclyAccessible') is False:
+        # The event is a remediation still being applied, possibly ours;
+        # submitting it again would only trigger another event
+        return [db_finding(remediation, results.REMEDIATED,
+                           {'pending': True}, target)]
+
+    print(f"RDS {remediation.kind} {identifier} is publicly accessible. "
+          "Removing public access...")
+    errors = {}
+    submit_remediations(rds_client, [remediation], rate=0, errors=errors)
+    if remediation in errors:
+        return [db_finding(remediation, results.ERROR,
+                           {'error': str(errors[remediation])}, target)]
+    return [db_finding(remediation, results.REMEDIATED, target=target)]
+
+
+# CloudTrail events that can make a DB instance or cluster public
+EVENT_HANDLERS = {
+    name: handle_db_event for name in (
+        'CreateDBInstance',
+        'ModifyDBInstance',
+        'RestoreDBInstanceFromDBSnapshot',
+        'RestoreDBInstanceToPointInTime',
+        'CreateDBCluster',
+        'ModifyDBCluster',
+        'RestoreDBClusterFromSnapshot',
+        'RestoreDBClusterToPointInTime',
+    )
+}
+
+
+def plan_target(session, target, writer):
+    """Write the changes a scan of one target would make, read-only."""
+    queue = find_public_resources(session.client('rds'))
+    for remediation in queue:
+        operation, params = remediation_call(remediation)
+        writer.write(plan.plan_action(
+            'rds', 'rds', operation, remediation.identifier, params, target
+        ))
+    return len(queue)
+
+
+def collect_inventory(session, target=None):
+    """Return the inventory table of a target's DB instances and clusters."""
+    rds_client = get_rds_client(session)
+    dbs = [
+        (db['DBInstanceIdentifier'], 'instance',
+         bool(db['PubliclyAccessible']), db.get('DBInstanceStatus'))
+        for db in iter_db_instances(rds_client)
+    ]
+    dbs.extend(
+        (db['DBClusterIdentifier'], 'cluster',
+         bool(db.get('PubliclyAccessible')), db.get('Status'))
+        for db in iter_db_clusters(rds_client)
+    )
+    return {'dbs': inventory.make_table(
+        dbs, ('identifier', 'kind', 'publicly_accessible', 'status'), target
+    )}
+
+
+def run(args):
+    """Run the apply, plan, service, multi-target or single account mode."""
+    options = {'wait': args.wait, 'max_workers': args.modify_workers,
+               'rate': args.modify_rate}
+
+    def default_session(region=None):
+        return authenticate_aws(args.profile, args.role_arn,
+                                region or args.region)
+
+    if args.apply:
+        plan.apply_from_args(args, PLAN_OPERATIONS, default_session)
+    elif args.plan:
+        plan.plan_from_args(args, plan_target, default_session)
+    elif args.events or args.queue_url:
+        with results.writer_from_args(args) as writer:
+            daemon.run_from_args(args, EVENT_HANDLERS, default_session,
+                                 writer)
+    else:
+        options['checkpoint'] = checkpoints.checkpoint_from_args(args)
+        writer = results.writer_from_args(args)
+        options['store'] = statestore.store_from_args(args)
+        try:
+            if args.targets:
+                runner.run_from_args(args, functools.partial(
+                    scan_target, writer=writer, **options
+                ))
             else:
-                print(f"Instance {instance_id} is not publicly accessible. No changes needed.")
+                check_and_remove_rds_public_access(
+                    profile=args.profile, role_arn=args.role_arn,
+                    region=args.region, writer=writer, **options
+                )
+        finally:
+            writer.close()
+            if options['store'] is not None:
+                options['store'].close()
+            if options['checkpoint'] is not None:
+                options['checkpoint'].close()
+
+
+def main(argv=None):
+    """Check the configured targets, or a single interactive account."""
+    parser = argparse.ArgumentParser(
+        description="Remove public access from RDS instances."
+    )
+    runner.add_runner_arguments(parser)
+    sessions.add_session_arguments(parser)
+    plan.add_plan_arguments(parser)
+    results.add_output_arguments(parser)
+    statestore.add_state_arguments(parser)
+    checkpoints.add_checkpoint_arguments(parser)
+    parser.add_argument(
+        '--modify-workers', type=int, default=MODIFY_WORKERS,
+        help=f"Parallel modify calls per target (default: {MODIFY_WORKERS})"
+    )
+    parser.add_argument(
+        '--modify-rate', type=float, default=MODIFY_RATE,
+        help=f"Modify calls per second per target (default: {MODIFY_RATE})"
+    )
+    parser.add_argument(
+        '--wait', action='store_true',
+        help="Poll until the submitted modifications have been applied"
+    )
+    daemon.add_daemon_arguments(parser)
+    metrics.add_metrics_arguments(parser)
+    args = parser.parse_args(argv)
+
+    try:
+        run(args)
+    finally:
+        metrics.report_from_args(args, metrics.DEFAULT_METRICS)
 
-    except Exception as e:
-        print(f"Error: {e}")
 
 if __name__ == "__main__":
-    check_and_remove_rds_public_access()
+    main()
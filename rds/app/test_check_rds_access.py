@@ -1,16 +1,47 @@
+import os
+import tempfile
 import unittest
 from unittest.mock import patch, MagicMock
-from check_rds_public_access import authenticate_aws, check_and_remove_rds_public_access
+
+from common import statestore
+from check_rds import (
+    Remediation,
+    authenticate_aws,
+    check_and_remove_rds_public_access,
+    handle_db_event,
+    remediate_public_access,
+    submit_remediations,
+    wait_for_remediations,
+)
+
+
+def make_rds_client(instances, clusters=()):
+    """Return a mock RDS client whose paginators yield the given pages."""
+    pages = {
+        'describe_db_instances': [{'DBInstances': list(instances)}],
+        'describe_db_clusters': [{'DBClusters': list(clusters)}],
+    }
+    client = MagicMock()
+
+    def get_paginator(name):
+        paginator = MagicMock()
+        paginator.paginate.return_value = pages[name]
+        return paginator
+
+    client.get_paginator.side_effect = get_paginator
+    return client
+
 
 class TestCheckAndRemoveRDSPublicAccess(unittest.TestCase):
 
+    @patch('common.sessions.get_session', return_value=None)
     @patch('boto3.session.Session')
-    def test_authenticate_aws(self, mock_boto_session):
+    def test_authenticate_aws(self, mock_boto_session, mock_get_session):
         # Mock the session
         mock_session = MagicMock()
         mock_boto_session.return_value = mock_session
 
-        with patch('builtins.input', side_effect=['fake_key', 'fake_secret', 'us-east-1']), \
+        with patch('builtins.input', side_effect=['fake_key', 'us-east-1']), \
              patch('getpass.getpass', return_value='fake_secret'):
             session = authenticate_aws()
 
@@ -21,30 +52,39 @@ class TestCheckAndRemoveRDSPublicAccess(unittest.TestCase):
             region_name='us-east-1'
         )
 
+    @patch('common.sessions.get_session')
+    def test_authenticate_aws_uses_configured_credentials(self,
+                                                          mock_get_session):
+        with patch('builtins.input') as mock_input:
+            session = authenticate_aws(profile='audit', region='us-east-1')
+
+        self.assertEqual(session, mock_get_session.return_value)
+        mock_get_session.assert_called_once_with('audit', None, 'us-east-1')
+        mock_input.assert_not_called()
+
+    @patch('common.sessions.get_session', return_value=None)
     @patch('boto3.session.Session')
-    def test_rds_public_access_removal(self, mock_boto_session):
+    def test_rds_public_access_removal(self, mock_boto_session,
+                                       mock_get_session):
         # Mock the RDS client and session
         mock_session = MagicMock()
-        mock_rds_client = MagicMock()
         mock_boto_session.return_value = mock_session
-        mock_session.client.return_value = mock_rds_client
 
-        # Mock describe_db_instances response
-        mock_rds_client.describe_db_instances.return_value = {
-            'DBInstances': [
-                {
-                    'DBInstanceIdentifier': 'test-instance-1',
-                    'PubliclyAccessible': True
-                },
-                {
-                    'DBInstanceIdentifier': 'test-instance-2',
-                    'PubliclyAccessible': False
-                }
-            ]
-        }
+        # Mock describe_db_instances pages
+        mock_rds_client = make_rds_client([
+            {
+                'DBInstanceIdentifier': 'test-instance-1',
+                'PubliclyAccessible': True
+            },
+            {
+                'DBInstanceIdentifier': 'test-instance-2',
+                'PubliclyAccessible': False
+            }
+        ])
+        mock_session.client.return_value = mock_rds_client
 
         # Call the function
-        with patch('builtins.input', side_effect=['fake_key', 'fake_secret', 'us-east-1']), \
+        with patch('builtins.input', side_effect=['fake_key', 'us-east-1']), \
              patch('getpass.getpass', return_value='fake_secret'):
             check_and_remove_rds_public_access()
 
@@ -55,8 +95,128 @@ class TestCheckAndRemoveRDSPublicAccess(unittest.TestCase):
             ApplyImmediately=True
         )
 
-        # Verify describe_db_instances was called
-        mock_rds_client.describe_db_instances.assert_called_once()
+        # Verify the instances were read through the paginator
+        mock_rds_client.describe_db_instances.assert_not_called()
+
+    def test_public_clusters_are_remediated(self):
+        mock_rds_client = make_rds_client([], clusters=[
+            {'DBClusterIdentifier': 'multi-az', 'PubliclyAccessible': True},
+            {'DBClusterIdentifier': 'aurora'},
+        ])
+        session = MagicMock()
+        session.client.return_value = mock_rds_client
+
+        remediated = check_and_remove_rds_public_access(session)
+
+        self.assertEqual(remediated, ['multi-az'])
+        mock_rds_client.modify_db_cluster.assert_called_once_with(
+            DBClusterIdentifier='multi-az',
+            PubliclyAccessible=False,
+            ApplyImmediately=True
+        )
+
+    def test_failed_submissions_are_not_reported(self):
+        mock_rds_client = MagicMock()
+
+        def modify_db_instance(DBInstanceIdentifier, **kwargs):
+            if DBInstanceIdentifier == 'bad':
+                raise RuntimeError("InvalidDBInstanceState")
+
+        mock_rds_client.modify_db_instance.side_effect = modify_db_instance
+        queue = [Remediation('instance', name) for name in ('a', 'bad', 'b')]
+
+        submitted = submit_remediations(mock_rds_client, queue, rate=0)
+
+        self.assertEqual([r.identifier for r in submitted], ['a', 'b'])
+
+    def test_status_is_polled_in_batches(self):
+        instances = [{'DBInstanceIdentifier': f'db-{n}',
+                      'PubliclyAccessible': False,
+                      'DBInstanceStatus': 'available'} for n in range(150)]
+        mock_rds_client = make_rds_client(instances)
+        remediations = [Remediation('instance', f'db-{n}')
+                        for n in range(150)]
+
+        pending = wait_for_remediations(mock_rds_client, remediations,
+                                        interval=0)
+
+        self.assertEqual(pending, set())
+        # 150 identifiers are polled with two filtered calls, not 150
+        self.assertEqual(mock_rds_client.get_paginator.call_count, 2)
+
+    def test_findings_cover_every_checked_db(self):
+        mock_rds_client = make_rds_client([
+            {'DBInstanceIdentifier': 'public', 'PubliclyAccessible': True},
+            {'DBInstanceIdentifier': 'locked', 'PubliclyAccessible': True},
+            {'DBInstanceIdentifier': 'private', 'PubliclyAccessible': False},
+        ])
+
+        def modify_db_instance(DBInstanceIdentifier, **kwargs):
+            if DBInstanceIdentifier == 'locked':
+                raise RuntimeError("InvalidDBInstanceState")
+
+        mock_rds_client.modify_db_instance.side_effect = modify_db_instance
+        session = MagicMock()
+        session.client.return_value = mock_rds_client
+
+        findings = remediate_public_access(session, rate=0)
+
+        self.assertEqual(
+            [(f.resource, f.status) for f in findings],
+            [('public', 'remediated'), ('locked', 'error'),
+             ('private', 'compliant')]
+        )
+        self.assertEqual(findings[1].detail,
+                         {'kind': 'instance',
+                          'error': 'InvalidDBInstanceState'})
+
+    def test_state_store_rechecks_remediated_dbs(self):
+        handle, path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        mock_rds_client = make_rds_client([
+            {'DBInstanceIdentifier': 'public', 'PubliclyAccessible': True},
+            {'DBInstanceIdentifier': 'private', 'PubliclyAccessible': False},
+        ])
+        session = MagicMock()
+        session.client.return_value = mock_rds_client
+
+        with statestore.StateStore(path) as store:
+            remediate_public_access(session, rate=0, store=store)
+        # The modification did not hold: the DB is still public
+        with statestore.StateStore(path) as store:
+            findings = remediate_public_access(session, rate=0, store=store)
+
+        self.assertEqual(
+            sorted((f.resource, f.status) for f in findings),
+            [('private', 'unchanged'), ('public', 'remediated')]
+        )
+        self.assertEqual(mock_rds_client.modify_db_instance.call_count, 2)
+
+    def test_pending_remediation_events_are_not_resubmitted(self):
+        mock_rds_client = MagicMock()
+        mock_rds_client.describe_db_instances.return_value = {
+            'DBInstances': [{'DBInstanceIdentifier': 'db',
+                             'PubliclyAccessible': True}]
+        }
+        session = MagicMock()
+        session.client.return_value = mock_rds_client
+        record = {'eventName': 'ModifyDBInstance', 'requestParameters': {
+            'dBInstanceIdentifier': 'db', 'publiclyAccessible': False}}
+
+        pending = handle_db_event(session, record)
+        record['requestParameters']['publiclyAccessible'] = True
+        submitted = handle_db_event(session, record)
+
+        self.assertEqual(pending[0].detail,
+                         {'kind': 'instance', 'pending': True})
+        self.assertEqual(submitted[0].status, 'remediated')
+        mock_rds_client.modify_db_instance.assert_called_once_with(
+            DBInstanceIdentifier='db',
+            PubliclyAccessible=False,
+            ApplyImmediately=True
+        )
+
 
 if __name__ == "__main__":
     unittest.main()
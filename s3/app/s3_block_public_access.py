@@ -1,8 +1,58 @@
+import argparse
 import boto3
+import functools
 import getpass
+import threading
+import weakref
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from common import (checkpoints, daemon, inventory, metrics, plan, results,
+                    runner, sessions)
+
+# Default number of buckets checked in parallel
+BUCKET_WORKERS = 16
+
+# Buckets requested per list_buckets page (the API maximum)
+LIST_BUCKETS_PAGE_SIZE = 10000
+
+# S3 clients of a session by region (None: the session's region); boto3
+# clients are thread-safe, so the bucket check workers share them instead
+# of building a client per call
+_s3_clients = weakref.WeakKeyDictionary()
+
+# Region of each bucket of a session, as returned by list_buckets
+_bucket_regions = weakref.WeakKeyDictionary()
+
+_s3_clients_lock = threading.Lock()
+
+# Block Public Access settings; public access is blocked, for a bucket
+# or for every bucket of the account, only when all of them are True
+BLOCK_SETTINGS = ('BlockPublicAcls', 'IgnorePublicAcls',
+                  'BlockPublicPolicy', 'RestrictPublicBuckets')
+
+# Settings written by disable_s3_public_access
+PUBLIC_ACCESS_BLOCK_CONFIGURATION = {name: True for name in BLOCK_SETTINGS}
+
+# API calls an apply phase may execute from a plan file
+PLAN_OPERATIONS = {('s3', 'put_public_access_block')}
+
+# Outcome of a concurrent bucket check; settings is None when it failed
+BucketCheck = namedtuple('BucketCheck', ['bucket', 'settings', 'error'])
+
+# AWS services whose clients a scan builds (see common/startup.py)
+SERVICES = ('s3', 's3control', 'sts')
+
+
+def authenticate_aws(profile=None, role_arn=None, region=None):
+    """
+    Create a session from the default credential chain, a profile or an
+    assumed role, prompting for credentials only if none are configured.
+    """
+    session = sessions.get_session(profile, role_arn, region)
+    if session is not None:
+        return session
 
-def authenticate_aws():
-    """Prompt the user for AWS credentials and create a session."""
     print("Please provide your AWS credentials:")
     aws_access_key_id = input("AWS Access Key ID: ")
     aws_secret_access_key = getpass.getpass("AWS Secret Access Key: ")
@@ -17,88 +67,441 @@ def authenticate_aws():
     return session
 
 
-def list_s3_buckets(session):
-    """List all S3 buckets."""
-    s3 = session.client('s3')
+def get_s3_client(session, region=None):
+    """Return the cached S3 client of a session and region."""
+    if region == getattr(session, 'region_name', None):
+        region = None
+    with _s3_clients_lock:
+        clients = _s3_clients.setdefault(session, {})
+        s3 = clients.get(region)
+        if s3 is None:
+            if region is None:
+                s3 = session.client('s3')
+            else:
+                s3 = session.client('s3', region_name=region)
+            clients[region] = s3
+        return s3
+
+
+def get_bucket_client(session, bucket_name):
+    """
+    Return the S3 client of a bucket's region, so calls go straight to it
+    instead of being redirected from the session's region.
+    """
+    with _s3_clients_lock:
+        region = _bucket_regions.get(session, {}).get(bucket_name)
+    return get_s3_client(session, region)
+
+
+def list_bucket_entries(session, raise_errors=False):
+    """
+    List all S3 buckets as list_buckets entries (Name, CreationDate,
+    BucketRegion), remembering each bucket's region for its later calls.
+    """
+    s3 = get_s3_client(session)
+    params = {'MaxBuckets': LIST_BUCKETS_PAGE_SIZE}
+    entries = []
     try:
-        response = s3.list_buckets()
-        print("Raw bucket response:", response)  # Debugging
-        print("Response type:", type(response))  # Debugging
-        return [bucket['Name'] for bucket in response['Buckets']]
+        while True:
+            response = s3.list_buckets(**params)
+            entries.extend(response['Buckets'])
+            if not response.get('ContinuationToken'):
+                break
+            params['ContinuationToken'] = response['ContinuationToken']
     except Exception as e:
+        if raise_errors:
+            raise
         print(f"Error listing buckets: {e}")
         return []
 
+    regions = {bucket['Name']: bucket['BucketRegion']
+               for bucket in entries if bucket.get('BucketRegion')}
+    with _s3_clients_lock:
+        _bucket_regions.setdefault(session, {}).update(regions)
+    return entries
+
+
+def list_s3_buckets(session, raise_errors=False):
+    """List all S3 buckets."""
+    return [bucket['Name']
+            for bucket in list_bucket_entries(session, raise_errors)]
+
+
+def print_block_settings(bucket_name, block_settings):
+    """Print the Block Public Access settings of a bucket."""
+    print(f"Block Public Access settings for bucket '{bucket_name}':")
+    for name in BLOCK_SETTINGS:
+        print(f"  {name}: {block_settings.get(name, False)}")
+
 
 def check_block_public_access(session, bucket_name):
     """Check Block Public Access settings for a specific bucket."""
-    s3 = session.client('s3')
+    s3 = get_bucket_client(session, bucket_name)
     try:
         response = s3.get_public_access_block(Bucket=bucket_name)
         block_settings = response['PublicAccessBlockConfiguration']
-        print(f"Block Public Access settings for bucket '{bucket_name}':")
-        print(f"  BlockPublicAcls: {block_settings['BlockPublicAcls']}")
-        print(f"  IgnorePublicAcls: {block_settings['IgnorePublicAcls']}")
-        print(f"  BlockPublicPolicy: {block_settings['BlockPublicPolicy']}")
-        print(f"  RestrictPublicBuckets: {block_settings['RestrictPublicBuckets']}")
+        print_block_settings(bucket_name, block_settings)
         return block_settings
     except Exception as e:
         print(f"Error checking bucket '{bucket_name}': {e}")
         return None
 
 
+def error_code(error):
+    """Return the AWS error code of a botocore ClientError, or None."""
+    return getattr(error, 'response', {}).get('Error', {}).get('Code')
+
+
+def fetch_block_public_access(s3, bucket_name):
+    """Return a BucketCheck for one bucket without printing anything."""
+    try:
+        response = s3.get_public_access_block(Bucket=bucket_name)
+        return BucketCheck(
+            bucket_name, response['PublicAccessBlockConfiguration'], None
+        )
+    except Exception as e:
+        if error_code(e) == 'NoSuchPublicAccessBlockConfiguration':
+            # Nothing is blocked on a bucket without a configuration
+            return BucketCheck(bucket_name, {}, None)
+        return BucketCheck(bucket_name, None, e)
+
+
+def check_buckets(session, buckets, max_workers=BUCKET_WORKERS):
+    """
+    Check Block Public Access for many buckets in parallel.
+    Returns one BucketCheck per bucket, in the order of `buckets`.
+    """
+    def check(bucket_name):
+        return fetch_block_public_access(
+            get_bucket_client(session, bucket_name), bucket_name
+        )
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(check, buckets))
+
+
+def get_account_block_public_access(session, account_id=None):
+    """
+    Return the account-level Block Public Access settings (S3 Control),
+    or None when they are not configured or cannot be read.
+    """
+    try:
+        if account_id is None:
+            account_id = session.client('sts').get_caller_identity()[
+                'Account']
+        response = session.client('s3control').get_public_access_block(
+            AccountId=account_id
+        )
+        return response['PublicAccessBlockConfiguration']
+    except Exception as e:
+        print(f"Account-level Block Public Access not read: {e}")
+        return None
+
+
+def blocks_public_access(settings):
+    """Return True when Block Public Access settings are all enabled."""
+    return settings is not None and all(
+        settings.get(name) is True for name in BLOCK_SETTINGS
+    )
+
+
+def account_blocks_public_access(settings):
+    """Return True when account-level settings cover every bucket."""
+    return blocks_public_access(settings)
+
+
+def public_access_detected(settings):
+    """Return True when the settings call for disable_s3_public_access."""
+    return settings is not None and not blocks_public_access(settings)
+
+
 def disable_s3_public_access(session, bucket_name):
     """
     Disable public access for a specific S3 bucket
     by enabling Block Public Access settings.
+    Returns False if the settings could not be updated.
     """
-    s3 = session.client('s3')
+    s3 = get_bucket_client(session, bucket_name)
     try:
         print(f"Disabling public access for bucket: {bucket_name}")
         s3.put_public_access_block(
             Bucket=bucket_name,
-            PublicAccessBlockConfiguration={
-                'BlockPublicAcls': False,
-                'IgnorePublicAcls': False,
-                'BlockPublicPolicy': False,
-                'RestrictPublicBuckets': False,
-            },
+            PublicAccessBlockConfiguration=PUBLIC_ACCESS_BLOCK_CONFIGURATION,
         )
         print(f"Public access disabled for bucket '{bucket_name}'.")
         print("Updated Block Public Access settings:")
         check_block_public_access(session, bucket_name)
+        return True
     except Exception as e:
         print(f"Error disabling public access for bucket '{bucket_name}': {e}")
+        return False
 
 
-if __name__ == "__main__":
-    # Authenticate AWS session
-    session = authenticate_aws()
+def bucket_finding(result, status, target=None):
+    """Return the Finding of a checked bucket."""
+    if result.error is not None:
+        detail = {'error': str(result.error)}
+    else:
+        detail = {'settings': result.settings}
+    return results.make_finding('s3', 's3-bpa', result.bucket, status,
+                                detail, target)
+
+
+def remediate_bucket(session, result, target=None):
+    """Report a BucketCheck and remediate the bucket if needed."""
+    bucket, settings = result.bucket, result.settings
+    if result.error is not None:
+        print(f"Error checking bucket '{bucket}': {result.error}")
+    else:
+        print_block_settings(bucket, settings)
+    print("-" * 40)
+
+    # Disable public access unless every Block Public Access setting is on
+    if public_access_detected(settings):
+        print(
+            f"Public access detected for bucket '{bucket}'. "
+            f"Disabling public access..."
+        )
+        if disable_s3_public_access(session, bucket):
+            status = results.REMEDIATED
+        else:
+            status = results.ERROR
+        print("-" * 40)
+    elif result.error is not None:
+        status = results.ERROR
+    else:
+        status = results.COMPLIANT
+        print(f"Bucket '{bucket}' already has public access disabled.")
+    return bucket_finding(result, status, target)
 
+
+def scan_buckets(session, max_workers=BUCKET_WORKERS, raise_errors=False,
+                 target=None, checkpoint=None):
+    """
+    Check every bucket and disable public access where it is detected.
+    Buckets covered by account-level Block Public Access need no check.
+    With a Checkpoint, buckets done by an interrupted run are skipped.
+    Returns one Finding per bucket.
+    """
     # List all buckets
-    buckets = list_s3_buckets(session)
+    buckets = list_s3_buckets(session, raise_errors)
+    findings = []
 
+    account_settings = None
     if buckets:
+        account_settings = get_account_block_public_access(
+            session, target.account_id if target else None
+        )
+
+    if buckets and account_blocks_public_access(account_settings):
+        # One S3 Control call stands in for a call per bucket
+        print(f"Account-level Block Public Access covers all "
+              f"{len(buckets)} buckets.")
+        findings.extend(
+            results.make_finding('s3', 's3-bpa', bucket, results.COMPLIANT,
+                                 {'account_settings': account_settings},
+                                 target)
+            for bucket in buckets
+        )
+    elif buckets:
         print("Buckets found:")
         for bucket in buckets:
             print(f"- {bucket}")
 
+        if checkpoint is not None:
+            buckets, done = checkpoint.partition('s3', target, buckets)
+            print(f"{len(done)} buckets done by the interrupted run.")
+            findings.extend(checkpoints.resumed_findings(
+                's3', 's3-bpa', done, target
+            ))
+
         print("\nChecking Block Public Access settings for each bucket:\n")
-        for bucket in buckets:
-            settings = check_block_public_access(session, bucket)
-            print("Settings:", settings)  # Debugging all setting should return all True or all False
-            print("Type:", type(settings))  # Debugging
-            print("-" * 40)
-
-            # Disable public access if any Block Public Access setting is True
-            if settings is not None and any(settings.values()): #Lambda Integraded function
-                print(
-                    f"Public access detected for bucket '{bucket}'. "
-                    f"Disabling public access..."
-                )
-                disable_s3_public_access(session, bucket)
-                print("-" * 40)
-            else:
-                print(f"Bucket '{bucket}' already has public access disabled.")
+        for result in check_buckets(session, buckets, max_workers):
+            finding = remediate_bucket(session, result, target)
+            findings.append(finding)
+            if checkpoint is not None:
+                checkpoint.record('s3', target, [finding])
     else:
         print("No buckets found.")
+    return findings
+
+
+def scan_target(session, target, max_workers=BUCKET_WORKERS, writer=None,
+                store=None, checkpoint=None):
+    """
+    Scan one account target for the multi-target runner. The StateStore
+    is ignored: bucket listings carry no marker of the Block Public Access
+    configuration, so every bucket is checked.
+    """
+    findings = scan_buckets(session, max_workers, raise_errors=True,
+                            target=target, checkpoint=checkpoint)
+    results.write_findings(writer, findings)
+    return results.summarize(findings)
+
+
+def handle_bucket_event(session, record, target=None):
+    """Re-check the bucket named by a CloudTrail record."""
+    bucket = daemon.request_parameter(record, 'bucketName')
+    if not bucket:
+        return []
+    result = fetch_block_public_access(get_s3_client(session), bucket)
+    return [remediate_bucket(session, result, target)]
+
+
+def handle_account_event(session, record, target=None):
+    """
+    Re-check every bucket of the account after a change to its
+    account-level Block Public Access, which the scan relies on to skip
+    the per-bucket checks.
+    """
+    return scan_buckets(session, raise_errors=True, target=target)
+
+
+# CloudTrail events that can change a bucket's Block Public Access. The
+# account-level S3 Control calls are logged as PutPublicAccessBlock and
+# DeletePublicAccessBlock, or with "Account" in the name.
+EVENT_HANDLERS = {
+    'CreateBucket': handle_bucket_event,
+    'PutBucketPublicAccessBlock': handle_bucket_event,
+    'DeleteBucketPublicAccessBlock': handle_bucket_event,
+    'PutPublicAccessBlock': handle_account_event,
+    'DeletePublicAccessBlock': handle_account_event,
+    'PutAccountPublicAccessBlock': handle_account_event,
+    'DeleteAccountPublicAccessBlock': handle_account_event,
+}
+
+
+def plan_target(session, target, writer, max_workers=BUCKET_WORKERS):
+    """Write the changes a scan of one account would make, read-only."""
+    planned = 0
+    buckets = list_s3_buckets(session, raise_errors=True)
+    if buckets and account_blocks_public_access(
+            get_account_block_public_access(
+                session, target.account_id if target else None)):
+        return planned
+    for result in check_buckets(session, buckets, max_workers):
+        if public_access_detected(result.settings):
+            writer.write(plan.plan_action(
+                's3', 's3', 'put_public_access_block', result.bucket,
+                {'Bucket': result.bucket,
+                 'PublicAccessBlockConfiguration':
+                     PUBLIC_ACCESS_BLOCK_CONFIGURATION},
+                target
+            ))
+            planned += 1
+    return planned
+
+
+def collect_inventory(session, target=None, max_workers=BUCKET_WORKERS):
+    """
+    Return the inventory table of an account's buckets and their Block
+    Public Access settings. Under account-level Block Public Access the
+    per-bucket settings are not read, and left empty.
+    """
+    entries = list_bucket_entries(session, raise_errors=True)
+    account_settings = None
+    if entries:
+        account_settings = get_account_block_public_access(
+            session, target.account_id if target else None
+        )
+    account_blocked = account_blocks_public_access(account_settings)
+
+    checks = {}
+    if not account_blocked:
+        names = [bucket['Name'] for bucket in entries]
+        checks = {result.bucket: result
+                  for result in check_buckets(session, names, max_workers)}
+
+    rows = []
+    for bucket in entries:
+        result = checks.get(bucket['Name'])
+        settings = (result.settings if result else None) or {}
+        rows.append(
+            (bucket['Name'], account_blocked)
+            + tuple(settings.get(name) for name in BLOCK_SETTINGS)
+            + (str(result.error) if result and result.error else None,)
+        )
+    table = inventory.make_table(
+        rows, ('bucket', 'account_blocked', 'block_public_acls',
+               'ignore_public_acls', 'block_public_policy',
+               'restrict_public_buckets', 'error'),
+        target, regional=False
+    )
+    # Buckets are account-wide; record the region each one lives in
+    table['region'] = [bucket.get('BucketRegion') for bucket in entries]
+    return {'buckets': table}
+
+
+def run(args):
+    """Run the apply, plan, service, multi-target or single account mode."""
+    def default_session(region=None):
+        return authenticate_aws(args.profile, args.role_arn,
+                                region or args.region)
+
+    if args.apply:
+        plan.apply_from_args(args, PLAN_OPERATIONS, default_session)
+        return
+
+    if args.plan:
+        task = functools.partial(plan_target,
+                                 max_workers=args.bucket_workers)
+        plan.plan_from_args(args, task, default_session, account_wide=True)
+        return
+
+    if args.events or args.queue_url:
+        with results.writer_from_args(args) as writer:
+            daemon.run_from_args(args, EVENT_HANDLERS, default_session,
+                                 writer)
+        return
+
+    checkpoint = checkpoints.checkpoint_from_args(args)
+    writer = results.writer_from_args(args)
+    try:
+        if args.targets:
+            # Bucket listing is account-wide, so one region per account is
+            # enough
+            task = functools.partial(scan_target, writer=writer,
+                                     checkpoint=checkpoint,
+                                     max_workers=args.bucket_workers)
+            runner.run_from_args(args, task, account_wide=True)
+            return
+
+        # Authenticate AWS session
+        session = default_session()
+        results.write_findings(
+            writer, scan_buckets(session, args.bucket_workers,
+                                 checkpoint=checkpoint)
+        )
+    finally:
+        writer.close()
+        if checkpoint is not None:
+            checkpoint.close()
+
+
+def main(argv=None):
+    """Check the configured targets, or a single interactive account."""
+    parser = argparse.ArgumentParser(
+        description="Check and update S3 Block Public Access settings."
+    )
+    runner.add_runner_arguments(parser)
+    sessions.add_session_arguments(parser)
+    plan.add_plan_arguments(parser)
+    results.add_output_arguments(parser)
+    checkpoints.add_checkpoint_arguments(parser)
+    parser.add_argument(
+        '--bucket-workers', type=int, default=BUCKET_WORKERS,
+        help=f"Buckets checked in parallel per account "
+             f"(default: {BUCKET_WORKERS})"
+    )
+    daemon.add_daemon_arguments(parser)
+    metrics.add_metrics_arguments(parser)
+    args = parser.parse_args(argv)
+
+    try:
+        run(args)
+    finally:
+        metrics.report_from_args(args, metrics.DEFAULT_METRICS)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,39 @@
+import os
+import tempfile
 import unittest
 from unittest.mock import patch, MagicMock
+
+from common import checkpoints, statestore
 from s3_block_public_access import (
     list_s3_buckets,
     check_block_public_access,
+    check_buckets,
     disable_s3_public_access,
     authenticate_aws,
+    get_s3_client,
+    handle_account_event,
+    handle_bucket_event,
+    scan_target,
 )
 
 
+def make_session(mock_s3, mock_s3control=None):
+    """Return a mock session whose S3 client is mock_s3."""
+    session = MagicMock()
+    clients = {"s3": mock_s3, "s3control": mock_s3control or MagicMock(),
+               "sts": MagicMock()}
+    session.client.side_effect = lambda name, **kwargs: clients[name]
+    return session
+
+
 class TestS3BlockPublicAccess(unittest.TestCase):
+    @patch("common.sessions.get_session", return_value=None)
     @patch("boto3.session.Session")
-    def test_authenticate_aws(self, mock_session):
+    def test_authenticate_aws(self, mock_session, mock_get_session):
         """Test AWS authentication."""
         mock_session.return_value = MagicMock()
-        with patch("builtins.input", side_effect=["fake-key", "fake-secret", "us-east-1"]):
+        with patch("builtins.input", side_effect=["fake-key", "us-east-1"]), \
+                patch("getpass.getpass", return_value="fake-secret"):
             session = authenticate_aws()
             self.assertIsNotNone(session)
             mock_session.assert_called_once_with(
@@ -22,21 +42,18 @@ class TestS3BlockPublicAccess(unittest.TestCase):
                 region_name="us-east-1",
             )
 
-    @patch("boto3.client")
-    def test_list_s3_buckets(self, mock_boto3_client):
+    def test_list_s3_buckets(self):
         """Test listing all S3 buckets."""
         mock_s3 = MagicMock()
         mock_s3.list_buckets.return_value = {
             "Buckets": [{"Name": "test-bucket-1"}, {"Name": "test-bucket-2"}]
         }
-        mock_boto3_client.return_value = mock_s3
 
-        buckets = list_s3_buckets()
+        buckets = list_s3_buckets(make_session(mock_s3))
         self.assertEqual(buckets, ["test-bucket-1", "test-bucket-2"])
         mock_s3.list_buckets.assert_called_once()
 
-    @patch("boto3.client")
-    def test_check_block_public_access(self, mock_boto3_client):
+    def test_check_block_public_access(self):
         """Test checking Block Public Access settings."""
         mock_s3 = MagicMock()
         mock_s3.get_public_access_block.return_value = {
@@ -47,9 +64,10 @@ class TestS3BlockPublicAccess(unittest.TestCase):
                 "RestrictPublicBuckets": True,
             }
         }
-        mock_boto3_client.return_value = mock_s3
 
-        settings = check_block_public_access("test-bucket")
+        settings = check_block_public_access(
+            make_session(mock_s3), "test-bucket"
+        )
         self.assertEqual(
             settings,
             {
@@ -61,31 +79,258 @@ class TestS3BlockPublicAccess(unittest.TestCase):
         )
         mock_s3.get_public_access_block.assert_called_once_with(Bucket="test-bucket")
 
-    @patch("boto3.client")
-    def test_disable_s3_public_access(self, mock_boto3_client):
+    def test_disable_s3_public_access(self):
         """Test disabling public access for a bucket."""
         mock_s3 = MagicMock()
-        mock_boto3_client.return_value = mock_s3
+        session = make_session(mock_s3)
 
         with patch("s3_block_public_access.check_block_public_access") as mock_check_block:
             mock_check_block.return_value = {
-                "BlockPublicAcls": False,
-                "IgnorePublicAcls": False,
-                "BlockPublicPolicy": False,
-                "RestrictPublicBuckets": False,
+                "BlockPublicAcls": True,
+                "IgnorePublicAcls": True,
+                "BlockPublicPolicy": True,
+                "RestrictPublicBuckets": True,
             }
 
-            disable_s3_public_access("test-bucket")
+            disable_s3_public_access(session, "test-bucket")
             mock_s3.put_public_access_block.assert_called_once_with(
                 Bucket="test-bucket",
                 PublicAccessBlockConfiguration={
-                    "BlockPublicAcls": False,
-                    "IgnorePublicAcls": False,
-                    "BlockPublicPolicy": False,
-                    "RestrictPublicBuckets": False,
+                    "BlockPublicAcls": True,
+                    "IgnorePublicAcls": True,
+                    "BlockPublicPolicy": True,
+                    "RestrictPublicBuckets": True,
                 },
             )
-            mock_check_block.assert_called_once_with("test-bucket")
+            mock_check_block.assert_called_once_with(session, "test-bucket")
+
+    def test_s3_client_is_reused(self):
+        """Test that a session builds its S3 client only once."""
+        session = make_session(MagicMock())
+
+        self.assertIs(get_s3_client(session), get_s3_client(session))
+        session.client.assert_called_once_with("s3")
+
+    def test_check_buckets_in_parallel(self):
+        """Test the concurrent check returns structured results in order."""
+        mock_s3 = MagicMock()
+        blocked = {"BlockPublicAcls": True}
+
+        def get_public_access_block(Bucket):
+            if Bucket == "broken":
+                raise RuntimeError("NoSuchPublicAccessBlockConfiguration")
+            return {"PublicAccessBlockConfiguration": blocked}
+
+        mock_s3.get_public_access_block.side_effect = get_public_access_block
+        session = make_session(mock_s3)
+
+        buckets = [f"bucket-{n}" for n in range(20)] + ["broken"]
+        results = check_buckets(session, buckets, max_workers=4)
+
+        self.assertEqual([r.bucket for r in results], buckets)
+        self.assertEqual(results[0].settings, blocked)
+        self.assertIsNone(results[-1].settings)
+        self.assertIsInstance(results[-1].error, RuntimeError)
+        session.client.assert_called_once_with("s3")
+
+    def test_scan_writes_one_finding_per_bucket(self):
+        """Test the scan reports structured findings instead of debug dumps."""
+        mock_s3 = MagicMock()
+        mock_s3.list_buckets.return_value = {
+            "Buckets": [{"Name": "flagged"}, {"Name": "clean"}]
+        }
+
+        def get_public_access_block(Bucket):
+            blocked = Bucket == "clean"
+            return {"PublicAccessBlockConfiguration": {
+                "BlockPublicAcls": True, "IgnorePublicAcls": blocked,
+                "BlockPublicPolicy": blocked,
+                "RestrictPublicBuckets": blocked,
+            }}
+
+        mock_s3.get_public_access_block.side_effect = get_public_access_block
+        writer = MagicMock()
+
+        with patch("builtins.print") as mock_print:
+            summary = scan_target(make_session(mock_s3), None, writer=writer)
+
+        findings = [call[0][0] for call in writer.write.call_args_list]
+        self.assertEqual([(f.resource, f.status) for f in findings],
+                         [("flagged", "remediated"), ("clean", "compliant")])
+        self.assertEqual(summary, {"remediated": 1, "compliant": 1})
+        printed = " ".join(str(call) for call in mock_print.call_args_list)
+        self.assertNotIn("Raw bucket response", printed)
+
+    def test_state_store_does_not_skip_buckets(self):
+        """Test buckets are re-checked: listings carry no BPA marker."""
+        mock_s3 = MagicMock()
+        mock_s3.list_buckets.return_value = {"Buckets": [
+            {"Name": "old", "CreationDate": "2024-01-01"},
+        ]}
+        mock_s3.get_public_access_block.return_value = {
+            "PublicAccessBlockConfiguration": {
+                "BlockPublicAcls": True, "IgnorePublicAcls": True,
+                "BlockPublicPolicy": True, "RestrictPublicBuckets": True,
+            }
+        }
+        handle, path = tempfile.mkstemp(suffix=".db")
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+
+        with statestore.StateStore(path) as store:
+            scan_target(make_session(mock_s3), None, store=store)
+        mock_s3.list_buckets.return_value["Buckets"].append(
+            {"Name": "new", "CreationDate": "2024-02-01"}
+        )
+        mock_s3.get_public_access_block.reset_mock()
+        with statestore.StateStore(path) as store:
+            summary = scan_target(make_session(mock_s3), None, store=store)
+
+        checked = {call[1]["Bucket"]
+                   for call in mock_s3.get_public_access_block.call_args_list}
+        self.assertEqual(checked, {"old", "new"})
+        self.assertEqual(summary, {"compliant": 2})
+
+    def test_bucket_event_rechecks_only_that_bucket(self):
+        """Test the service mode fixes the bucket named by an event."""
+        mock_s3 = MagicMock()
+        mock_s3.get_public_access_block.return_value = {
+            "PublicAccessBlockConfiguration": {
+                "BlockPublicAcls": True, "IgnorePublicAcls": False,
+                "BlockPublicPolicy": False, "RestrictPublicBuckets": False,
+            }
+        }
+        record = {"eventName": "DeleteBucketPublicAccessBlock",
+                  "requestParameters": {"bucketName": "changed"}}
+
+        findings = handle_bucket_event(make_session(mock_s3), record)
+
+        self.assertEqual([(f.resource, f.status) for f in findings],
+                         [("changed", "remediated")])
+        mock_s3.list_buckets.assert_not_called()
+        mock_s3.put_public_access_block.assert_called_once()
+
+    def test_account_event_rechecks_every_bucket(self):
+        """Test removing the account-level block re-checks the buckets."""
+        mock_s3 = MagicMock()
+        mock_s3.list_buckets.return_value = {"Buckets": [
+            {"Name": "a"}, {"Name": "b"},
+        ]}
+        mock_s3.get_public_access_block.return_value = {
+            "PublicAccessBlockConfiguration": {
+                "BlockPublicAcls": True, "IgnorePublicAcls": False,
+                "BlockPublicPolicy": True, "RestrictPublicBuckets": True,
+            }
+        }
+        mock_s3control = MagicMock()
+        mock_s3control.get_public_access_block.return_value = {
+            "PublicAccessBlockConfiguration": {
+                "BlockPublicAcls": False, "IgnorePublicAcls": False,
+                "BlockPublicPolicy": False, "RestrictPublicBuckets": False,
+            }
+        }
+        record = {"eventName": "DeletePublicAccessBlock",
+                  "requestParameters": {"accountId": "111"}}
+        target = MagicMock(account_id="111", region="us-east-1")
+
+        findings = handle_account_event(
+            make_session(mock_s3, mock_s3control), record, target)
+
+        self.assertEqual(sorted((f.resource, f.status) for f in findings),
+                         [("a", "remediated"), ("b", "remediated")])
+        self.assertEqual(mock_s3.put_public_access_block.call_count, 2)
+
+    def test_resumed_scan_skips_buckets_already_done(self):
+        """Test --resume does not re-check or re-fix finished buckets."""
+        mock_s3 = MagicMock()
+        mock_s3.list_buckets.return_value = {"Buckets": [
+            {"Name": "fixed"}, {"Name": "left"},
+        ]}
+        mock_s3.get_public_access_block.return_value = {
+            "PublicAccessBlockConfiguration": {
+                "BlockPublicAcls": True, "IgnorePublicAcls": False,
+                "BlockPublicPolicy": False, "RestrictPublicBuckets": False,
+            }
+        }
+        handle, path = tempfile.mkstemp(suffix=".json")
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        with checkpoints.Checkpoint(path) as checkpoint:
+            checkpoint.record("s3", None, [MagicMock(
+                resource="fixed", status="remediated")])
+
+        with checkpoints.Checkpoint(path, resume=True) as checkpoint:
+            summary = scan_target(make_session(mock_s3), None,
+                                  checkpoint=checkpoint)
+            done = checkpoint.done("s3", None)
+
+        checked = {call[1]["Bucket"]
+                   for call in mock_s3.get_public_access_block.call_args_list}
+        self.assertEqual(checked, {"left"})
+        mock_s3.put_public_access_block.assert_called_once()
+        self.assertEqual(summary, {"remediated": 2})
+        self.assertEqual(done, {"fixed": "remediated", "left": "remediated"})
+
+    def test_bucket_without_configuration_is_blocked(self):
+        """Test a bucket with no Block Public Access config is fixed."""
+        mock_s3 = MagicMock()
+        mock_s3.list_buckets.return_value = {"Buckets": [{"Name": "bare"}]}
+        missing = RuntimeError("NoSuchPublicAccessBlockConfiguration")
+        missing.response = {
+            "Error": {"Code": "NoSuchPublicAccessBlockConfiguration"}}
+        mock_s3.get_public_access_block.side_effect = missing
+
+        with patch("builtins.print"):
+            summary = scan_target(make_session(mock_s3), None)
+
+        self.assertEqual(summary, {"remediated": 1})
+        mock_s3.put_public_access_block.assert_called_once_with(
+            Bucket="bare", PublicAccessBlockConfiguration={
+                "BlockPublicAcls": True, "IgnorePublicAcls": True,
+                "BlockPublicPolicy": True, "RestrictPublicBuckets": True,
+            })
+
+    def test_account_level_block_skips_bucket_checks(self):
+        """Test account-wide Block Public Access covers every bucket."""
+        mock_s3 = MagicMock()
+        mock_s3.list_buckets.return_value = {"Buckets": [
+            {"Name": "a", "BucketRegion": "eu-west-1"}, {"Name": "b"},
+        ]}
+        mock_s3control = MagicMock()
+        mock_s3control.get_public_access_block.return_value = {
+            "PublicAccessBlockConfiguration": {
+                "BlockPublicAcls": True, "IgnorePublicAcls": True,
+                "BlockPublicPolicy": True, "RestrictPublicBuckets": True,
+            }
+        }
+        target = MagicMock(account_id="111", region="us-east-1")
+
+        summary = scan_target(make_session(mock_s3, mock_s3control), target)
+
+        self.assertEqual(summary, {"compliant": 2})
+        mock_s3control.get_public_access_block.assert_called_once_with(
+            AccountId="111")
+        mock_s3.get_public_access_block.assert_not_called()
+
+    def test_bucket_calls_use_the_bucket_region(self):
+        """Test buckets are checked through a client of their region."""
+        regional = {None: MagicMock(), "eu-west-1": MagicMock()}
+        regional[None].list_buckets.return_value = {"Buckets": [
+            {"Name": "local", "BucketRegion": "us-east-1"},
+            {"Name": "remote", "BucketRegion": "eu-west-1"},
+        ]}
+        session = MagicMock(region_name="us-east-1")
+        session.client.side_effect = (
+            lambda name, region_name=None: regional[region_name]
+        )
+
+        buckets = list_s3_buckets(session)
+        check_buckets(session, buckets, max_workers=2)
+
+        regional[None].get_public_access_block.assert_called_once_with(
+            Bucket="local")
+        regional["eu-west-1"].get_public_access_block.assert_called_once_with(
+            Bucket="remote")
 
 
 if __name__ == "__main__":